@@ -1,20 +1,66 @@
 # Example app.py (using Flask) - Added /clear_history route
+import json
 import os
-from flask import Flask, render_template, request, jsonify
+import time
+from flask import Flask, g, render_template, request, jsonify, Response, send_from_directory, stream_with_context
 from pathlib import Path # Make sure Path is imported
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.formparser import parse_form_data
+from werkzeug.utils import secure_filename
 import random # Needed for shuffling (although shuffling happens in JS)
-import traceback # For better error logging
 
 import config
+import content_store
+import context_cache
+import coverage
 import data_manager as dm
 import file_handler as fh
 import gemini_handler as gh
+import generation_planner as planner
+import http_cache
+import ingest
+import job_queue
+import log_utils
+import metrics
+import profiling
+from log_utils import get_logger
+
+logger = get_logger(__name__)
 
 app = Flask(__name__)
+jobs = job_queue.create_job_queue()
+
+HTTP_REQUESTS = metrics.counter("mcq_http_requests_total", "HTTP requests handled.", ("endpoint", "method", "status"))
+HTTP_SECONDS = metrics.histogram("mcq_http_request_seconds", "Time to produce HTTP responses (not the streamed body).", ("endpoint",))
+
+@app.before_request
+def start_request():
+    """Tags everything logged for this request with its id (the client's X-Request-ID, or a new one)."""
+    g.request_id = log_utils.set_request_id(request.headers.get('X-Request-ID'))
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def compress_json(response):
+    """gzip/brotli-encodes large JSON responses for clients that accept it."""
+    return http_cache.compress_response(request, response)
+
+@app.after_request
+def finish_request(response):
+    """Echoes the request id and records request counts and latency per route."""
+    response.headers['X-Request-ID'] = g.get('request_id', '')
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    if 'request_start' in g:
+        HTTP_SECONDS.observe(time.perf_counter() - g.request_start, endpoint=endpoint)
+    return response
+
+# Per-request profiling for admins; without a token no hooks are installed at all
+if config.PROFILING_ADMIN_TOKEN:
+    profiling.install(app)
 
 # Configure Gemini once on startup
 if not gh.configure_gemini():
-    print("CRITICAL: Failed to configure Gemini API on startup.")
+    logger.critical("Failed to configure Gemini API on startup.")
 
 # --- Routes ---
 
@@ -26,112 +72,451 @@ def index():
 
 @app.route('/get_bank', methods=['GET'])
 def get_question_bank():
-    """API endpoint to fetch the question bank for a topic."""
+    """
+    API endpoint to fetch the question bank for a topic.
+    Without paging parameters the whole bank is returned as a list. With any of
+    limit, cursor, sources (repeated, one PDF name each), seed or fields (comma-separated)
+    one page is returned as {"questions", "total", "next_cursor"} (see dm.query_question_bank).
+    """
     topic = request.args.get('topic')
     if not topic:
         return jsonify({"error": "Topic parameter is required"}), 400
-    bank = dm.load_question_bank(topic)
-    # Shuffling will be done in JavaScript before displaying
-    return jsonify(bank)
+    # The ETag changes with the stored bank, so an unchanged bank costs a stat() and a 304
+    etag = http_cache.make_etag("bank", topic, config.QUESTION_BANK_BACKEND, dm.get_bank_stamp(topic),
+                                sorted(request.args.items(multi=True)))
+    if not any(name in request.args for name in ('limit', 'cursor', 'sources', 'seed', 'fields')):
+        return http_cache.cached_json(request, etag, lambda: dm.load_question_bank(topic))
+
+    sources = [name for name in request.args.getlist('sources') if name] or None # PDF names may contain commas
+    fields = [f.strip() for f in request.args.get('fields', '').split(',') if f.strip()] or None
+    unknown = set(fields or ()) - set(dm.BANK_FIELDS)
+    if unknown:
+        return jsonify({"error": f"Unknown field(s): {', '.join(sorted(unknown))}"}), 400
+    try:
+        limit = int(request.args['limit']) if request.args.get('limit') else None
+        if limit is not None and limit <= 0: raise ValueError()
+    except ValueError:
+        return jsonify({"error": "limit must be a positive integer"}), 400
+    if http_cache.matching_etag(request, etag):
+        return http_cache.cached_json(request, etag, None)
+    try:
+        page = dm.query_question_bank(topic, sources=sources, cursor=request.args.get('cursor') or None, limit=limit,
+                                      seed=request.args.get('seed') or None, fields=fields)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return http_cache.cached_json(request, etag, lambda: page)
+
+@app.route('/get_bank_sources', methods=['GET'])
+def get_bank_sources():
+    """API endpoint listing the source PDFs of a topic's questions with question counts (for the quiz filter)."""
+    topic = request.args.get('topic')
+    if not topic:
+        return jsonify({"error": "Topic parameter is required"}), 400
+    etag = http_cache.make_etag("bank_sources", topic, config.QUESTION_BANK_BACKEND, dm.get_bank_stamp(topic))
+    return http_cache.cached_json(request, etag, lambda: dm.get_bank_sources(topic))
 
 @app.route('/get_context_files', methods=['GET'])
 def get_context_files():
-    """API endpoint to list PDF files in the topic's context folder."""
+    """
+    API endpoint to list PDF files in the topic's context folder, with each file's
+    ingestion status ("ready", "pending" or "error", see ingest.py).
+    """
     topic = request.args.get('topic')
     if not topic:
         return jsonify({"error": "Topic parameter is required"}), 400
 
-    context_folder_path = dm.get_context_folder(topic)
-    pdf_files = []
-    if context_folder_path.is_dir():
-        pdf_files = sorted([f.name for f in context_folder_path.glob('*.pdf')])
-    return jsonify({"files": pdf_files})
+    fingerprint = dm.get_context_fingerprint(topic)
+    etag = http_cache.make_etag("context_files", topic, fingerprint, ingest.get_state_stamp(topic))
+    signatures = {f"context/{name}": (size, mtime_ns) for name, size, mtime_ns in fingerprint}
+    return http_cache.cached_json(request, etag, lambda: {"files": sorted(name for name, _, _ in fingerprint),
+                                                          "status": ingest.get_context_file_status(topic, signatures)})
+
+@app.route('/upload_context', methods=['POST'])
+def upload_context():
+    """
+    API endpoint to add PDFs (multipart field "files", topic in the query string) to a topic's context folder.
+    Each file is streamed to disk while being hashed, stored once by content (see content_store.py) and
+    hardlinked into the topic; extraction and indexing start right away as an "ingest" job.
+    """
+    topic = request.args.get('topic')
+    if not topic:
+        return jsonify({"status": "error", "message": "Topic parameter is required"}), 400
+    if topic not in dm.get_available_topics():
+        return jsonify({"status": "error", "message": f"Topic '{topic}' not found."}), 404
+    if request.content_length and request.content_length > config.UPLOAD_MAX_REQUEST_BYTES:
+        return jsonify({"status": "error", "message": f"Upload exceeds the {config.UPLOAD_MAX_REQUEST_BYTES // (1024 * 1024)} MB request limit."}), 413
+
+    uploads = []
+    def stream_factory(total_content_length, content_type, filename, content_length=None):
+        upload = content_store.HashingUpload()
+        uploads.append(upload)
+        return upload
+
+    try:
+        # Parsed here rather than via request.files, so each file part is written through stream_factory
+        _, _, files = parse_form_data(request.environ, stream_factory=stream_factory, silent=False,
+                                      max_content_length=config.UPLOAD_MAX_REQUEST_BYTES, max_form_memory_size=1024 * 1024)
+    except (content_store.UploadTooLarge, RequestEntityTooLarge) as e:
+        for upload in uploads:
+            upload.discard()
+        message = str(e) if isinstance(e, content_store.UploadTooLarge) else "Upload exceeds the request size limit."
+        return jsonify({"status": "error", "message": message}), 413
+    except Exception as e:
+        for upload in uploads:
+            upload.discard()
+        logger.error(f"Error reading upload for topic '{topic}': {e}")
+        return jsonify({"status": "error", "message": f"Could not read the upload: {e}"}), 400
+
+    results, errors = [], []
+    context_folder = dm.get_context_folder(topic)
+    for storage in files.getlist('files'):
+        upload = storage.stream
+        filename = secure_filename(storage.filename or "")
+        if not filename.lower().endswith('.pdf'):
+            errors.append({"file": storage.filename, "error": "Only .pdf files can be uploaded."})
+            upload.discard()
+            continue
+        if not upload.is_pdf():
+            errors.append({"file": storage.filename, "error": "File is not a PDF."})
+            upload.discard()
+            continue
+        try:
+            replaced = (context_folder / filename).exists()
+            stored, deduplicated, changed = content_store.store_upload(upload, context_folder / filename)
+        except OSError as e:
+            upload.discard()
+            logger.error(f"Error storing upload '{filename}' for topic '{topic}': {e}")
+            errors.append({"file": storage.filename, "error": f"Could not store file: {e}"})
+            continue
+        logger.info(f"Upload: {topic}/context/{filename} ({upload.size} bytes, sha256 {upload.sha256[:12]}"
+                    f"{', already stored' if deduplicated else ''}{', unchanged' if not changed else ''})")
+        results.append({"file": filename, "sha256": upload.sha256, "size": upload.size, "deduplicated": deduplicated,
+                        "replaced": replaced and changed, "unchanged": not changed})
+    for upload in uploads: # Parts that were not under "files"
+        if not upload.closed:
+            upload.discard()
+    if any(r["replaced"] for r in results): # The replaced content may now be linked from no topic
+        content_store.collect_garbage()
+
+    job = None
+    if any(not r["unchanged"] for r in results):
+        def run(job):
+            job.update_progress("extracting", 10)
+            summary = ingest.ingest_topic(topic, blocking=True, settle_seconds=0)
+            return {"status": "success", "summary": summary}, 200
+        job = jobs.submit("ingest", topic, run)
+    status_code = 200 if results or not errors else 400
+    return jsonify({"status": "success" if results else "error", "files": results, "errors": errors,
+                    "job_id": job.id if job else None,
+                    "message": f"Uploaded {len(results)} file(s)" + (f", {len(errors)} rejected." if errors else ".")}), status_code
+
+
+@app.route('/coverage', methods=['GET'])
+def get_coverage():
+    """
+    API endpoint reporting how well each context PDF of a topic is covered by its questions
+    (see coverage.get_coverage). chunks=1 adds per-chunk page ranges and counts.
+    """
+    topic = request.args.get('topic')
+    if not topic:
+        return jsonify({"error": "Topic parameter is required"}), 400
+    include_chunks = request.args.get('chunks') == '1'
+    etag = http_cache.make_etag("coverage", topic, config.QUESTION_BANK_BACKEND, dm.get_bank_stamp(topic),
+                                dm.get_context_fingerprint(topic), config.COVERAGE_TARGET_QUESTIONS_PER_CHUNK, include_chunks)
+    return http_cache.cached_json(request, etag, lambda: coverage.get_coverage(topic, include_chunks))
+
+@app.route('/search', methods=['GET'])
+def search_questions():
+    """
+    API endpoint for ranked keyword search over question banks (see dm.search_question_banks).
+    q is the query ("word*" matches a prefix, prefix=1 makes the last word one); topic and sources
+    may be repeated to restrict the search (default: all topics); fields is comma-separated.
+    """
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"error": "q parameter is required"}), 400
+    topics = [name for name in request.args.getlist('topic') if name] or dm.get_available_topics()
+    unknown_topics = set(topics) - set(dm.get_available_topics())
+    if unknown_topics:
+        return jsonify({"error": f"Unknown topic(s): {', '.join(sorted(unknown_topics))}"}), 404
+    fields = [f.strip() for f in request.args.get('fields', '').split(',') if f.strip()] or None
+    unknown = set(fields or ()) - set(dm.BANK_FIELDS)
+    if unknown:
+        return jsonify({"error": f"Unknown field(s): {', '.join(sorted(unknown))}"}), 400
+    try:
+        limit = int(request.args['limit']) if request.args.get('limit') else None
+        if limit is not None and limit <= 0: raise ValueError()
+    except ValueError:
+        return jsonify({"error": "limit must be a positive integer"}), 400
+
+    etag = http_cache.make_etag("search", config.QUESTION_BANK_BACKEND, [(t, dm.get_bank_stamp(t)) for t in topics],
+                                sorted(request.args.items(multi=True)))
+    def run_search():
+        start = time.perf_counter()
+        result = dm.search_question_banks(query, topics=topics, sources=[s for s in request.args.getlist('sources') if s] or None,
+                                          limit=limit, prefix=request.args.get('prefix') == '1', fields=fields)
+        result["took_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        return result
+    return http_cache.cached_json(request, etag, run_search)
 
 
 @app.route('/generate', methods=['POST'])
 def handle_generate():
     """API endpoint to trigger question generation from selected existing PDFs."""
     data = request.json
+    params, error = _parse_generate_request(data)
+    if error:
+        return error
+
+    job_fn = lambda job: run_generation(job, **params)
+    return _enqueue_or_run('generate', params['topic'], job_fn, wait=bool(data.get('wait')))
+
+
+def _parse_generate_request(data: dict):
+    """Validates a /generate or /generate_stream body. Returns (run_generation kwargs, None) or (None, error response)."""
     if not data:
-        return jsonify({"status": "error", "message": "Request body must be JSON"}), 400
+        return None, (jsonify({"status": "error", "message": "Request body must be JSON"}), 400)
 
     topic = data.get('topic')
     num_questions_str = data.get('num_questions')
     selected_files = data.get('selected_files')
+    context_mode = data.get('context_mode', 'full')
 
     # --- Validation ---
-    if not topic: return jsonify({"status": "error", "message": "Topic is missing"}), 400
-    if not num_questions_str: return jsonify({"status": "error", "message": "Number of questions is missing"}), 400
+    if not topic: return None, (jsonify({"status": "error", "message": "Topic is missing"}), 400)
+    if not num_questions_str: return None, (jsonify({"status": "error", "message": "Number of questions is missing"}), 400)
     if not selected_files or not isinstance(selected_files, list) or len(selected_files) == 0:
-         return jsonify({"status": "error", "message": "No context files selected"}), 400
+         return None, (jsonify({"status": "error", "message": "No context files selected"}), 400)
+    if context_mode not in ('full', 'retrieval', 'fill_gaps'):
+        return None, (jsonify({"status": "error", "message": f"Unknown context mode: {context_mode}"}), 400)
 
     try:
         num_questions = int(num_questions_str)
         if num_questions <= 0: raise ValueError()
     except (ValueError, TypeError):
-        return jsonify({"status": "error", "message": "Invalid number of questions"}), 400
+        return None, (jsonify({"status": "error", "message": "Invalid number of questions"}), 400)
 
-    print(f"Received generation request for topic '{topic}', count: {num_questions} from files: {selected_files}")
+    logger.info(f"Received generation request for topic '{topic}', count: {num_questions} from files: {selected_files} (context mode: {context_mode})")
 
-    extracted_text = ""
     context_folder_path = dm.get_context_folder(topic)
 
     if not context_folder_path.is_dir():
-         return jsonify({"status": "error", "message": f"Context folder for topic '{topic}' not found on server."}), 400
+         return None, (jsonify({"status": "error", "message": f"Context folder for topic '{topic}' not found on server."}), 400)
 
     if not fh.PDF_LIB_AVAILABLE:
-         print("PDF library (pypdf) not available.")
-         return jsonify({"status": "error", "message": "PDF processing library not available on server."}), 500
-
+         logger.error("PDF library (pypdf) not available.")
+         return None, (jsonify({"status": "error", "message": "PDF processing library not available on server."}), 500)
+
+    return {"topic": topic, "num_questions": num_questions, "selected_files": selected_files, "context_mode": context_mode,
+            "fresh": bool(data.get('fresh'))}, None
+
+
+def _enqueue_or_run(kind: str, topic: str, job_fn, wait: bool = False):
+    """
+    Queues job_fn as a background job and returns 202 with its id. If wait is set, the request
+    instead blocks until the job has run (still under the queue's caps) and returns its result,
+    unless that takes longer than JOB_WAIT_TIMEOUT_SECONDS.
+    """
+    job = jobs.submit(kind, topic, job_fn)
+    logger.info(f"Queued {kind} job {job.id} for topic '{topic}'")
+    if wait and job.wait(config.JOB_WAIT_TIMEOUT_SECONDS):
+        return jsonify(job.result), job.http_status
+    return jsonify({"status": "queued", "job_id": job.id, "status_url": f"/jobs/{job.id}"}), 202
+
+
+def run_generation(job: job_queue.Job, topic: str, num_questions: int, selected_files: list[str], context_mode: str, fresh: bool = False) -> tuple[dict, int]:
+    """
+    Runs one generation request, fanned out by the generation planner into concurrent
+    Gemini calls over parts of the context. fresh bypasses the Gemini response cache.
+    Returns (response payload, HTTP status).
+    """
     try:
-        for filename in selected_files:
-            if ".." in filename or filename.startswith("/"):
-                 print(f"Warning: Skipping potentially unsafe filename: {filename}")
-                 continue
-
-            file_path = context_folder_path / filename
-            if file_path.is_file() and filename.lower().endswith('.pdf'):
-                print(f"  Reading selected file: {file_path}")
-                try:
-                    from pypdf import PdfReader, errors
-                    reader = PdfReader(file_path)
-                    file_text = ""
-                    for page in reader.pages:
-                        page_text = page.extract_text()
-                        if page_text: file_text += page_text + "\n"
-                    if file_text:
-                        extracted_text += file_text + f"\n--- End of Document: {filename} ---\n\n"
-                        print(f"    Extracted ~{len(file_text)} chars from {filename}.")
-                    else: print(f"    No text extracted from {filename}.")
-                except errors.PdfReadError: print(f"    Warning: Could not read corrupted/encrypted PDF: {filename}")
-                except Exception as e: print(f"    Error reading {filename}: {e}")
-            else: print(f"  Warning: Selected file not found or not a PDF: {filename}")
-
-        if not extracted_text.strip():
-             return jsonify({"status": "error", "message": "Could not extract any text from the selected PDF file(s)."}), 400
-
-        print("Loading current question bank for history...")
-        current_bank = dm.load_question_bank(topic)
-        history_text = dm.format_bank_for_prompt(current_bank, relevant_source_pdfs=selected_files)
-
-        print(f"Sending context ({len(extracted_text)} chars) and history to Gemini...")
-        new_mcqs = gh.generate_new_mcqs(extracted_text, history_text, num_questions)
+        segments, history_text, history_stats = _prepare_generation(job, topic, selected_files, context_mode, num_questions)
+        if not segments:
+             return {"status": "error", "message": "Could not extract any text from the selected PDF file(s)."}, 400
+
+        job.update_progress("calling_gemini", 40)
+        parts = planner.plan_generation(segments, num_questions)
+        logger.info(f"Generating {num_questions} questions in {len(parts)} part(s) "
+                    f"({sum(p['size'] for p in parts)} chars of context) with history...")
+        new_mcqs, plan_stats = planner.generate(parts, history_text, num_questions, bypass_cache=fresh,
+                                                progress=job.update_progress)
 
         if new_mcqs:
-            print(f"Received {len(new_mcqs)} new MCQs from Gemini.")
-            # Tag each new MCQ with the list of PDF files used for its generation
-            for mcq in new_mcqs:
-                mcq['source_pdfs'] = selected_files
-            dm.add_questions_to_bank(topic, new_mcqs)
-            return jsonify({"status": "success", "message": f"Generated and added {len(new_mcqs)} new questions.", "new_questions_count": len(new_mcqs)})
+            logger.info(f"Received {len(new_mcqs)} new MCQs from Gemini.")
+            job.update_progress("saving", 90)
+            # Each MCQ is already tagged (source_pdfs) with the PDF files of the part it was generated from
+            added = dm.add_questions_to_bank(topic, new_mcqs)
+            return {"status": "success", "message": f"Generated and added {added} new questions.", "new_questions_count": added,
+                    "history": history_stats, "plan": plan_stats}, 200
         else:
-            print("No new MCQs were successfully generated or parsed by Gemini.")
-            return jsonify({"status": "success", "message": "Context processed, but no new unique questions were generated by Gemini.", "new_questions_count": 0})
+            logger.warning("No new MCQs were successfully generated or parsed by Gemini.")
+            return {"status": "success", "message": "Context processed, but no new unique questions were generated by Gemini.", "new_questions_count": 0,
+                    "history": history_stats, "plan": plan_stats}, 200
 
+    except gh.GeminiError as e:
+        return _gemini_error_response(e, "generation")
     except Exception as e:
-        print(f"Error during generation process: {e}")
-        traceback.print_exc()
-        return jsonify({"status": "error", "message": f"An internal error occurred: {e}"}), 500
+        logger.exception(f"Error during generation process: {e}")
+        return {"status": "error", "message": f"An internal error occurred: {e}"}, 500
+
+
+def _gemini_error_response(e: gh.GeminiError, during: str) -> tuple[dict, int]:
+    """
+    Response payload and status for a failed Gemini call: 500 if Gemini rejected the request
+    itself (retrying cannot help), 503 if it was unreachable or throttled (worth retrying later).
+    """
+    if isinstance(e, gh.GeminiRequestError):
+        logger.error(f"Gemini rejected the request during {during}: {e}")
+        return {"status": "error", "message": str(e)}, 500
+    logger.warning(f"Gemini unavailable during {during}: {e}")
+    return {"status": "error", "message": f"Gemini is unavailable, please try again shortly: {e}"}, 503
+
+
+def _prepare_generation(job: job_queue.Job, topic: str, selected_files: list[str], context_mode: str, num_questions: int) -> tuple[list[dict], str, dict]:
+    """Loads the history bank and extracts context segments for a generation request. Returns (segments, history text, history stats)."""
+    job.update_progress("loading_bank", 5)
+    logger.info("Loading questions for the selected PDFs for history...")
+    current_bank = dm.load_questions_for_sources(topic, selected_files)
+
+    job.update_progress("extracting", 10)
+    segments = planner.build_segments(topic, selected_files, context_mode, current_bank, num_questions)
+    if not segments:
+        return segments, "", {}
+
+    job.update_progress("building_prompt", 30)
+    history_text, history_stats = dm.build_history_section(current_bank, relevant_source_pdfs=selected_files)
+    logger.info(f"History section: ~{history_stats['estimated_tokens']} tokens ({history_stats['full_examples']} full, "
+                f"{history_stats['digest_questions']} stems, {history_stats['omitted_questions']} omitted)")
+    return segments, history_text, history_stats
+
+
+# --- Streaming Generation ---
+def _sse_event(event: str, data: dict) -> str:
+    """Formats one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.route('/generate_stream', methods=['POST'])
+def handle_generate_stream():
+    """
+    Like /generate, but streams the result as Server-Sent Events: 'status' events while
+    preparing, one 'question' event per MCQ as soon as Gemini finishes writing it (already
+    saved to the bank), and a final 'done' (or 'error') event with counts and timings.
+    The stream takes a slot in the job queue for its whole run, so it is subject to the
+    same global and per-topic caps as /generate; when none is free it returns 429.
+    """
+    params, error = _parse_generate_request(request.json)
+    if error:
+        return error
+    topic, selected_files = params['topic'], params['selected_files']
+    job = jobs.claim('generate_stream', topic)
+    if job is None:
+        return jsonify({"status": "error", "message": f"Another generation is running for topic '{topic}' (or the server is at capacity), please try again shortly."}), \
+            429, {"Retry-After": str(config.STREAM_BUSY_RETRY_AFTER_SECONDS)}
+
+    def events():
+        start = time.perf_counter()
+        outcome = {"http_status": 500, "result": None}
+        try:
+            yield _sse_event("status", {"stage": "extracting"})
+            segments, history_text, history_stats = _prepare_generation(job, topic, selected_files, params['context_mode'],
+                                                                        params['num_questions'])
+            if not segments:
+                outcome["http_status"] = 400
+                yield _sse_event("error", {"message": "Could not extract any text from the selected PDF file(s)."})
+                return
+
+            yield _sse_event("status", {"stage": "calling_gemini", "history": history_stats})
+            received = saved = 0
+            ttfq_ms = None
+            # Parts stream one after another, so each question is tagged with its own part's PDFs as in /generate
+            for part in planner.plan_generation(segments, params['num_questions']):
+                for mcq in gh.stream_new_mcqs(part["context_text"], history_text, part["num_questions"],
+                                              bypass_cache=params['fresh']):
+                    received += 1
+                    mcq['source_pdfs'] = part["files"]
+                    # Saved one at a time so the near-duplicate filter and bank stay current as questions arrive
+                    if not dm.add_questions_to_bank(topic, [mcq]):
+                        continue
+                    saved += 1
+                    if ttfq_ms is None:
+                        ttfq_ms = round((time.perf_counter() - start) * 1000)
+                    yield _sse_event("question", {"index": saved, "question": mcq})
+
+            done = {"message": f"Generated and added {saved} new questions.", "new_questions_count": saved,
+                    "received_count": received, "ttfq_ms": ttfq_ms,
+                    "total_ms": round((time.perf_counter() - start) * 1000), "history": history_stats}
+            outcome.update(http_status=200, result=done)
+            yield _sse_event("done", done)
+        except gh.GeminiError as e:
+            payload, outcome["http_status"] = _gemini_error_response(e, "streamed generation")
+            yield _sse_event("error", {"message": payload["message"]})
+        except Exception as e:
+            logger.exception(f"Error during streamed generation: {e}")
+            yield _sse_event("error", {"message": f"An internal error occurred: {e}"})
+        finally:
+            jobs.finish(job, outcome["http_status"], outcome["result"])
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"} # Stop proxies buffering the stream
+    response = Response(stream_with_context(events()), mimetype='text/event-stream', headers=headers)
+    # Also frees the slot if the client goes away before the stream starts (the generator's finally never runs then)
+    response.call_on_close(lambda: jobs.finish(job, 499))
+    return response
+
+
+@app.route('/stream_stats', methods=['GET'])
+def get_stream_stats():
+    """Reports streaming counters, including Gemini time-to-first-question."""
+    return jsonify(gh.get_stream_stats())
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Stage timings, counters and size histograms in the Prometheus text format (see metrics.py)."""
+    if not config.METRICS_ENABLED:
+        return jsonify({"error": "Metrics are disabled (METRICS_ENABLED=0)"}), 404
+    job_stats = jobs.stats()
+    metrics.gauge("mcq_jobs_queued", "Background jobs waiting to start.").set(job_stats["queued"])
+    metrics.gauge("mcq_jobs_running", "Background jobs running.").set(job_stats["running"])
+    bank_stats = dm.get_bank_cache_stats()
+    metrics.gauge("mcq_bank_cache_bytes", "Estimated size of the in-memory bank cache.").set(bank_stats["estimated_bytes"])
+    cache_events = metrics.gauge("mcq_bank_cache_events", "In-memory bank cache counters since start.", ("event",))
+    for event in ("hits", "misses", "write_throughs", "evictions", "invalidations"):
+        cache_events.set(bank_stats[event], event=event)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/profiles', methods=['GET'])
+def get_profiles():
+    """Admin endpoint listing recent request/job profiles (see profiling.py)."""
+    if not profiling.is_admin(request):
+        return jsonify({"error": "Profiling is disabled or the admin token is missing."}), 403
+    try:
+        limit = int(request.args.get('limit', 20))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    return jsonify({"profiles": profiling.list_profiles(limit), "directory": str(profiling.get_profiles_dir())})
+
+@app.route('/profiles/<path:filename>', methods=['GET'])
+def download_profile(filename):
+    """Admin endpoint serving one saved profile file (.pstats, .collapsed or .json)."""
+    if not profiling.is_admin(request):
+        return jsonify({"error": "Profiling is disabled or the admin token is missing."}), 403
+    return send_from_directory(profiling.get_profiles_dir().resolve(), filename, as_attachment=True)
+
+
+@app.route('/gemini_stats', methods=['GET'])
+def get_gemini_stats():
+    """Reports the Gemini client's retries, failures, rate-limit waits and circuit breaker state, plus per-mode parse stats."""
+    return jsonify({"client": gh.get_client_stats(), "parse": gh.get_parse_stats()})
+
+
+@app.route('/cache_stats', methods=['GET'])
+def get_cache_stats():
+    """Reports Gemini response and context cache and in-memory bank cache hits/misses, and search index sizes."""
+    return jsonify({"gemini_responses": gh.get_cache_stats(), "gemini_contexts": context_cache.get_stats(),
+                    "banks": dm.get_bank_cache_stats(), "search_indexes": dm.get_search_index_stats()})
 
 
 @app.route('/format_examples', methods=['POST'])
@@ -140,25 +525,44 @@ def handle_format_examples():
     topic = data.get('topic')
     if not topic: return jsonify({"status": "error", "message": "Topic is missing"}), 400
 
-    print(f"Received format examples request for topic '{topic}'")
+    logger.info(f"Received format examples request for topic '{topic}'")
+    fresh = bool(data.get('fresh'))
+    return _enqueue_or_run('format_examples', topic, lambda job: run_format_examples(job, topic, fresh), wait=bool(data.get('wait')))
+
+
+def run_format_examples(job: job_queue.Job, topic: str, fresh: bool = False) -> tuple[dict, int]:
+    """Formats the topic's example files into MCQs. Returns (response payload, HTTP status)."""
     try:
+        job.update_progress("reading_examples", 10)
         examples_folder = dm.get_examples_folder(topic)
         example_text = fh.read_text_files_in_folder(str(examples_folder))
         if not example_text or example_text.isspace():
-             return jsonify({"status": "success", "message": "No text found in example files to format.", "formatted_count": 0})
+             return {"status": "success", "message": "No text found in example files to format.", "formatted_count": 0}, 200
 
-        formatted_mcqs = gh.format_examples_to_mcq(example_text)
+        job.update_progress("calling_gemini", 30)
+        formatted_mcqs = gh.format_examples_to_mcq(example_text, bypass_cache=fresh)
         count = len(formatted_mcqs)
         if count > 0:
+            job.update_progress("saving", 90)
             dm.add_questions_to_bank(topic, formatted_mcqs)
-            return jsonify({"status": "success", "message": f"Formatted and added {count} questions from examples.", "formatted_count": count})
+            return {"status": "success", "message": f"Formatted and added {count} questions from examples.", "formatted_count": count}, 200
         else:
-             return jsonify({"status": "success", "message": "Examples processed, but no MCQs were formatted.", "formatted_count": 0})
+             return {"status": "success", "message": "Examples processed, but no MCQs were formatted.", "formatted_count": 0}, 200
 
+    except gh.GeminiError as e:
+        return _gemini_error_response(e, "formatting examples")
     except Exception as e:
-        print(f"Error formatting examples: {e}")
-        traceback.print_exc()
-        return jsonify({"status": "error", "message": f"Error formatting examples: {e}"}), 500
+        logger.exception(f"Error formatting examples: {e}")
+        return {"status": "error", "message": f"Error formatting examples: {e}"}, 500
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """API endpoint to poll a background job's status, progress and (once finished) result."""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": f"Job '{job_id}' not found (it may have expired)."}), 404
+    return jsonify(job.to_dict())
 
 
 @app.route('/add_topic', methods=['POST'])
@@ -168,7 +572,7 @@ def handle_add_topic():
     if not topic_name or topic_name.isspace():
         return jsonify({"status": "error", "message": "Topic name cannot be empty"}), 400
 
-    print(f"Received add topic request for: '{topic_name}'")
+    logger.info(f"Received add topic request for: '{topic_name}'")
     try:
         # Check existence *before* trying to create
         if topic_name in dm.get_available_topics():
@@ -182,8 +586,7 @@ def handle_add_topic():
              # create_topic prints errors, assume failure if not success
              return jsonify({"status": "error", "message": f"Failed to create topic '{topic_name}'. Check server logs."}), 500
     except Exception as e:
-        print(f"Error adding topic: {e}")
-        traceback.print_exc()
+        logger.exception(f"Error adding topic: {e}")
         return jsonify({"status": "error", "message": f"Internal server error adding topic: {e}"}), 500
 
 # --- NEW Endpoint: Clear History ---
@@ -195,7 +598,7 @@ def handle_clear_history():
     if not topic:
         return jsonify({"status": "error", "message": "Topic is missing"}), 400
 
-    print(f"Received request to clear history for topic: '{topic}'")
+    logger.info(f"Received request to clear history for topic: '{topic}'")
 
     # Check if topic exists before trying to clear
     if topic not in dm.get_available_topics():
@@ -204,15 +607,19 @@ def handle_clear_history():
     try:
         # Overwrite the bank with an empty list
         dm.save_question_bank(topic, [])
-        print(f"Successfully cleared question bank for topic: '{topic}'")
+        logger.info(f"Successfully cleared question bank for topic: '{topic}'")
         return jsonify({"status": "success", "message": f"Question history for topic '{topic}' has been cleared."})
     except Exception as e:
-        print(f"Error clearing history for topic '{topic}': {e}")
-        traceback.print_exc()
+        logger.exception(f"Error clearing history for topic '{topic}': {e}")
         # Internal Server Error
         return jsonify({"status": "error", "message": f"An internal error occurred while clearing history: {e}"}), 500
 
 
 if __name__ == '__main__':
+    # Pre-extract and index context PDFs as they arrive, so generation reads cached artifacts.
+    # Started here rather than on import, so tests, the CLIs and every gunicorn worker don't each run one
+    # (and only in the reloader's serving process, not its file-watching parent)
+    if config.INGEST_WATCHER_ENABLED and os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        ingest.start_watcher()
     # Consider setting debug=False for production
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,315 @@
+# bank_store.py
+import json
+import sqlite3
+from contextlib import contextmanager
+from pathlib import Path
+from fs_utils import atomic_write_json, file_lock
+from text_utils import normalize_question_text
+from log_utils import get_logger
+
+logger = get_logger(__name__)
+
+JSON_BANK_FILENAME = "question_bank.json"
+SQLITE_BANK_FILENAME = "question_bank.sqlite3"
+
+# Fields with their own columns/tables in SQLite; anything else goes in the 'extra' JSON column
+_CORE_FIELDS = ("question", "options", "correct_answer", "source_pdfs")
+
+class BankStore:
+    """
+    Storage backend for topic question banks. Every method takes the topic's
+    folder (topics/<topic>) so the store does not need to know about config.
+    """
+    name = "base"
+
+    def load(self, topic_path: Path) -> list[dict]:
+        """Returns all questions in insertion order."""
+        raise NotImplementedError
+
+    def save(self, topic_path: Path, questions: list[dict]):
+        """Replaces the whole bank with questions."""
+        raise NotImplementedError
+
+    def add(self, topic_path: Path, questions: list[dict]) -> list[dict]:
+        """Appends questions whose normalized text is not already in the bank. Returns those added."""
+        return self.add_stamped(topic_path, questions)[0]
+
+    def add_stamped(self, topic_path: Path, questions: list[dict]) -> tuple[list[dict], tuple, tuple]:
+        """
+        Like add(), also returning (added, stamp_before, stamp_after): the bank's stamp just before
+        and just after the write.
+
+        Both stamps are read while holding the store's write lock, so no other writer can change
+        the bank between them. In-memory caches of the bank (bank cache, search and near-duplicate
+        indexes) rely on this for write-through: one at stamp_before held exactly the bank this
+        write appended to, so it can be extended with added and re-stamped at stamp_after. One at
+        any other stamp missed another worker's write (perhaps one that landed after the caller
+        read the bank but before this call took the lock) and is dropped instead.
+        """
+        raise NotImplementedError
+
+    def rewrite(self, topic_path: Path, fn) -> list[dict]:
+        """
+        Replaces the bank with fn(current questions), reading and writing under the store's write
+        lock so no concurrent add is lost in between. If fn returns None the bank is left as it is.
+        Returns fn's result.
+        """
+        raise NotImplementedError
+
+    def query(self, topic_path: Path, source_pdfs: list[str]) -> list[dict]:
+        """Returns questions tagged with at least one of source_pdfs, in insertion order."""
+        wanted = set(source_pdfs)
+        return [q for q in self.load(topic_path)
+                if isinstance(q.get('source_pdfs'), list) and wanted.intersection(q['source_pdfs'])]
+
+    def exists(self, topic_path: Path) -> bool:
+        raise NotImplementedError
+
+    def stamp(self, topic_path: Path) -> tuple:
+        """A cheap value that changes whenever the stored bank changes (from file metadata)."""
+        raise NotImplementedError
+
+def _file_stamp(filepath: Path) -> tuple:
+    try:
+        st = filepath.stat()
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+    except FileNotFoundError:
+        return None
+
+class JsonBankStore(BankStore):
+    """
+    Stores a topic's bank as a single JSON list in question_bank.json.
+    Writes go through a temp file + rename while holding an inter-process lock on
+    question_bank.json.lock, so concurrent workers cannot lose each other's questions
+    and a crash mid-write cannot leave a truncated bank behind.
+    """
+    name = "json"
+
+    def bank_file(self, topic_path: Path) -> Path:
+        return Path(topic_path) / JSON_BANK_FILENAME
+
+    def lock_file(self, topic_path: Path) -> Path:
+        return Path(topic_path) / (JSON_BANK_FILENAME + ".lock")
+
+    def exists(self, topic_path: Path) -> bool:
+        return self.bank_file(topic_path).exists()
+
+    def stamp(self, topic_path: Path) -> tuple:
+        return _file_stamp(self.bank_file(topic_path))
+
+    def load(self, topic_path: Path) -> list[dict]:
+        filepath = self.bank_file(topic_path)
+        with open(filepath, 'r', encoding='utf-8') as f:
+            history = json.load(f)
+        if not isinstance(history, list):
+            raise ValueError(f"Invalid format in bank file {filepath}. Expected a list.")
+        return history
+
+    def _write(self, topic_path: Path, questions: list[dict]):
+        atomic_write_json(self.bank_file(topic_path), questions, indent=4, durable=True)
+
+    def save(self, topic_path: Path, questions: list[dict]):
+        with file_lock(self.lock_file(topic_path)):
+            self._write(topic_path, questions)
+
+    def add_stamped(self, topic_path: Path, questions: list[dict]) -> tuple[list[dict], tuple, tuple]:
+        with file_lock(self.lock_file(topic_path)):
+            stamp_before = self.stamp(topic_path)
+            # Re-read under the lock; a corrupt bank raises here rather than being overwritten
+            current_bank = self.load(topic_path) if self.exists(topic_path) else []
+            existing = {normalize_question_text(q.get('question', '')) for q in current_bank if q.get('question')}
+            added = []
+            for q_new in questions:
+                key = normalize_question_text(q_new.get('question', ''))
+                # Add if it has text and is not already in the bank (also prevents duplicates within the new list)
+                if key and key not in existing:
+                    current_bank.append(q_new)
+                    existing.add(key)
+                    added.append(q_new)
+            if added:
+                self._write(topic_path, current_bank)
+            return added, stamp_before, self.stamp(topic_path)
+
+    def rewrite(self, topic_path: Path, fn) -> list[dict]:
+        with file_lock(self.lock_file(topic_path)):
+            questions = fn(self.load(topic_path) if self.exists(topic_path) else [])
+            if questions is not None:
+                self._write(topic_path, questions)
+            return questions
+
+class SqliteBankStore(BankStore):
+    """
+    Stores a topic's bank in question_bank.sqlite3 with separate tables for
+    questions, options and sources. A unique index on the normalized question
+    text does deduplication, so adding a batch costs O(batch) rather than O(bank).
+    If the database does not exist yet, question_bank.json is imported on first use.
+    Writes also hold an inter-process lock on question_bank.sqlite3.lock, which
+    add_stamped relies on for its stamps (see BankStore.add_stamped).
+    """
+    name = "sqlite"
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS questions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            question TEXT NOT NULL,
+            normalized TEXT NOT NULL,
+            correct_answer TEXT,
+            has_sources INTEGER NOT NULL DEFAULT 0,
+            extra TEXT
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_questions_normalized ON questions(normalized);
+        CREATE TABLE IF NOT EXISTS options (
+            question_id INTEGER NOT NULL REFERENCES questions(id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            label TEXT NOT NULL,
+            text TEXT,
+            PRIMARY KEY (question_id, label)
+        );
+        CREATE TABLE IF NOT EXISTS sources (
+            question_id INTEGER NOT NULL REFERENCES questions(id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            source_pdf TEXT NOT NULL,
+            PRIMARY KEY (question_id, source_pdf)
+        );
+        CREATE INDEX IF NOT EXISTS idx_sources_pdf ON sources(source_pdf);
+    """
+
+    def db_file(self, topic_path: Path) -> Path:
+        return Path(topic_path) / SQLITE_BANK_FILENAME
+
+    def lock_file(self, topic_path: Path) -> Path:
+        return Path(topic_path) / (SQLITE_BANK_FILENAME + ".lock")
+
+    def exists(self, topic_path: Path) -> bool:
+        return self.db_file(topic_path).exists() or JsonBankStore().exists(topic_path)
+
+    def stamp(self, topic_path: Path) -> tuple:
+        db_path = self.db_file(topic_path)
+        # Committed writes may only touch the WAL file until the next checkpoint
+        return (_file_stamp(db_path), _file_stamp(db_path.with_name(db_path.name + "-wal")))
+
+    def _connect(self, topic_path: Path) -> sqlite3.Connection:
+        db_path = self.db_file(topic_path)
+        is_new = not db_path.exists()
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.executescript(self._SCHEMA)
+        if is_new and JsonBankStore().exists(topic_path):
+            try:
+                imported = self._insert(conn, JsonBankStore().load(topic_path))
+                conn.commit()
+                logger.info(f"Imported {len(imported)} questions from {JSON_BANK_FILENAME} into {db_path}")
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not import {JSON_BANK_FILENAME} into {db_path}: {e}")
+        return conn
+
+    @contextmanager
+    def _transaction(self, topic_path: Path):
+        """Opens the topic database, commits on success (rolls back on error) and always closes it."""
+        conn = self._connect(topic_path)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _insert(self, conn: sqlite3.Connection, questions: list[dict]) -> list[dict]:
+        added = []
+        for q in questions:
+            q_text = (q.get('question') or '').strip()
+            key = normalize_question_text(q_text)
+            if not key:
+                continue
+            extra = {k: v for k, v in q.items() if k not in _CORE_FIELDS}
+            cur = conn.execute(
+                "INSERT INTO questions (question, normalized, correct_answer, has_sources, extra) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT(normalized) DO NOTHING",
+                (q.get('question'), key, q.get('correct_answer'), int('source_pdfs' in q),
+                 json.dumps(extra) if extra else None))
+            if cur.rowcount == 0:
+                continue
+            question_id = cur.lastrowid
+            options = q.get('options')
+            if isinstance(options, dict):
+                conn.executemany("INSERT INTO options (question_id, position, label, text) VALUES (?, ?, ?, ?)",
+                                 [(question_id, i, label, text) for i, (label, text) in enumerate(options.items())])
+            sources = q.get('source_pdfs')
+            if isinstance(sources, list):
+                conn.executemany("INSERT OR IGNORE INTO sources (question_id, position, source_pdf) VALUES (?, ?, ?)",
+                                 [(question_id, i, pdf) for i, pdf in enumerate(sources)])
+            added.append(q)
+        return added
+
+    def _select(self, conn: sqlite3.Connection, where: str = "", params: tuple = ()) -> list[dict]:
+        rows = conn.execute(
+            f"SELECT id, question, correct_answer, has_sources, extra FROM questions {where} ORDER BY id", params
+        ).fetchall()
+        if not rows:
+            return []
+        ids = [row[0] for row in rows]
+        options, sources = {}, {}
+        # Fetch children in batches to stay under SQLite's bound-parameter limit
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            marks = ",".join("?" * len(batch))
+            for qid, label, text in conn.execute(
+                    f"SELECT question_id, label, text FROM options WHERE question_id IN ({marks}) "
+                    f"ORDER BY question_id, position", batch):
+                options.setdefault(qid, {})[label] = text
+            for qid, pdf in conn.execute(
+                    f"SELECT question_id, source_pdf FROM sources WHERE question_id IN ({marks}) "
+                    f"ORDER BY question_id, position", batch):
+                sources.setdefault(qid, []).append(pdf)
+
+        questions = []
+        for qid, q_text, correct, has_sources, extra in rows:
+            q = {"question": q_text, "options": options.get(qid, {}), "correct_answer": correct}
+            if has_sources:
+                q["source_pdfs"] = sources.get(qid, [])
+            if extra:
+                q.update(json.loads(extra))
+            questions.append(q)
+        return questions
+
+    def load(self, topic_path: Path) -> list[dict]:
+        with self._transaction(topic_path) as conn:
+            return self._select(conn)
+
+    def save(self, topic_path: Path, questions: list[dict]):
+        with file_lock(self.lock_file(topic_path)), self._transaction(topic_path) as conn:
+            conn.execute("DELETE FROM questions")
+            self._insert(conn, questions)
+
+    def add_stamped(self, topic_path: Path, questions: list[dict]) -> tuple[list[dict], tuple, tuple]:
+        with file_lock(self.lock_file(topic_path)):
+            stamp_before = self.stamp(topic_path)
+            with self._transaction(topic_path) as conn:
+                added = self._insert(conn, questions)
+            # Read after the connection is closed (and the WAL possibly checkpointed), still under the lock
+            return added, stamp_before, self.stamp(topic_path)
+
+    def rewrite(self, topic_path: Path, fn) -> list[dict]:
+        with file_lock(self.lock_file(topic_path)), self._transaction(topic_path) as conn:
+            questions = fn(self._select(conn))
+            if questions is not None:
+                conn.execute("DELETE FROM questions")
+                self._insert(conn, questions)
+            return questions
+
+    def query(self, topic_path: Path, source_pdfs: list[str]) -> list[dict]:
+        if not source_pdfs:
+            return []
+        marks = ",".join("?" * len(source_pdfs))
+        with self._transaction(topic_path) as conn:
+            return self._select(conn, f"WHERE id IN (SELECT question_id FROM sources WHERE source_pdf IN ({marks}))",
+                                tuple(source_pdfs))
+
+_STORES = {store.name: store for store in (JsonBankStore(), SqliteBankStore())}
+
+def get_store(name: str) -> BankStore:
+    """Returns the bank store registered under name ('json' or 'sqlite')."""
+    if name not in _STORES:
+        raise ValueError(f"Unknown question bank backend '{name}'. Expected one of: {', '.join(_STORES)}")
+    return _STORES[name]
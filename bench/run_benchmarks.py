@@ -0,0 +1,247 @@
+# bench/run_benchmarks.py
+"""
+End-to-end benchmarks of the Flask endpoints against the local fake Gemini backend
+(no API key needed). A copy of one sample topic from topics/ is made in a temp
+folder, so the real banks are never touched.
+
+Stages (each driven through the app's routes with Flask's test client):
+    generate         POST /generate, then polls /jobs/<id> until the job finishes
+    generate_stream  POST /generate_stream (reads the whole event stream; retried while the topic is busy)
+    get_bank         GET  /get_bank
+    format_examples  POST /format_examples, then polls /jobs/<id>
+
+For every stage it reports the first (cold cache) request's latency, p50/p95/max
+latency of the remaining requests, throughput and peak traced Python memory,
+and saves everything as JSON.
+
+Run from the project root:
+    python -m bench.run_benchmarks --topic cloud --files 3 --iterations 5 --concurrency 2
+    python -m bench.run_benchmarks --compare bench/results/<earlier run>.json
+"""
+import argparse
+import json
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import config
+
+STAGES = ["generate", "generate_stream", "get_bank", "format_examples"]
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+JOB_POLL_SECONDS = 0.01
+EXAMPLES_TEXT = "\n".join(
+    f"Q{i}: What does concept {i} of this course describe? A: It describes topic {i}." for i in range(1, 9))
+
+def _percentile(sorted_values: list[float], pct: float) -> float:
+    """Linear-interpolated percentile of an ascending list."""
+    if not sorted_values:
+        return None
+    pos = (len(sorted_values) - 1) * pct / 100
+    low = int(pos)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (pos - low)
+
+def _prepare_topic(topics_dir: Path, topic: str, num_files: int) -> list[str]:
+    """Copies the topic's bank and first num_files context PDFs into topics_dir; returns the PDF names."""
+    source = Path("topics") / topic
+    if not (source / "context").is_dir():
+        raise SystemExit(f"Sample topic not found: {source}/context (run from the project root)")
+    target = topics_dir / topic
+    (target / "context").mkdir(parents=True)
+    (target / "examples").mkdir()
+    pdfs = sorted((source / "context").glob("*.pdf"))[:num_files]
+    for pdf in pdfs:
+        shutil.copy2(pdf, target / "context" / pdf.name)
+    if (source / "question_bank.json").exists():
+        shutil.copy2(source / "question_bank.json", target / "question_bank.json")
+    (target / "examples" / "bench_examples.txt").write_text(EXAMPLES_TEXT, encoding="utf-8")
+    return [pdf.name for pdf in pdfs]
+
+def _run_job(client, path: str, body: dict) -> dict:
+    """Queues a job like the browser does (202 + job id) and polls it; returns the job's status dict, or None."""
+    r = client.post(path, json=body)
+    if r.status_code != 202:
+        return None
+    status_url = r.json["status_url"]
+    while True:
+        job = client.get(status_url).json
+        if job["status"] in ("succeeded", "failed"):
+            return job
+        time.sleep(JOB_POLL_SECONDS)
+
+def _make_requests(app, topic: str, files: list[str], num_questions: int) -> dict:
+    """One callable per stage; each performs a request and returns (ok, extra metrics)."""
+    body = {"topic": topic, "num_questions": num_questions, "selected_files": files}
+
+    def generate():
+        job = _run_job(app.test_client(), '/generate', body)
+        ok = job is not None and job["http_status"] == 200
+        return ok, {"questions": (job["result"] or {}).get("new_questions_count", 0) if ok else 0}
+
+    def generate_stream():
+        r = app.test_client().post('/generate_stream', json=body)
+        while r.status_code == 429: # Another stream holds the topic's job slot; retry like a client would
+            time.sleep(JOB_POLL_SECONDS)
+            r = app.test_client().post('/generate_stream', json=body)
+        done = {}
+        for block in r.get_data(as_text=True).split("\n\n"):
+            if block.startswith("event: done"):
+                done = json.loads(block.split("data: ", 1)[1])
+        return r.status_code == 200 and bool(done), {"questions": done.get("new_questions_count", 0),
+                                                      "ttfq_ms": done.get("ttfq_ms")}
+
+    def get_bank():
+        r = app.test_client().get('/get_bank', query_string={"topic": topic})
+        return r.status_code == 200, {}
+
+    def format_examples():
+        job = _run_job(app.test_client(), '/format_examples', {"topic": topic})
+        ok = job is not None and job["http_status"] == 200
+        return ok, {"questions": (job["result"] or {}).get("formatted_count", 0) if ok else 0}
+
+    return {"generate": generate, "generate_stream": generate_stream, "get_bank": get_bank,
+            "format_examples": format_examples}
+
+def run_stage(request_fn, iterations: int, concurrency: int, trace_memory: bool) -> dict:
+    latencies, extras, failures = [], [], 0
+    lock = threading.Lock()
+
+    def one(_):
+        nonlocal failures
+        start = time.perf_counter()
+        ok, extra = request_fn()
+        elapsed = (time.perf_counter() - start) * 1000
+        with lock:
+            latencies.append(elapsed)
+            extras.append(extra)
+            failures += 0 if ok else 1
+
+    if trace_memory:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+    wall_start = time.perf_counter()
+    one(0) # The first request runs alone so its (cold cache) latency is reported separately
+    first_ms = latencies[0]
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(iterations - 1)))
+    wall = time.perf_counter() - wall_start
+
+    # Percentiles describe the warm requests; the cold first one is reported as first_ms
+    ordered = sorted(latencies[1:] or latencies)
+    result = {
+        "requests": len(latencies),
+        "failures": failures,
+        "first_ms": round(first_ms, 1),
+        "p50_ms": round(_percentile(ordered, 50), 1),
+        "p95_ms": round(_percentile(ordered, 95), 1),
+        "max_ms": round(ordered[-1], 1),
+        "throughput_rps": round(len(latencies) / wall, 3),
+        "questions": sum(e.get("questions", 0) for e in extras),
+    }
+    ttfq = sorted(e["ttfq_ms"] for e in extras if e.get("ttfq_ms") is not None)
+    if ttfq:
+        result["ttfq_p50_ms"] = round(_percentile(ttfq, 50), 1)
+    if trace_memory:
+        result["peak_memory_mb"] = round((tracemalloc.get_traced_memory()[1] - baseline) / 2**20, 2)
+    return result
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _print_comparison(current: dict, previous: dict):
+    print(f"\nComparison with {previous.get('timestamp')} ({previous.get('git_commit')}):")
+    for stage, now in current["stages"].items():
+        before = previous.get("stages", {}).get(stage)
+        if not before:
+            continue
+        parts = []
+        for key in ("p50_ms", "p95_ms", "throughput_rps", "peak_memory_mb"):
+            if now.get(key) is not None and before.get(key):
+                change = (now[key] - before[key]) / before[key] * 100
+                parts.append(f"{key} {before[key]} -> {now[key]} ({change:+.0f}%)")
+        print(f"  {stage:16} " + ", ".join(parts))
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--topic", default="cloud", help="Sample topic under topics/ to copy")
+    parser.add_argument("--files", type=int, default=3, help="Number of the topic's context PDFs to use")
+    parser.add_argument("--stages", default=",".join(STAGES), help="Comma-separated stages to run")
+    parser.add_argument("--iterations", type=int, default=5, help="Requests per stage")
+    parser.add_argument("--concurrency", type=int, default=1, help="Concurrent requests after the first")
+    parser.add_argument("--num-questions", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=config.FAKE_GEMINI_LATENCY_SECONDS, help="Fake Gemini delay per call (s)")
+    parser.add_argument("--per-1k-tokens", type=float, default=config.FAKE_GEMINI_SECONDS_PER_1K_TOKENS, help="Fake Gemini delay per 1k tokens (s)")
+    parser.add_argument("--malformed-rate", type=float, default=config.FAKE_GEMINI_MALFORMED_RATE)
+    parser.add_argument("--error-rate", type=float, default=config.FAKE_GEMINI_ERROR_RATE)
+    parser.add_argument("--no-gemini-cache", action="store_true", help="Disable the Gemini response cache")
+    parser.add_argument("--no-memory", action="store_true", help="Skip tracemalloc (it slows Python code down)")
+    parser.add_argument("--output", help="Result file (default: bench/results/<timestamp>.json)")
+    parser.add_argument("--compare", help="Earlier result file to compare against")
+    args = parser.parse_args()
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"Unknown stage(s): {', '.join(sorted(unknown))}")
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        work_dir = Path(work_dir)
+        topics_dir = work_dir / "topics"
+        files = _prepare_topic(topics_dir, args.topic, args.files)
+
+        # Configure before the app is imported (it configures Gemini on import)
+        config.TOPICS_BASE_DIR = str(topics_dir)
+        config.GEMINI_BACKEND = "fake"
+        config.GEMINI_CACHE_DIR = str(work_dir / "gemini_cache")
+        config.GEMINI_CACHE_ENABLED = config.GEMINI_CACHE_ENABLED and not args.no_gemini_cache
+        config.FAKE_GEMINI_LATENCY_SECONDS = args.latency
+        config.FAKE_GEMINI_SECONDS_PER_1K_TOKENS = args.per_1k_tokens
+        config.FAKE_GEMINI_MALFORMED_RATE = args.malformed_rate
+        config.FAKE_GEMINI_ERROR_RATE = args.error_rate
+        from app import app
+
+        requests = _make_requests(app, args.topic, files, args.num_questions)
+        if not args.no_memory:
+            tracemalloc.start()
+        results = {}
+        for stage in stages:
+            print(f"\n=== {stage} ({args.iterations} requests, concurrency {args.concurrency}) ===")
+            results[stage] = run_stage(requests[stage], args.iterations, args.concurrency, not args.no_memory)
+        if not args.no_memory:
+            tracemalloc.stop()
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {**vars(args), "stages": stages, "files": files},
+        "stages": results,
+    }
+    print("\nstage              p50 ms   p95 ms  first ms    req/s  peak MB  failures")
+    for stage, r in results.items():
+        print(f"{stage:16} {r['p50_ms']:8} {r['p95_ms']:8} {r['first_ms']:9} {r['throughput_rps']:8} "
+              f"{r.get('peak_memory_mb', '-'):>8} {r['failures']:9}")
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"\nSaved results to {output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            _print_comparison(report, json.load(f))
+    return 1 if any(r["failures"] for r in results.values()) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+# bench/stress_bank_writes.py
+"""
+Hammers a single topic's question bank from many processes at once and checks
+that no questions are lost and the bank file stays valid.
+
+Run from the project root:
+    python -m bench.stress_bank_writes --processes 8 --batches 25 --batch-size 4 --backend json
+"""
+import argparse
+import multiprocessing
+import random
+import sys
+import tempfile
+import time
+
+import config
+import data_manager as dm
+
+TOPIC = "stress"
+_VOCABULARY = [f"term{n}" for n in range(5000)]
+
+def _question(worker_id: int, b: int, i: int) -> dict:
+    # Random words per question, so the near-duplicate filter (which stays on) has nothing to reject
+    rng = random.Random(f"{worker_id}:{b}:{i}")
+    words = lambda count: " ".join(rng.sample(_VOCABULARY, count))
+    return {
+        "question": f"Worker {worker_id} batch {b} question {i}: what links {words(8)}?",
+        "options": {label: words(3) for label in "ABCD"},
+        "correct_answer": "A",
+        "source_pdfs": [f"worker{worker_id}.pdf"],
+    }
+
+def _worker(topics_dir: str, backend: str, worker_id: int, batches: int, batch_size: int):
+    config.TOPICS_BASE_DIR = topics_dir
+    config.QUESTION_BANK_BACKEND = backend
+    for b in range(batches):
+        dm.add_questions_to_bank(TOPIC, [_question(worker_id, b, i) for i in range(batch_size)])
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--batches", type=int, default=25, help="add_questions_to_bank calls per process")
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--backend", choices=["json", "sqlite"], default=config.QUESTION_BANK_BACKEND)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as topics_dir:
+        config.TOPICS_BASE_DIR = topics_dir
+        config.QUESTION_BANK_BACKEND = args.backend
+        dm.create_topic(TOPIC)
+
+        start = time.perf_counter()
+        procs = [multiprocessing.Process(target=_worker, args=(topics_dir, args.backend, w, args.batches, args.batch_size))
+                 for w in range(args.processes)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+        elapsed = time.perf_counter() - start
+
+        failed = [p.exitcode for p in procs if p.exitcode != 0]
+        bank = dm.load_question_bank(TOPIC)
+        expected = args.processes * args.batches * args.batch_size
+        unique = {q["question"] for q in bank}
+        print(f"\n{args.backend} store: {len(bank)} questions ({len(unique)} unique), expected {expected}, "
+              f"{args.processes * args.batches} concurrent writes in {elapsed:.2f}s")
+        if failed or len(bank) != expected or len(unique) != expected:
+            print(f"FAILED: lost {expected - len(unique)} question(s); worker exit codes: {failed or 'all 0'}")
+            return 1
+        print("OK: no questions lost.")
+        return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
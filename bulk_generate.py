@@ -0,0 +1,330 @@
+# bulk_generate.py
+"""
+Headless question generation for many topics in one run (e.g. a nightly content refresh).
+
+Each topic is generated from all of its context PDFs (or the --files named) the
+same way /generate does: the planner splits the context into concurrent Gemini
+calls and new questions are added to the topic's bank. Topics run on a pool of
+--workers threads; all of them share the process's Gemini client, so its
+requests/tokens-per-minute limits (--rpm, --tpm) are a global budget for the run.
+--max-tokens caps the run's (estimated) tokens: each topic reserves an estimate of
+its calls before making them and is skipped if that would not fit next to what
+was used and what running topics reserved; top-up calls stop once it is spent.
+
+Progress is checkpointed to BULK_CHECKPOINT_FILE after every topic. An
+interrupted (or partly failed) run is continued with --resume, which skips the
+topics already done with the same generation options (topics can be added or
+left out between runs). A summary of throughput and
+(estimated) tokens is printed at the end and can be saved with --report.
+
+    python bulk_generate.py --all -n 20
+    python bulk_generate.py cloud "web dev" -n 10 --context-mode fill_gaps --workers 4
+    python bulk_generate.py --all -n 20 --resume --report refresh.json
+"""
+import argparse
+import contextvars
+import json
+import math
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+import config
+import data_manager as dm
+import file_handler as fh
+import gemini_handler as gh
+import generation_planner as planner
+from fs_utils import atomic_write_json
+from log_utils import get_logger, set_request_id
+from text_utils import estimate_tokens
+
+logger = get_logger(__name__)
+
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+STATUS_SKIPPED = "skipped" # No context PDFs, or the token budget ran out before it started
+
+# --- Checkpoint ---
+
+class Checkpoint:
+    """Per-topic results of a run, saved after each topic so the run can be resumed."""
+
+    def __init__(self, path: Path, settings: dict):
+        self.path = Path(path)
+        self.settings = settings
+        self.topics = {}
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def resume(cls, path: Path, settings: dict) -> "Checkpoint":
+        """
+        Loads the checkpoint at path if it was written with the same settings (the generation
+        options, not the topic list), else starts a new one.
+        """
+        checkpoint = cls(path, settings)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return checkpoint
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Could not read checkpoint {path} ({e}). Starting a new run.")
+            return checkpoint
+        if saved.get("settings") != settings:
+            logger.warning(f"Checkpoint {path} was written with different settings. Starting a new run.")
+            return checkpoint
+        checkpoint.topics = saved.get("topics", {})
+        checkpoint.started_at = saved.get("started_at", checkpoint.started_at)
+        return checkpoint
+
+    def is_done(self, topic: str) -> bool:
+        return self.topics.get(topic, {}).get("status") == STATUS_DONE
+
+    def record(self, topic: str, result: dict):
+        with self._lock:
+            self.topics[topic] = result
+            try:
+                atomic_write_json(self.path, {"settings": self.settings, "started_at": self.started_at,
+                                              "topics": self.topics}, indent=2)
+            except OSError as e:
+                logger.warning(f"Could not save checkpoint {self.path}: {e}")
+
+# --- Token budget ---
+
+class TokenBudget:
+    """
+    The run's --max-tokens, shared by the worker threads. Tokens used are read from the shared
+    Gemini client; topics reserve their estimate before calling, so concurrent topics can't all
+    start on the same remaining budget. A running topic's own usage counts next to its
+    reservation, so the check errs towards skipping, never towards overshooting.
+    """
+
+    def __init__(self, max_tokens: int, client_before: dict):
+        self.max_tokens = max_tokens
+        self.client_before = client_before
+        self.reserved = 0
+        self.exhausted = threading.Event()
+        self._lock = threading.Lock()
+
+    def used(self) -> int:
+        return _tokens_used(self.client_before)
+
+    def reserve(self, tokens: int) -> bool:
+        """Reserves tokens if they fit in what is left, else marks the budget exhausted and returns False."""
+        with self._lock:
+            if self.used() + self.reserved + tokens > self.max_tokens:
+                self.exhausted.set()
+                return False
+            self.reserved += tokens
+            return True
+
+    def release(self, tokens: int):
+        with self._lock:
+            self.reserved -= tokens
+
+    def has_tokens_left(self) -> bool:
+        if self.used() < self.max_tokens:
+            return True
+        self.exhausted.set()
+        return False
+
+def estimate_plan_tokens(parts: list[dict], history_text: str) -> int:
+    """Estimated prompt and output tokens of a plan's first round of calls (one per PLANNER_QUESTIONS_PER_CALL questions)."""
+    total = 0
+    for part in parts:
+        calls = math.ceil(part["num_questions"] / config.PLANNER_QUESTIONS_PER_CALL)
+        prompt = gh.build_generation_prompt(part["context_text"], history_text, config.PLANNER_QUESTIONS_PER_CALL)
+        total += calls * estimate_tokens(prompt) + part["num_questions"] * config.BULK_OUTPUT_TOKENS_PER_QUESTION
+    return total
+
+# --- Generation ---
+
+def generate_topic(topic: str, num_questions: int, context_mode: str, files: list[str] = None,
+                   fresh: bool = False, budget: TokenBudget = None) -> dict:
+    """
+    Generates up to num_questions new questions for topic and adds them to its bank. Returns the topic's result.
+    With a budget, the plan's estimated tokens are reserved first (the topic is skipped if they don't fit).
+    """
+    start = time.perf_counter()
+    available = [name for name, _, _ in dm.get_context_fingerprint(topic)]
+    selected = [name for name in available if name in files] if files else available
+    if not selected:
+        return {"status": STATUS_SKIPPED, "reason": "no matching context PDFs", "added": 0, "seconds": 0.0}
+
+    current_bank = dm.load_questions_for_sources(topic, selected)
+    segments = planner.build_segments(topic, selected, context_mode, current_bank, num_questions)
+    if not segments:
+        return {"status": STATUS_FAILED, "error": "could not extract any text from the context PDFs", "added": 0,
+                "seconds": round(time.perf_counter() - start, 2)}
+    history_text, _ = dm.build_history_section(current_bank, relevant_source_pdfs=selected)
+    parts = planner.plan_generation(segments, num_questions)
+    estimate = estimate_plan_tokens(parts, history_text) if budget else 0
+    if budget and not budget.reserve(estimate):
+        return {"status": STATUS_SKIPPED, "reason": f"token budget exhausted (needs ~{estimate} tokens)", "added": 0,
+                "seconds": round(time.perf_counter() - start, 2)}
+    try:
+        new_mcqs, plan_stats = planner.generate(parts, history_text, num_questions, bypass_cache=fresh,
+                                                keep_going=budget.has_tokens_left if budget else None)
+    finally:
+        if budget:
+            budget.release(estimate)
+    added = dm.add_questions_to_bank(topic, new_mcqs) if new_mcqs else 0
+    return {"status": STATUS_DONE, "files": len(selected), "added": added, "calls": plan_stats["calls"],
+            "failed_calls": plan_stats["failed_calls"], "seconds": round(time.perf_counter() - start, 2)}
+
+def _run_topic(topic: str, options: dict, budget: TokenBudget = None) -> dict:
+    set_request_id(f"bulk-{topic}"[:64].replace(" ", "_")) # Tags the topic's log records (and its planner threads')
+    logger.info(f"Bulk: generating {options['num_questions']} questions for topic '{topic}'...")
+    try:
+        return generate_topic(topic, **options, budget=budget)
+    except gh.GeminiRequestError as e:
+        logger.error(f"Bulk: Gemini rejected a request for topic '{topic}': {e}")
+        return {"status": STATUS_FAILED, "error": str(e), "added": 0}
+    except gh.GeminiError as e:
+        logger.warning(f"Bulk: Gemini unavailable for topic '{topic}': {e}")
+        return {"status": STATUS_FAILED, "error": f"Gemini unavailable: {e}", "added": 0}
+    except Exception as e:
+        logger.exception(f"Bulk: error while generating topic '{topic}': {e}")
+        return {"status": STATUS_FAILED, "error": str(e), "added": 0}
+
+def _tokens_used(baseline: dict) -> int:
+    stats = gh.get_client_stats()
+    return (stats["prompt_tokens"] + stats["output_tokens"]) - (baseline["prompt_tokens"] + baseline["output_tokens"])
+
+def run(topics: list[str], options: dict, checkpoint: Checkpoint, workers: int = None, max_tokens: int = None) -> dict:
+    """Generates every topic not already done in checkpoint on a thread pool. Returns the run summary."""
+    client_before = gh.get_client_stats()
+    cache_before = gh.get_cache_stats()
+    pending = [topic for topic in topics if not checkpoint.is_done(topic)]
+    resumed = len(topics) - len(pending)
+    if resumed:
+        logger.info(f"Bulk: resuming, {resumed} topic(s) already done.")
+
+    start = time.perf_counter()
+    results = {}
+    budget = TokenBudget(max_tokens, client_before) if max_tokens else None
+
+    def work(topic: str) -> dict:
+        # Topics queued behind the pool check the budget when they start, not when they were submitted
+        if budget and not budget.has_tokens_left():
+            return {"status": STATUS_SKIPPED, "reason": "token budget exhausted", "added": 0}
+        return _run_topic(topic, options, budget)
+
+    pool = ThreadPoolExecutor(max_workers=max(1, workers or config.BULK_WORKERS), thread_name_prefix="bulk")
+    futures = {pool.submit(contextvars.copy_context().run, work, topic): topic for topic in pending}
+    try:
+        for future in as_completed(futures):
+            topic = futures[future]
+            results[topic] = result = future.result()
+            checkpoint.record(topic, result)
+            detail = result.get("error") or result.get("reason") or f"{result['added']} added in {result['seconds']}s"
+            logger.info(f"Bulk: topic '{topic}' {result['status']} ({detail}) [{len(results)}/{len(pending)}]")
+    except KeyboardInterrupt:
+        logger.warning("Bulk: interrupted; finishing running topics (resume later with --resume).")
+        for future in futures:
+            future.cancel()
+        raise
+    finally:
+        pool.shutdown(wait=True)
+        seconds = time.perf_counter() - start
+
+    return _summarize(results, resumed, seconds, client_before, cache_before, bool(budget and budget.exhausted.is_set()))
+
+def _summarize(results: dict, resumed: int, seconds: float, client_before: dict, cache_before: dict,
+               budget_exhausted: bool) -> dict:
+    client = gh.get_client_stats()
+    cache = gh.get_cache_stats()
+    by_status = {status: sorted(t for t, r in results.items() if r["status"] == status)
+                 for status in (STATUS_DONE, STATUS_FAILED, STATUS_SKIPPED)}
+    added = sum(r.get("added", 0) for r in results.values())
+    tokens = {name: client[name] - client_before[name] for name in ("prompt_tokens", "output_tokens")}
+    minutes = seconds / 60 or 1e-9
+    return {
+        "topics": {"done": len(by_status[STATUS_DONE]), "failed": by_status[STATUS_FAILED],
+                   "skipped": by_status[STATUS_SKIPPED], "resumed": resumed},
+        "questions_added": added,
+        "seconds": round(seconds, 1),
+        "questions_per_minute": round(added / minutes, 1),
+        "gemini": {"calls": client["calls"] - client_before["calls"], "retries": client["retries"] - client_before["retries"],
+                   "failures": client["failures"] - client_before["failures"],
+                   "cache_hits": cache["hits"] - cache_before["hits"],
+                   "rate_limit_wait_seconds": round(client["rate_limit_wait_seconds"] - client_before["rate_limit_wait_seconds"], 1)},
+        "tokens": {**tokens, "total": sum(tokens.values()), "per_minute": round(sum(tokens.values()) / minutes)},
+        "budget_exhausted": budget_exhausted,
+        "results": results,
+    }
+
+def print_summary(summary: dict):
+    topics, gemini, tokens = summary["topics"], summary["gemini"], summary["tokens"]
+    print(f"Topics: {topics['done']} done, {len(topics['failed'])} failed, {len(topics['skipped'])} skipped"
+          + (f", {topics['resumed']} already done before resuming" if topics["resumed"] else ""))
+    for topic, result in sorted(summary["results"].items()):
+        detail = result.get("error") or result.get("reason") or f"{result['added']} added, {result['calls']} call(s)"
+        print(f"  {topic}: {result['status']} ({detail}, {result.get('seconds', 0)}s)")
+    print(f"Questions added: {summary['questions_added']} in {summary['seconds']}s ({summary['questions_per_minute']}/min)")
+    print(f"Gemini: {gemini['calls']} call(s), {gemini['retries']} retries, {gemini['failures']} failed, "
+          f"{gemini['cache_hits']} cache hit(s), {gemini['rate_limit_wait_seconds']}s waiting on rate limits")
+    print(f"Tokens (estimated): {tokens['prompt_tokens']} prompt + {tokens['output_tokens']} output = "
+          f"{tokens['total']} ({tokens['per_minute']}/min)")
+    if summary["budget_exhausted"]:
+        print("Token budget exhausted: run again with --resume (and a new budget) to finish the remaining topics.")
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate questions for many topics in one run.")
+    parser.add_argument("topics", nargs="*", help="Topic names (see the topics/ folder)")
+    parser.add_argument("--all", action="store_true", help="Generate for every topic")
+    parser.add_argument("-n", "--num-questions", type=int, default=config.DEFAULT_NUM_QUESTIONS_TO_GENERATE,
+                        help="New questions per topic")
+    parser.add_argument("--context-mode", choices=("full", "retrieval", "fill_gaps"), default="full")
+    parser.add_argument("--files", nargs="+", help="Only use context PDFs with these names (in every topic)")
+    parser.add_argument("--fresh", action="store_true", help="Bypass the Gemini response cache")
+    parser.add_argument("--workers", type=int, default=config.BULK_WORKERS, help="Topics generated at once")
+    parser.add_argument("--rpm", type=int, help="Gemini requests per minute for the whole run (default: config)")
+    parser.add_argument("--tpm", type=int, help="Gemini tokens per minute for the whole run (default: config)")
+    parser.add_argument("--max-tokens", type=int, help="Token budget of the run (estimated): topics that would not fit are skipped")
+    parser.add_argument("--checkpoint", default=config.BULK_CHECKPOINT_FILE, help="Progress file")
+    parser.add_argument("--resume", action="store_true", help="Skip topics the checkpoint records as done with the same options")
+    parser.add_argument("--report", help="Also save the summary as JSON to this file")
+    args = parser.parse_args()
+
+    topics = dm.get_available_topics() if args.all else args.topics
+    if not topics:
+        parser.error("Name at least one topic or pass --all.")
+    if args.num_questions <= 0:
+        parser.error("--num-questions must be positive.")
+    missing = [topic for topic in topics if not dm.get_context_folder(topic).is_dir()]
+    if missing:
+        parser.error(f"Unknown topic(s): {', '.join(missing)}")
+    if not fh.PDF_LIB_AVAILABLE:
+        sys.exit("PDF library (pypdf) not available.")
+
+    # The shared client is created on first use, so these apply to every call of the run
+    if args.rpm:
+        config.GEMINI_REQUESTS_PER_MINUTE = args.rpm
+    if args.tpm:
+        config.GEMINI_TOKENS_PER_MINUTE = args.tpm
+    if not gh.configure_gemini():
+        sys.exit("Gemini is not configured (see GOOGLE_API_KEY / GEMINI_BACKEND).")
+
+    options = {"num_questions": args.num_questions, "context_mode": args.context_mode, "files": args.files,
+               "fresh": args.fresh}
+    # Only the generation options: adding a topic (e.g. under --all) must not discard the others' progress
+    if args.resume:
+        checkpoint = Checkpoint.resume(args.checkpoint, options)
+    else:
+        checkpoint = Checkpoint(args.checkpoint, options)
+
+    try:
+        summary = run(topics, options, checkpoint, workers=args.workers, max_tokens=args.max_tokens)
+    except KeyboardInterrupt:
+        sys.exit(f"Interrupted. Progress saved to {args.checkpoint}; continue with --resume.")
+    print_summary(summary)
+    if args.report:
+        atomic_write_json(Path(args.report), summary, indent=2)
+    if summary["topics"]["failed"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -13,8 +13,205 @@ GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY", "YOUR_DEFAULT_API_KEY_HERE") # Repl
 # Base directory where all topic folders will reside
 TOPICS_BASE_DIR = "topics"
 
+# --- Question Bank Storage ---
+# "json": question_bank.json is the bank (rewritten on every change).
+# "sqlite": question_bank.sqlite3 is the bank, imported from question_bank.json on first use;
+#           the JSON file then only serves as an import/export format (see data_manager.export_question_bank).
+QUESTION_BANK_BACKEND = os.getenv("QUESTION_BANK_BACKEND", "json")
+# /get_bank page size when the request gives no limit, and the most one request may ask for
+BANK_PAGE_DEFAULT_LIMIT = 50
+BANK_PAGE_MAX_LIMIT = 500
+
 # --- Gemini Model ---
 GEMINI_MODEL_NAME = "gemini-2.5-flash-preview-04-17" # Or your preferred model
 
+# Model backend: "google" (the real API, needs GOOGLE_API_KEY) or "fake" (local, see fake_gemini.py)
+GEMINI_BACKEND = os.getenv("GEMINI_BACKEND", "google")
+
+# --- Fake Gemini Backend ---
+# Fixed delay per call, plus a delay per 1k prompt + output tokens
+FAKE_GEMINI_LATENCY_SECONDS = float(os.getenv("FAKE_GEMINI_LATENCY_SECONDS", "0.5"))
+FAKE_GEMINI_SECONDS_PER_1K_TOKENS = float(os.getenv("FAKE_GEMINI_SECONDS_PER_1K_TOKENS", "0.05"))
+# Share of generated questions written in a shape the parser rejects
+FAKE_GEMINI_MALFORMED_RATE = float(os.getenv("FAKE_GEMINI_MALFORMED_RATE", "0.05"))
+# Share of calls failing with a retryable (503) error
+FAKE_GEMINI_ERROR_RATE = float(os.getenv("FAKE_GEMINI_ERROR_RATE", "0"))
+FAKE_GEMINI_SEED = int(os.getenv("FAKE_GEMINI_SEED", "0"))
+
+# Response format requested from Gemini: "json" (schema-constrained JSON array) or "text" (Question:/Options: blocks)
+GEMINI_OUTPUT_MODE = os.getenv("GEMINI_OUTPUT_MODE", "json")
+
+# --- Gemini Client ---
+# Client-side rate limits (keep at or below your API quota)
+GEMINI_REQUESTS_PER_MINUTE = int(os.getenv("GEMINI_REQUESTS_PER_MINUTE", "60"))
+GEMINI_TOKENS_PER_MINUTE = int(os.getenv("GEMINI_TOKENS_PER_MINUTE", "1000000"))
+# Longest a call waits for rate-limit capacity before failing fast
+GEMINI_RATE_LIMIT_MAX_WAIT_SECONDS = 120
+# Per-attempt request timeout
+GEMINI_TIMEOUT_SECONDS = 180
+# Retries for retryable errors (429, 5xx, timeouts), with jittered exponential backoff
+GEMINI_MAX_RETRIES = 4
+GEMINI_BACKOFF_BASE_SECONDS = 1.0
+GEMINI_BACKOFF_MAX_SECONDS = 30.0
+# Consecutive failed attempts that open the circuit breaker, and how long it stays open
+GEMINI_BREAKER_FAILURE_THRESHOLD = 5
+GEMINI_BREAKER_RESET_SECONDS = 30
+
+# --- HTTP Responses ---
+# JSON bodies at least this large are gzip-encoded (brotli if the package is installed) for clients that accept it
+HTTP_COMPRESS_MIN_BYTES = 1024
+HTTP_GZIP_LEVEL = 6
+HTTP_BROTLI_QUALITY = 5
+
+# --- Logging & Metrics ---
+# "text" (one line per record) or "json" (one JSON object per line); every record carries its request id
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Set to "0" to stop collecting stage timings and counters (and disable /metrics)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+
+# --- Profiling ---
+# Admin token that enables per-request profiling (X-Admin-Token header plus X-Profile or ?profile=cprofile|sample);
+# empty disables profiling entirely (see profiling.py)
+PROFILING_ADMIN_TOKEN = os.getenv("PROFILING_ADMIN_TOKEN", "")
+PROFILES_DIR = os.getenv("PROFILES_DIR", "profiles")
+# Newest profiles kept on disk (older ones are deleted)
+PROFILES_MAX_KEPT = 50
+PROFILE_SAMPLE_INTERVAL_SECONDS = 0.005
+
 # --- Other Settings ---
 DEFAULT_NUM_QUESTIONS_TO_GENERATE = 5 # Default number for generation requests
+
+# --- Caching ---
+# Name of the per-topic cache folder (e.g. topics/<topic>/.cache/)
+CACHE_DIR_NAME = ".cache"
+# Maximum size of each topic's extracted PDF text cache before LRU eviction
+EXTRACTION_CACHE_MAX_BYTES = 200 * 1024 * 1024
+# Folder for cached raw Gemini responses, keyed by hash of (model, prompt, generation params)
+GEMINI_CACHE_DIR = os.getenv("GEMINI_CACHE_DIR", os.path.join(CACHE_DIR_NAME, "gemini"))
+# Set to "0" to disable the Gemini response cache
+GEMINI_CACHE_ENABLED = os.getenv("GEMINI_CACHE_ENABLED", "1") != "0"
+# Cached Gemini responses older than this are ignored and replaced
+GEMINI_CACHE_TTL_SECONDS = 7 * 24 * 3600
+# Maximum size of the Gemini response cache before LRU eviction
+GEMINI_CACHE_MAX_BYTES = 50 * 1024 * 1024
+# Set to "0" to disable the per-process cache of parsed question banks (checked against the bank's stamp on every read)
+BANK_CACHE_ENABLED = os.getenv("BANK_CACHE_ENABLED", "1") != "0"
+# Estimated size (question and option text) of all cached banks before the least recently used topic is evicted
+BANK_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# --- Gemini Context Caching ---
+# Send large generation contexts once into a provider-side cache and reference it in later calls (see context_cache.py).
+# Opt-in for the real API, where cache creation and storage are billed; on by default only for the fake backend
+CONTEXT_CACHE_ENABLED = os.getenv("CONTEXT_CACHE_ENABLED", "1" if GEMINI_BACKEND == "fake" else "0") != "0"
+# Smaller contexts are sent inline (the API's minimum cache size depends on the model)
+CONTEXT_CACHE_MIN_TOKENS = 4096
+CONTEXT_CACHE_TTL_SECONDS = 3600
+# Caches this close to expiry are recreated rather than used, so a call never races the expiry
+CONTEXT_CACHE_EXPIRY_MARGIN_SECONDS = 60
+# Most caches kept at once; the oldest is deleted (the provider bills cache storage per hour)
+CONTEXT_CACHE_MAX_ENTRIES = 32
+# After creating a cache for a context failed, send that context inline for this long before trying again
+CONTEXT_CACHE_RETRY_SECONDS = 600
+
+# --- PDF Extraction ---
+# Worker processes used to extract PDFs in parallel (1 disables the pool)
+PDF_EXTRACTION_WORKERS = max(1, min(8, os.cpu_count() or 1))
+# Large PDFs are split into page ranges of this size so one deck can use several workers
+PDF_PAGES_PER_TASK = 25
+# Jobs with fewer uncached pages left after each file's first range than this finish serially, avoiding pool overhead
+PDF_PARALLEL_MIN_PAGES = 40
+
+# --- Ingestion ---
+# Set to "0" to not start the background watcher that pre-extracts and indexes new context PDFs (see ingest.py).
+# Only `python app.py` starts it; under gunicorn run one `python ingest.py --all --watch` next to the workers instead
+INGEST_WATCHER_ENABLED = os.getenv("INGEST_WATCHER_ENABLED", "1") != "0"
+INGEST_POLL_SECONDS = 5
+# Files modified more recently than this are left for the next poll, as they may still be copying
+INGEST_SETTLE_SECONDS = 2
+
+# --- Uploads ---
+# Uploaded PDFs are stored once by SHA-256 in TOPICS_BASE_DIR/<this folder> and hardlinked into topics (see content_store.py)
+CONTENT_STORE_DIR_NAME = ".store"
+# Upload temp files older than this are crash leftovers, removed by content_store.collect_garbage()
+CONTENT_STORE_TMP_MAX_AGE_SECONDS = 24 * 3600
+# Largest single PDF accepted by /upload_context, and largest whole upload request
+UPLOAD_MAX_FILE_BYTES = 200 * 1024 * 1024
+UPLOAD_MAX_REQUEST_BYTES = 1024 * 1024 * 1024
+
+# --- Retrieval Context Mode ---
+# Rough characters-per-token ratio used for token estimates
+CHARS_PER_TOKEN = 4
+# Target size of each indexed chunk of PDF text
+RETRIEVAL_CHUNK_CHARS = 1500
+# Maximum number of chunks sent to Gemini in retrieval mode
+RETRIEVAL_TOP_K = 12
+# Maximum estimated tokens of context sent to Gemini in retrieval mode
+RETRIEVAL_TOKEN_BUDGET = 6000
+# BM25 ranking parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# --- Coverage ---
+# A context chunk counts as covered once this many bank questions are attributed to it;
+# "fill_gaps" generation skips covered chunks and allocates questions by the shortfall
+COVERAGE_TARGET_QUESTIONS_PER_CHUNK = 2
+
+# --- Search ---
+# Results per /search request by default, and at most
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 200
+# Prefix queries ("net*") shorter than this are not expanded, and expand to at most this many index terms
+SEARCH_MIN_PREFIX_CHARS = 2
+SEARCH_MAX_PREFIX_TERMS = 50
+
+# --- Generation Planner ---
+# Largest number of questions requested from Gemini in a single call; bigger requests fan out
+PLANNER_QUESTIONS_PER_CALL = 10
+# Gemini calls run at the same time for one request
+PLANNER_MAX_CONCURRENT_CALLS = 4
+# Pages per context segment in 'full' mode (segments are the unit parts are packed from)
+PLANNER_SEGMENT_PAGES = 10
+# Follow-up rounds used to make up for calls that returned too few (or duplicate) questions
+PLANNER_TOP_UP_ROUNDS = 2
+
+# --- Near-Duplicate Detection ---
+# What to do with new questions that closely match an existing one: "reject", "flag" or "off"
+NEAR_DUPLICATE_ACTION = "reject"
+# Jaccard similarity (of question + correct-option word shingles) at or above which questions count as near-duplicates
+NEAR_DUPLICATE_THRESHOLD = 0.7
+# MinHash signature length (one-permutation bins) per question; split into LSH bands of equal size.
+# Questions only have a few dozen shingles, so larger values mostly add empty, densified bins.
+MINHASH_NUM_PERM = 32
+
+# --- Prompt History ---
+# How existing bank questions are summarised in generation prompts: "sample_digest", "stems" or "full"
+HISTORY_STRATEGY = "sample_digest"
+# Maximum estimated tokens for the "Existing Question Bank" prompt section
+HISTORY_TOKEN_BUDGET = 4000
+# Number of questions shown in full (with options) as style examples in "sample_digest" mode
+HISTORY_FULL_EXAMPLES = 5
+
+# --- Background Jobs ---
+# Backend that runs queued /generate and /format_examples jobs: "thread" (in-process pool) or "inline"
+JOB_BACKEND = "thread"
+# Maximum jobs running at once across all topics
+JOB_MAX_CONCURRENT = 4
+# Maximum jobs running at once for a single topic
+JOB_MAX_PER_TOPIC = 1
+# Ingest jobs (queued by uploads) run in their own lane of this many slots, so they never hold up /generate for a topic
+JOB_INGEST_MAX_CONCURRENT = 1
+# How long finished jobs stay available at /jobs/<id>
+JOB_RETENTION_SECONDS = 3600
+# Longest a request sent with "wait": true blocks on its job; after that it gets the usual 202 and job id
+JOB_WAIT_TIMEOUT_SECONDS = 600
+# Retry-After sent with the 429 /generate_stream returns while its topic (or every job slot) is busy
+STREAM_BUSY_RETRY_AFTER_SECONDS = 5
+
+# --- Bulk Generation ---
+# Topics generated at once by bulk_generate.py (each fans out into up to PLANNER_MAX_CONCURRENT_CALLS calls)
+BULK_WORKERS = 2
+# Progress of the last bulk run, so an interrupted run can be resumed with --resume
+BULK_CHECKPOINT_FILE = os.path.join(CACHE_DIR_NAME, "bulk_generate.json")
+# Output tokens assumed per question when bulk_generate.py reserves a topic's share of --max-tokens
+BULK_OUTPUT_TOKENS_PER_QUESTION = 250
@@ -0,0 +1,194 @@
+# content_store.py
+"""
+Content-addressed storage for uploaded context PDFs.
+
+Uploads are written straight to a temp file inside the store while being
+hashed, so a file is never held in memory and never copied a second time.
+Once complete, the file is renamed to <store>/<sha[:2]>/<sha256>.pdf (or
+discarded if that content is already stored) and hardlinked into the topic's
+context folder, so the same deck uploaded to several topics uses its disk
+space once. The store lives in TOPICS_BASE_DIR/.store so hardlinks stay on
+one filesystem; if linking fails anyway the file is copied.
+
+A stored file whose link count is back to 1 is linked from no topic any more
+(its PDFs were deleted or replaced by other content). collect_garbage() removes
+those, and upload leftovers older than CONTENT_STORE_TMP_MAX_AGE_SECONDS; it
+runs after an upload replaces a file and after ingestion notices deleted PDFs,
+or from the command line (e.g. after deleting a topic folder):
+    python content_store.py gc
+Storing and linking (store_upload) and collection hold the store's lock, so a
+deduplicated upload never links a file that is being collected.
+"""
+import argparse
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+import config
+from fs_utils import file_lock
+from log_utils import get_logger
+
+logger = get_logger(__name__)
+
+PDF_MAGIC = b"%PDF-"
+
+class UploadTooLarge(Exception):
+    """Raised while writing an upload that exceeds UPLOAD_MAX_FILE_BYTES."""
+
+def get_store_dir() -> Path:
+    return Path(config.TOPICS_BASE_DIR) / config.CONTENT_STORE_DIR_NAME
+
+def _lock_file() -> Path:
+    return get_store_dir() / "store.lock"
+
+class HashingUpload:
+    """
+    A write-only temp file in the store that hashes and counts what is written.
+    Used as the multipart parser's stream, so uploads go to disk in chunks as they arrive.
+    """
+
+    def __init__(self, max_bytes: int = None):
+        tmp_dir = get_store_dir() / "tmp"
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=tmp_dir, suffix=".upload")
+        self.path = Path(path)
+        self.max_bytes = max_bytes or config.UPLOAD_MAX_FILE_BYTES
+        self.size = 0
+        self.head = b""
+        self._file = os.fdopen(fd, 'w+b')
+        self._sha = hashlib.sha256()
+
+    def write(self, data: bytes) -> int:
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise UploadTooLarge(f"File exceeds the {self.max_bytes // (1024 * 1024)} MB upload limit")
+        if len(self.head) < len(PDF_MAGIC):
+            self.head += data[:len(PDF_MAGIC) - len(self.head)]
+        self._sha.update(data)
+        return self._file.write(data)
+
+    # The multipart parser rewinds and may read the stream back; FileStorage needs these too
+    def seek(self, *args):
+        return self._file.seek(*args)
+
+    def read(self, *args):
+        return self._file.read(*args)
+
+    def tell(self):
+        return self._file.tell()
+
+    def flush(self):
+        self._file.flush()
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def close(self):
+        self._file.close()
+
+    @property
+    def sha256(self) -> str:
+        return self._sha.hexdigest()
+
+    def is_pdf(self) -> bool:
+        return self.head == PDF_MAGIC
+
+    def discard(self):
+        self.close()
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+def commit(upload: HashingUpload) -> tuple[Path, bool]:
+    """Moves a finished upload to its content address. Returns (stored path, whether the content was already stored)."""
+    upload.flush()
+    os.fsync(upload._file.fileno())
+    upload.close()
+    sha = upload.sha256
+    stored = get_store_dir() / sha[:2] / f"{sha}.pdf"
+    if stored.exists():
+        upload.discard()
+        return stored, True
+    stored.parent.mkdir(parents=True, exist_ok=True)
+    os.chmod(upload.path, 0o444) # Shared by every topic linking to it; never edited in place
+    os.replace(upload.path, stored)
+    return stored, False
+
+def link_into(stored: Path, target: Path) -> bool:
+    """
+    Places stored content at target (hardlink, or copy across filesystems), replacing any
+    other file there. Returns False if target already is that stored file.
+    """
+    try:
+        if os.path.samefile(stored, target):
+            return False
+    except FileNotFoundError:
+        pass
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp_target = target.with_name(f".{target.name}.linking")
+    try:
+        tmp_target.unlink()
+    except FileNotFoundError:
+        pass
+    try:
+        os.link(stored, tmp_target)
+    except OSError as e:
+        logger.warning(f"Could not hardlink {stored} ({e}); copying instead.")
+        shutil.copy2(stored, tmp_target)
+        os.chmod(tmp_target, 0o644)
+    os.replace(tmp_target, target) # Readers see the old file or the new one, never a partial copy
+    return True
+
+def store_upload(upload: HashingUpload, target: Path) -> tuple[Path, bool, bool]:
+    """
+    commit()s upload and link_into()s target under the store's lock.
+    Returns (stored path, whether the content was already stored, whether target changed).
+    """
+    with file_lock(_lock_file()):
+        stored, deduplicated = commit(upload)
+        return stored, deduplicated, link_into(stored, target)
+
+# --- Garbage collection ---
+
+def collect_garbage() -> dict:
+    """
+    Removes stored files no topic links to (link count 1) and stale upload temp files.
+    Returns {"removed", "freed_bytes"}.
+    """
+    summary = {"removed": 0, "freed_bytes": 0}
+    store_dir = get_store_dir()
+    if not store_dir.is_dir():
+        return summary
+    stale_before = time.time() - config.CONTENT_STORE_TMP_MAX_AGE_SECONDS
+    with file_lock(_lock_file()):
+        candidates = [(path, False) for path in store_dir.glob("??/*.pdf")]
+        candidates += [(path, True) for path in store_dir.glob("tmp/*.upload")]
+        for path, is_tmp in candidates:
+            try:
+                st = path.stat()
+                in_use = st.st_mtime > stale_before if is_tmp else st.st_nlink > 1
+                if in_use:
+                    continue
+                path.unlink()
+            except FileNotFoundError:
+                continue
+            summary["removed"] += 1
+            summary["freed_bytes"] += st.st_size
+    if summary["removed"]:
+        logger.info(f"Content store: removed {summary['removed']} unreferenced file(s), "
+                    f"freeing {summary['freed_bytes'] / (1024 * 1024):.1f} MB.")
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the content store of uploaded PDFs.")
+    parser.add_argument("command", choices=["gc"], help="gc: remove stored PDFs that no topic links to any more")
+    parser.parse_args()
+    summary = collect_garbage()
+    print(f"Removed {summary['removed']} file(s), freed {summary['freed_bytes'] / (1024 * 1024):.1f} MB.")
+
+if __name__ == "__main__":
+    main()
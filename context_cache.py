@@ -0,0 +1,215 @@
+# context_cache.py
+"""
+Provider-side caching of large generation contexts (Gemini explicit context caching).
+
+The extracted text of a file set is registered with the provider once and later
+generation prompts only reference it, so repeated generations over the same
+lecture decks stop re-sending hundreds of thousands of tokens. Entries are keyed
+by the content hash of (backend, model, context) and reused until shortly before
+their TTL runs out; at most CONTEXT_CACHE_MAX_ENTRIES are kept (the oldest is
+deleted, since the provider bills storage per hour).
+
+get() returns None whenever caching is off, the context is below
+CONTEXT_CACHE_MIN_TOKENS, the backend has no caching, or creating the cache
+failed; callers then send the context inline. A cache the provider dropped early
+shows up as a "not found" error on use (is_missing_cache_error), after which the
+caller invalidates it and falls back inline as well.
+
+Backends follow config.GEMINI_BACKEND: "google" uses google.generativeai.caching,
+"fake" the local stand-in in fake_gemini.py.
+"""
+import datetime
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+import config
+import metrics
+from gemini_client import GeminiUnavailable
+from text_utils import estimate_tokens
+from log_utils import get_logger
+
+logger = get_logger(__name__)
+
+LOOKUPS = metrics.counter("mcq_gemini_context_cache_lookups_total", "Context cache lookups for large contexts.", ("result",))
+CACHED_TOKENS = metrics.counter("mcq_gemini_context_cache_tokens_total",
+                                "Estimated context tokens uploaded to caches and served from them.", ("kind",))
+
+class CachedContext:
+    """A provider cache holding one context, and a model that generates against it."""
+
+    def __init__(self, key: str, name: str, model, tokens: int, expires_at: float):
+        self.key = key
+        self.name = name
+        self.model = model
+        self.tokens = tokens
+        self.expires_at = expires_at # time.monotonic()
+        self.uses = 0
+
+# --- Backends ---
+
+def _create_google_cache(contents: str, ttl_seconds: float) -> tuple[str, object]:
+    import google.generativeai as genai
+    from google.generativeai import caching
+    cache = caching.CachedContent.create(model=f"models/{config.GEMINI_MODEL_NAME}", display_name="mcq-context",
+                                         contents=[contents], ttl=datetime.timedelta(seconds=ttl_seconds))
+    return cache.name, genai.GenerativeModel.from_cached_content(cached_content=cache)
+
+def _delete_google_cache(name: str):
+    from google.generativeai import caching
+    caching.CachedContent.get(name).delete()
+
+def _create_fake_cache(contents: str, ttl_seconds: float) -> tuple[str, object]:
+    import fake_gemini
+    cache = fake_gemini.create_cached_content(config.GEMINI_MODEL_NAME, contents, ttl_seconds)
+    return cache.name, fake_gemini.FakeGenerativeModel.from_cached_content(cache)
+
+def _delete_fake_cache(name: str):
+    import fake_gemini
+    fake_gemini.delete_cached_content(name)
+
+# (create(contents, ttl_seconds) -> (cache name, model), delete(cache name)) per config.GEMINI_BACKEND
+CACHE_BACKENDS = {"google": (_create_google_cache, _delete_google_cache), "fake": (_create_fake_cache, _delete_fake_cache)}
+
+# --- Cache ---
+
+_ENTRIES: "OrderedDict[str, CachedContext]" = OrderedDict() # key -> entry, oldest first
+_FAILED: dict[str, float] = {} # key -> monotonic time after which creating it may be retried
+_CREATING: dict[str, threading.Lock] = {} # One creation per key at a time
+_LOCK = threading.Lock()
+_STATS = {"created": 0, "hits": 0, "create_failures": 0, "invalidated": 0, "expired": 0, "evicted": 0,
+          "uploaded_tokens": 0, "served_tokens": 0}
+
+def context_key(contents: str) -> str:
+    return hashlib.sha256(f"{config.GEMINI_BACKEND}\0{config.GEMINI_MODEL_NAME}\0{contents}".encode('utf-8')).hexdigest()
+
+def is_cacheable(contents: str) -> bool:
+    return (config.CONTEXT_CACHE_ENABLED and config.GEMINI_BACKEND in CACHE_BACKENDS
+            and estimate_tokens(contents) >= config.CONTEXT_CACHE_MIN_TOKENS)
+
+def _current_entry(key: str) -> CachedContext:
+    """The live entry for key, dropping it if it is about to expire. Call with _LOCK held."""
+    entry = _ENTRIES.get(key)
+    if entry is not None and entry.expires_at - config.CONTEXT_CACHE_EXPIRY_MARGIN_SECONDS <= time.monotonic():
+        del _ENTRIES[key]
+        _STATS["expired"] += 1
+        return None
+    return entry
+
+def get(contents: str, client=None) -> CachedContext:
+    """
+    Returns the provider cache holding contents, creating it if needed (through client's
+    limiter, retries and breaker when given), or None if the contents should be sent inline.
+    """
+    if not is_cacheable(contents):
+        return None
+    key = context_key(contents)
+    with _LOCK:
+        entry = _current_entry(key)
+        if entry is None and _FAILED.get(key, 0) > time.monotonic():
+            LOOKUPS.inc(result="failed_recently")
+            return None
+        creating = _CREATING.setdefault(key, threading.Lock())
+    if entry is not None:
+        LOOKUPS.inc(result="hit")
+        return entry
+
+    with creating:
+        with _LOCK: # Another thread may have created it (or failed to) meanwhile
+            entry = _current_entry(key)
+            failed = entry is None and _FAILED.get(key, 0) > time.monotonic()
+        if entry is not None:
+            LOOKUPS.inc(result="hit")
+            return entry
+        entry = None if failed else _create(key, contents, client)
+    with _LOCK:
+        _CREATING.pop(key, None)
+    return entry
+
+def _create(key: str, contents: str, client) -> CachedContext:
+    create, _ = CACHE_BACKENDS[config.GEMINI_BACKEND]
+    ttl = config.CONTEXT_CACHE_TTL_SECONDS
+    tokens = estimate_tokens(contents)
+    try:
+        with metrics.timed("gemini_context_cache_create"):
+            expires_at = time.monotonic() + ttl # Taken before the call, so the provider's TTL never outlives ours
+            call = lambda: create(contents, ttl)
+            name, model = client.run(contents, call) if client is not None else call()
+    except GeminiUnavailable as e: # Rate limited or circuit open: not the context's fault, so no back-off
+        LOOKUPS.inc(result="unavailable")
+        logger.warning(f"Context cache: could not create a cache now ({e}); sending the context inline.")
+        return None
+    except Exception as e:
+        LOOKUPS.inc(result="create_failed")
+        with _LOCK:
+            _STATS["create_failures"] += 1
+            _FAILED[key] = time.monotonic() + config.CONTEXT_CACHE_RETRY_SECONDS
+        logger.warning(f"Context cache: creating a cache of ~{tokens} tokens failed ({e}); sending the context inline.")
+        return None
+
+    entry = CachedContext(key, name, model, tokens, expires_at)
+    with _LOCK:
+        _ENTRIES[key] = entry
+        _FAILED.pop(key, None)
+        _STATS["created"] += 1
+        _STATS["uploaded_tokens"] += tokens
+        evicted = []
+        while len(_ENTRIES) > config.CONTEXT_CACHE_MAX_ENTRIES:
+            evicted.append(_ENTRIES.popitem(last=False)[1])
+        _STATS["evicted"] += len(evicted)
+    LOOKUPS.inc(result="created")
+    CACHED_TOKENS.inc(tokens, kind="uploaded")
+    logger.info(f"Context cache: cached ~{tokens} tokens as {name} for {ttl}s.")
+    for old in evicted:
+        _delete(old)
+    return entry
+
+def _delete(entry: CachedContext):
+    """Deletes the provider cache (best effort: it expires on its own anyway)."""
+    _, delete = CACHE_BACKENDS[config.GEMINI_BACKEND]
+    try:
+        delete(entry.name)
+    except Exception as e:
+        logger.warning(f"Context cache: could not delete {entry.name}: {e}")
+
+def record_use(entry: CachedContext):
+    """Counts a successful generation that referenced entry instead of sending its tokens."""
+    with _LOCK:
+        entry.uses += 1
+        _STATS["hits"] += 1
+        _STATS["served_tokens"] += entry.tokens
+    CACHED_TOKENS.inc(entry.tokens, kind="served")
+
+def invalidate(entry: CachedContext):
+    """Forgets entry (e.g. after the provider reported it missing)."""
+    with _LOCK:
+        if _ENTRIES.get(entry.key) is entry:
+            del _ENTRIES[entry.key]
+            _STATS["invalidated"] += 1
+
+def is_missing_cache_error(error: Exception) -> bool:
+    """True if a failed call was rejected because its cache no longer exists (expired or deleted)."""
+    while error is not None:
+        code = getattr(error, 'code', None)
+        code = getattr(code, 'value', code)
+        if code == 404:
+            return True
+        error = error.__cause__
+    return False
+
+def clear():
+    """Deletes every provider cache this process created."""
+    with _LOCK:
+        entries = list(_ENTRIES.values())
+        _ENTRIES.clear()
+    for entry in entries:
+        _delete(entry)
+
+def get_stats() -> dict:
+    """Entry counts and estimated tokens uploaded to, and served from, context caches."""
+    with _LOCK:
+        stats = dict(_STATS)
+        stats["entries"] = len(_ENTRIES)
+    stats["enabled"] = config.CONTEXT_CACHE_ENABLED
+    stats["tokens_saved"] = stats["served_tokens"] - stats["uploaded_tokens"]
+    return stats
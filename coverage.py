@@ -0,0 +1,123 @@
+# coverage.py
+"""
+Per-topic coverage index: how many bank questions each context PDF, page range
+and chunk already has, and which material still needs questions.
+
+Chunks come from the retrieval index (so PDFs are extracted and chunked once).
+Each question is attributed to its best-matching BM25 chunk among the PDFs in
+its source_pdfs tags; untagged questions may match any chunk. A chunk is
+covered once COVERAGE_TARGET_QUESTIONS_PER_CHUNK questions are attributed to
+it. The result is cached in memory per topic until the bank or a PDF changes.
+"""
+import math
+import threading
+import config
+import data_manager as dm
+import retrieval
+from log_utils import get_logger
+
+logger = get_logger(__name__)
+
+_TOPIC_COVERAGE: dict[str, tuple] = {} # topic -> (cache key, chunks, per-chunk question counts)
+_LOCK = threading.Lock()
+
+def _count_questions(chunks: list[dict], questions: list[dict]) -> list[int]:
+    counts = [0] * len(chunks)
+    if not chunks:
+        return counts
+    bm25 = retrieval.Bm25(chunks)
+    for q in questions:
+        scores = bm25.scores(retrieval.question_query_terms(q))
+        sources = q.get('source_pdfs')
+        if isinstance(sources, list):
+            scores = {pos: score for pos, score in scores.items() if chunks[pos]["file"] in sources}
+        if scores:
+            counts[max(scores, key=scores.get)] += 1
+    return counts
+
+def get_chunk_coverage(topic_name: str) -> tuple[list[dict], list[int]]:
+    """Returns (chunks of all the topic's context PDFs, bank questions attributed to each chunk)."""
+    fingerprint = dm.get_context_fingerprint(topic_name)
+    key = (dm.get_bank_stamp(topic_name), fingerprint, config.QUESTION_BANK_BACKEND)
+    with _LOCK:
+        cached = _TOPIC_COVERAGE.get(topic_name)
+    if cached and cached[0] == key:
+        return cached[1], cached[2]
+
+    filenames = [name for name, _, _ in fingerprint]
+    index = retrieval.update_topic_index(topic_name, filenames)
+    chunks = [c for name in filenames for c in index["files"].get(name, {}).get("chunks", [])]
+    counts = _count_questions(chunks, dm.load_question_bank(topic_name))
+    with _LOCK:
+        _TOPIC_COVERAGE[topic_name] = (key, chunks, counts)
+    return chunks, counts
+
+def _eligible(chunk: dict) -> bool:
+    return chunk["length"] >= retrieval.MIN_CHUNK_TERMS # Title/agenda slides never need questions
+
+def get_coverage(topic_name: str, include_chunks: bool = False) -> dict:
+    """
+    Coverage stats per context PDF: tagged questions, pages, chunks, covered chunks,
+    missing questions ("deficit") and a status of new, partial or covered.
+    With include_chunks each file also lists its chunks' page ranges and question counts.
+    """
+    target = config.COVERAGE_TARGET_QUESTIONS_PER_CHUNK
+    chunks, counts = get_chunk_coverage(topic_name)
+    tagged = dm.get_bank_sources(topic_name)
+
+    files = {}
+    for chunk, count in zip(chunks, counts):
+        entry = files.setdefault(chunk["file"], {"file": chunk["file"], "questions": tagged["sources"].get(chunk["file"], 0),
+                                                 "pages": 0, "chunks": 0, "covered_chunks": 0, "deficit": 0})
+        entry["pages"] = max(entry["pages"], chunk["page_end"])
+        if include_chunks:
+            entry.setdefault("chunk_coverage", []).append(
+                {"page_start": chunk["page_start"], "page_end": chunk["page_end"], "questions": count})
+        if not _eligible(chunk):
+            continue
+        entry["chunks"] += 1
+        entry["covered_chunks"] += count >= target
+        entry["deficit"] += max(0, target - count)
+
+    for entry in files.values():
+        entry["coverage"] = round(entry["covered_chunks"] / entry["chunks"], 3) if entry["chunks"] else 1.0
+        if entry["questions"] == 0:
+            entry["status"] = "new"
+        elif entry["deficit"] == 0:
+            entry["status"] = "covered"
+        else:
+            entry["status"] = "partial"
+    return {"target_per_chunk": target, "files": sorted(files.values(), key=lambda e: e["file"]),
+            "total_questions": tagged["total"], "untagged_questions": tagged["untagged"],
+            "deficit": sum(e["deficit"] for e in files.values())}
+
+def gap_segments(topic_name: str, filenames: list[str], num_questions: int) -> list[dict]:
+    """
+    Segments for 'fill_gaps' generation: the least-covered chunks of the selected PDFs,
+    skipping chunks (and so whole files) that already reach the coverage target. Each
+    segment's weight is its missing question count, so the planner allocates the requested
+    questions to the least-covered material. Falls back to the least-covered chunks overall
+    when everything selected is already covered.
+    """
+    target = config.COVERAGE_TARGET_QUESTIONS_PER_CHUNK
+    chunks, counts = get_chunk_coverage(topic_name)
+    selected = set(filenames)
+    eligible = [pos for pos, c in enumerate(chunks) if c["file"] in selected and _eligible(c)]
+    gaps = [pos for pos in eligible if counts[pos] < target]
+    if gaps:
+        skipped = sorted(selected - {chunks[pos]["file"] for pos in gaps})
+        if skipped:
+            logger.info(f"Fill gaps: skipping fully covered file(s): {', '.join(skipped)}")
+    else:
+        logger.info("Fill gaps: all selected material reaches the coverage target; using the least-covered chunks.")
+        gaps = eligible
+
+    calls = max(1, math.ceil(num_questions / config.PLANNER_QUESTIONS_PER_CALL))
+    candidates = [chunks[pos] for pos in gaps]
+    picked = retrieval.select_chunks(candidates, [counts[pos] for pos in gaps],
+                                     config.RETRIEVAL_TOKEN_BUDGET * calls, config.RETRIEVAL_TOP_K * calls)
+    count_by_id = {chunks[pos]["id"]: counts[pos] for pos in gaps}
+    logger.info(f"Fill gaps: selected {len(picked)} of {len(eligible)} chunk(s) ({len(gaps)} under-covered).")
+    return [{"file": c["file"], "page_start": c["page_start"], "page_end": c["page_end"],
+             "text": f"[Pages {c['page_start']}-{c['page_end']}]\n{c['text']}\n\n",
+             "weight": max(1, target - count_by_id[c["id"]])} for c in picked]
@@ -1,8 +1,23 @@
 # data_manager.py
+import base64
+import bisect
+import hashlib
+import heapq
 import json
+import math
 import os
+import threading
+from collections import Counter, OrderedDict
 from pathlib import Path
 import config # Import your config file
+import bank_store
+import dedupe
+import metrics
+from fs_utils import atomic_write_json
+from text_utils import estimate_tokens, tokenize
+from log_utils import get_logger
+
+logger = get_logger(__name__)
 
 def get_topic_path(topic_name: str) -> Path:
     """Gets the base directory path for a given topic."""
@@ -18,22 +33,42 @@ def get_examples_folder(topic_name: str) -> Path:
 
 def get_question_bank_file(topic_name: str) -> Path:
     """Gets the question bank JSON file path for a topic."""
-    return get_topic_path(topic_name) / "question_bank.json"
+    return get_topic_path(topic_name) / bank_store.JSON_BANK_FILENAME
+
+def get_bank_store() -> bank_store.BankStore:
+    """Gets the configured question bank storage backend."""
+    return bank_store.get_store(config.QUESTION_BANK_BACKEND)
+
+def get_bank_stamp(topic_name: str) -> tuple:
+    """Returns a value that changes whenever the topic's stored bank changes."""
+    return get_bank_store().stamp(get_topic_path(topic_name))
+
+def get_context_fingerprint(topic_name: str) -> tuple:
+    """(name, size, mtime_ns) of each PDF in the topic's context folder, sorted; changes whenever a PDF does."""
+    try:
+        with os.scandir(get_context_folder(topic_name)) as entries:
+            pdfs = [entry for entry in entries if entry.name.endswith('.pdf') and entry.is_file()]
+            return tuple(sorted((entry.name, entry.stat().st_size, entry.stat().st_mtime_ns) for entry in pdfs))
+    except (FileNotFoundError, NotADirectoryError):
+        return ()
 
 def get_available_topics() -> list[str]:
-    """Lists available topics by looking for directories in the base path."""
+    """Lists available topics by looking for directories in the base path (skipping hidden ones such as the upload store)."""
     base_path = Path(config.TOPICS_BASE_DIR)
     if not base_path.is_dir():
         return []
-    return sorted([d.name for d in base_path.iterdir() if d.is_dir()])
+    return sorted([d.name for d in base_path.iterdir() if d.is_dir() and not d.name.startswith('.')])
 
 def create_topic(topic_name: str) -> bool:
     """Creates the necessary directory structure for a new topic."""
     if not topic_name or topic_name.isspace():
-         print("Error: Topic name cannot be empty.")
+         logger.error("Topic name cannot be empty.")
          return False
+    if topic_name.startswith('.'):
+        logger.error(f"Topic name '{topic_name}' cannot start with a dot (reserved for internal folders).")
+        return False
     if topic_name in get_available_topics():
-        print(f"Topic '{topic_name}' already exists.")
+        logger.info(f"Topic '{topic_name}' already exists.")
         return True # Or False, depending on desired behavior
 
     topic_path = get_topic_path(topic_name)
@@ -46,77 +81,549 @@ def create_topic(topic_name: str) -> bool:
         examples_path.mkdir(exist_ok=True)
         # Create an empty question bank file
         save_question_bank(topic_name, [])
-        print(f"Created topic structure for '{topic_name}' at {topic_path}")
+        logger.info(f"Created topic structure for '{topic_name}' at {topic_path}")
         return True
     except OSError as e:
-        print(f"Error creating topic '{topic_name}': {e}")
+        logger.error(f"Error creating topic '{topic_name}': {e}")
         return False
 
+# --- In-Memory Bank Cache ---
+# Parsed banks are kept per process and reused while the store's stamp (file inode/size/mtime)
+# is unchanged, so writes by other workers or by hand are picked up on the next read.
+
+_BANK_CACHE: OrderedDict = OrderedDict() # topic -> (backend, stamp, questions, estimated bytes), least recently used first
+_BANK_CACHE_LOCK = threading.Lock()
+_BANK_CACHE_STATS = {"hits": 0, "misses": 0, "write_throughs": 0, "evictions": 0, "invalidations": 0}
+
+def _estimate_bank_bytes(questions: list[dict]) -> int:
+    # Text sizes plus a fixed per-question overhead; cheap compared with measuring the objects
+    total = 0
+    for q in questions:
+        total += 200 + len(q.get('question') or '')
+        options = q.get('options')
+        if isinstance(options, dict):
+            total += sum(len(str(v)) for v in options.values())
+    return total
+
+def _bank_cache_get(topic_name: str, backend: str, stamp) -> list[dict]:
+    """Returns a copy of the cached bank if it is still current, else None (counting the hit or miss)."""
+    if not config.BANK_CACHE_ENABLED:
+        return None
+    with _BANK_CACHE_LOCK:
+        entry = _BANK_CACHE.get(topic_name)
+        if entry and stamp is not None and entry[0] == backend and entry[1] == stamp:
+            _BANK_CACHE.move_to_end(topic_name)
+            _BANK_CACHE_STATS["hits"] += 1
+            return list(entry[2]) # Callers may append to or reorder the list; the questions themselves are shared
+        _BANK_CACHE_STATS["misses"] += 1
+        return None
+
+def _bank_cache_put(topic_name: str, backend: str, stamp, questions: list[dict], write_through: bool = False):
+    if not config.BANK_CACHE_ENABLED or stamp is None:
+        return
+    size = _estimate_bank_bytes(questions)
+    with _BANK_CACHE_LOCK:
+        _BANK_CACHE.pop(topic_name, None)
+        if size > config.BANK_CACHE_MAX_BYTES:
+            return
+        _BANK_CACHE[topic_name] = (backend, stamp, list(questions), size)
+        if write_through:
+            _BANK_CACHE_STATS["write_throughs"] += 1
+        total = sum(entry[3] for entry in _BANK_CACHE.values())
+        while total > config.BANK_CACHE_MAX_BYTES:
+            _, evicted = _BANK_CACHE.popitem(last=False)
+            total -= evicted[3]
+            _BANK_CACHE_STATS["evictions"] += 1
+
+def _bank_cache_append(topic_name: str, backend: str, stamp_before, stamp_after, added: list[dict]):
+    """
+    Write-through for add_stamped(): extends the cached bank if it is at stamp_before,
+    else drops it (see BankStore.add_stamped).
+    """
+    with _BANK_CACHE_LOCK:
+        entry = _BANK_CACHE.get(topic_name)
+    if entry and stamp_before is not None and entry[0] == backend and entry[1] == stamp_before:
+        _bank_cache_put(topic_name, backend, stamp_after, entry[2] + added, write_through=True)
+    else:
+        _bank_cache_invalidate(topic_name)
+
+def _bank_cache_invalidate(topic_name: str):
+    with _BANK_CACHE_LOCK:
+        if _BANK_CACHE.pop(topic_name, None) is not None:
+            _BANK_CACHE_STATS["invalidations"] += 1
+
+def get_bank_cache_stats() -> dict:
+    """Hit/miss/eviction counters and current size of the in-memory bank cache."""
+    with _BANK_CACHE_LOCK:
+        stats = dict(_BANK_CACHE_STATS)
+        stats["topics"] = len(_BANK_CACHE)
+        stats["estimated_bytes"] = sum(entry[3] for entry in _BANK_CACHE.values())
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else None
+    stats["max_bytes"] = config.BANK_CACHE_MAX_BYTES
+    stats["enabled"] = config.BANK_CACHE_ENABLED
+    return stats
+
 def load_question_bank(topic_name: str) -> list[dict]:
     """Loads the question bank for a specific topic."""
-    filepath = get_question_bank_file(topic_name)
-    if not filepath.exists():
-        print(f"Question bank file not found for topic '{topic_name}'. Starting fresh.")
+    store = get_bank_store()
+    topic_path = get_topic_path(topic_name)
+    # The stamp is read before loading, so a concurrent write can only make the entry look stale, never current
+    stamp = store.stamp(topic_path)
+    cached = _bank_cache_get(topic_name, store.name, stamp)
+    if cached is not None:
+        return cached
+    if not store.exists(topic_path):
+        logger.info(f"Question bank file not found for topic '{topic_name}'. Starting fresh.")
         return []
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            history = json.load(f)
-            if isinstance(history, list):
-                print(f"Loaded {len(history)} questions for topic '{topic_name}' from {filepath}")
-                return history
-            else:
-                print(f"Warning: Invalid format in bank file {filepath}. Expected a list. Returning empty list.")
-                return []
+        with metrics.timed("bank_load"):
+            history = store.load(topic_path)
+        logger.info(f"Loaded {len(history)} questions for topic '{topic_name}' ({store.name} store)")
+        _bank_cache_put(topic_name, store.name, stamp, history)
+        return history
     except json.JSONDecodeError:
-        print(f"Warning: Could not decode JSON from bank file {filepath}. File might be corrupt. Returning empty list.")
+        logger.warning(f"Could not decode JSON from bank for topic '{topic_name}'. File might be corrupt. Returning empty list.")
+        return []
+    except ValueError as e:
+        logger.warning(f"{e} Returning empty list.")
         return []
     except Exception as e:
-        print(f"Error loading question bank file {filepath}: {e}")
+        logger.error(f"Error loading question bank for topic '{topic_name}': {e}")
+        return []
+
+def load_questions_for_sources(topic_name: str, source_pdfs: list[str]) -> list[dict]:
+    """
+    Loads only the questions tagged with at least one of source_pdfs: from the cached bank
+    via the source index, or filtered by the store when the bank cache is disabled.
+    """
+    store = get_bank_store()
+    topic_path = get_topic_path(topic_name)
+    if not store.exists(topic_path):
+        return []
+    if config.BANK_CACHE_ENABLED:
+        stamp = store.stamp(topic_path)
+        questions = load_question_bank(topic_name)
+        index = get_source_index(topic_name, stamp, questions)
+        positions = {pos for pdf in source_pdfs for pos in index["by_source"].get(pdf, ())}
+        return [questions[pos] for pos in sorted(positions)]
+    try:
+        return store.query(topic_path, source_pdfs)
+    except Exception as e:
+        logger.error(f"Error querying question bank for topic '{topic_name}': {e}")
         return []
 
 def save_question_bank(topic_name: str, questions: list[dict]):
     """Saves the list of questions for a specific topic."""
-    filepath = get_question_bank_file(topic_name)
+    store = get_bank_store()
+    topic_path = get_topic_path(topic_name)
     try:
-        # Ensure the parent directory exists
-        filepath.parent.mkdir(parents=True, exist_ok=True)
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(questions, f, indent=4)
-            print(f"Saved {len(questions)} questions for topic '{topic_name}' to {filepath}")
+        with metrics.timed("bank_save"):
+            store.save(topic_path, questions)
+        logger.info(f"Saved {len(questions)} questions for topic '{topic_name}' ({store.name} store)")
+        _bank_cache_put(topic_name, store.name, store.stamp(topic_path), questions, write_through=True)
     except Exception as e:
-        print(f"Error saving question bank file {filepath}: {e}")
+        _bank_cache_invalidate(topic_name)
+        logger.error(f"Error saving question bank for topic '{topic_name}': {e}")
+
+def rewrite_question_bank(topic_name: str, fn) -> list[dict]:
+    """
+    Replaces the topic's bank with fn(current questions) under the store's write lock, so questions
+    other workers add meanwhile are never overwritten (fn returning None keeps the bank unchanged).
+    Returns fn's result. Every in-memory index of the bank is dropped afterwards.
+    """
+    store = get_bank_store()
+    try:
+        with metrics.timed("bank_save"):
+            return store.rewrite(get_topic_path(topic_name), fn)
+    finally:
+        invalidate_topic_caches(topic_name)
 
-def add_questions_to_bank(topic_name: str, new_questions: list[dict]):
-    """Adds new, unique questions to the topic's bank."""
+def invalidate_topic_caches(topic_name: str):
+    """Drops the cached bank and its near-duplicate, search and source indexes, forcing reloads on next use."""
+    _bank_cache_invalidate(topic_name)
+    dedupe.invalidate(topic_name)
+    with _SEARCH_INDEX_LOCK:
+        _SEARCH_INDEXES.pop(topic_name, None)
+    with _SOURCE_INDEX_LOCK:
+        _SOURCE_INDEXES.pop(topic_name, None)
+
+def add_questions_to_bank(topic_name: str, new_questions: list[dict]) -> int:
+    """Adds new, unique questions to the topic's bank. Returns how many were added."""
     if not new_questions:
-        return
+        return 0
+
+    store = get_bank_store()
+    topic_path = get_topic_path(topic_name)
+    if config.NEAR_DUPLICATE_ACTION != 'off':
+        new_questions = dedupe.filter_near_duplicates(topic_name, new_questions, store.stamp(topic_path),
+                                                      lambda: load_question_bank(topic_name))
+        if not new_questions:
+            logger.info(f"No new unique questions found to add for topic '{topic_name}'.")
+            return 0
+
+    try:
+        with metrics.timed("bank_add"):
+            # Caches are extended only if they are at stamp_before (see BankStore.add_stamped)
+            added, stamp_before, stamp_after = store.add_stamped(topic_path, new_questions)
+    except json.JSONDecodeError as e:
+        dedupe.invalidate(topic_name)
+        _bank_cache_invalidate(topic_name)
+        # Never replace a damaged bank with just the new questions; leave it for manual repair
+        logger.error(f"Question bank for topic '{topic_name}' is corrupt ({e}). Refusing to overwrite it.")
+        raise
+    except Exception:
+        dedupe.invalidate(topic_name)
+        _bank_cache_invalidate(topic_name)
+        raise
+    if config.NEAR_DUPLICATE_ACTION != 'off':
+        dedupe.record_saved(topic_name, stamp_before, stamp_after)
+    if added:
+        _bank_cache_append(topic_name, store.name, stamp_before, stamp_after, added)
+        _search_index_append(topic_name, stamp_before, stamp_after, added)
+        logger.info(f"Added {len(added)} new unique questions to bank for topic '{topic_name}'.")
+    else:
+        logger.info(f"No new unique questions found to add for topic '{topic_name}'.")
+    return len(added)
 
-    current_bank = load_question_bank(topic_name)
-    existing_question_texts = {q.get('question', '').strip() for q in current_bank if q.get('question')}
-    added_count = 0
-
-    for q_new in new_questions:
-        q_text = q_new.get('question', '').strip()
-        # Add if it has text and is not already in the bank (case-sensitive check)
-        if q_text and q_text not in existing_question_texts:
-            current_bank.append(q_new)
-            existing_question_texts.add(q_text) # Add to set to prevent adding duplicates from the *new* list
-            added_count += 1
-
-    if added_count > 0:
-        print(f"Adding {added_count} new unique questions to bank for topic '{topic_name}'.")
-        save_question_bank(topic_name, current_bank)
+def export_question_bank(topic_name: str, filepath: Path = None) -> Path:
+    """Writes the topic's bank to a JSON file (question_bank.json by default) and returns its path."""
+    filepath = Path(filepath) if filepath else get_question_bank_file(topic_name)
+    store = get_bank_store()
+    topic_path = get_topic_path(topic_name)
+    json_store = bank_store.get_store("json")
+    is_bank_file = filepath.resolve() == json_store.bank_file(topic_path).resolve()
+    if is_bank_file and store is json_store:
+        logger.info(f"Question bank for topic '{topic_name}' is already stored in {filepath}")
+        return filepath # Rewriting it from a loaded copy could drop a concurrent add
+    questions = load_question_bank(topic_name)
+    if is_bank_file:
+        json_store.save(topic_path, questions) # Under the bank lock, so JSON store writers never see a partial file
     else:
-        print(f"No new unique questions found to add for topic '{topic_name}'.")
+        atomic_write_json(filepath, questions, indent=4)
+    logger.info(f"Exported {len(questions)} questions for topic '{topic_name}' to {filepath}")
+    return filepath
+
+def import_question_bank(topic_name: str, filepath: Path) -> int:
+    """Adds the questions from a JSON export file to the topic's bank. Returns how many were added."""
+    with open(filepath, 'r', encoding='utf-8') as f:
+        questions = json.load(f)
+    if not isinstance(questions, list):
+        raise ValueError(f"Invalid format in {filepath}. Expected a list.")
+    return add_questions_to_bank(topic_name, questions)
 
-def format_bank_for_prompt(question_bank: list[dict], relevant_source_pdfs: list[str] = None) -> str:
+# --- Bank Pages ---
+
+BANK_FIELDS = ("question", "options", "correct_answer", "source_pdfs")
+
+_SOURCE_INDEXES: dict[str, tuple] = {} # topic -> (bank stamp, source index)
+_SOURCE_INDEX_LOCK = threading.Lock()
+
+def _build_source_index(questions: list[dict]) -> dict:
+    by_source, untagged = {}, []
+    for pos, q in enumerate(questions):
+        sources = q.get('source_pdfs')
+        if not isinstance(sources, list) or not sources:
+            untagged.append(pos)
+            continue
+        for pdf in dict.fromkeys(sources):
+            by_source.setdefault(pdf, []).append(pos)
+    return {"count": len(questions), "by_source": by_source, "untagged": untagged}
+
+def get_source_index(topic_name: str, stamp, questions: list[dict]) -> dict:
     """
-    Formats question bank questions into a string for the Gemini prompt history.
-    If relevant_source_pdfs is provided, filters the bank to include only questions
-    derived from at least one of those PDFs.
+    Positions of the topic's questions per source PDF ({"count", "by_source", "untagged"}).
+    Reused while the bank stamp is unchanged; questions is the bank loaded after reading stamp.
     """
+    with _SOURCE_INDEX_LOCK:
+        cached = _SOURCE_INDEXES.get(topic_name)
+    if cached and cached[0] == stamp and cached[1]["count"] == len(questions):
+        return cached[1]
+    index = _build_source_index(questions)
+    with _SOURCE_INDEX_LOCK:
+        _SOURCE_INDEXES[topic_name] = (stamp, index)
+    return index
+
+def _encode_cursor(key: tuple) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode('utf-8')).decode('ascii').rstrip("=")
+
+def _decode_cursor(cursor: str, key_length: int) -> tuple:
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    if not isinstance(key, list) or len(key) != key_length or not all(isinstance(k, int) for k in key):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return tuple(key)
+
+def _sort_key(pos: int, seed) -> tuple:
+    # A per-position hash gives a random order that stays stable as questions are appended,
+    # so cursors from earlier pages remain valid while the bank grows
+    if seed is None:
+        return (pos,)
+    digest = hashlib.blake2b(f"{seed}:{pos}".encode('utf-8'), digest_size=8).digest()
+    return (int.from_bytes(digest, 'big'), pos)
+
+def query_question_bank(topic_name: str, sources: list[str] = None, cursor: str = None, limit: int = None,
+                        seed: str = None, fields: list[str] = None) -> dict:
+    """
+    Returns one page of the topic's bank: {"questions", "total", "next_cursor"}.
+    sources keeps questions tagged with any of those PDFs; seed orders the bank randomly
+    but reproducibly (quiz mode) instead of in insertion order; fields limits each
+    question to those keys (each always carries its bank position as "id").
+    next_cursor (None on the last page) fetches the following page with the same arguments.
+    Raises ValueError for a malformed cursor.
+    """
+    limit = min(limit or config.BANK_PAGE_DEFAULT_LIMIT, config.BANK_PAGE_MAX_LIMIT)
+    stamp = get_bank_stamp(topic_name)
+    questions = load_question_bank(topic_name)
+    index = get_source_index(topic_name, stamp, questions)
+
+    if sources:
+        positions = set()
+        for pdf in sources:
+            positions.update(index["by_source"].get(pdf, ()))
+    else:
+        positions = range(len(questions))
+    keys = sorted(_sort_key(pos, seed) for pos in positions)
+
+    start = 0
+    if cursor:
+        start = bisect.bisect_right(keys, _decode_cursor(cursor, 1 if seed is None else 2))
+    page_keys = keys[start:start + limit]
+    page = []
+    for key in page_keys:
+        q = questions[key[-1]]
+        item = {k: q[k] for k in fields if k in q} if fields else dict(q)
+        item["id"] = key[-1]
+        page.append(item)
+    next_cursor = _encode_cursor(page_keys[-1]) if page_keys and start + limit < len(keys) else None
+    return {"questions": page, "total": len(keys), "next_cursor": next_cursor}
+
+def get_bank_sources(topic_name: str) -> dict:
+    """Question counts per source PDF: {"total", "untagged", "sources": {pdf: count}}."""
+    stamp = get_bank_stamp(topic_name)
+    questions = load_question_bank(topic_name)
+    index = get_source_index(topic_name, stamp, questions)
+    return {"total": index["count"], "untagged": len(index["untagged"]),
+            "sources": {pdf: len(index["by_source"][pdf]) for pdf in sorted(index["by_source"])}}
+
+# --- Search Index ---
+# An in-memory inverted index per topic over each question's text, options and source PDF names,
+# holding the indexed questions too, so a search with a current index needs no bank load.
+# add_questions_to_bank appends to it when it was current at the pre-write stamp read under the
+# store's lock; any other change (a save, another worker, a hand edit) makes it rebuild from the bank.
+
+_SEARCH_INDEXES: dict[str, tuple] = {} # topic -> (bank stamp, search index)
+_SEARCH_INDEX_LOCK = threading.Lock()
+
+def _question_search_terms(q: dict) -> list[str]:
+    options = q.get('options') if isinstance(q.get('options'), dict) else {}
+    sources = q.get('source_pdfs') if isinstance(q.get('source_pdfs'), list) else []
+    return tokenize(" ".join([str(q.get('question') or '')] + [str(v) for v in options.values()] + [str(s) for s in sources]))
+
+def _index_questions(index: dict, questions: list[dict]):
+    """Adds questions to index as the positions following its current count."""
+    index["questions"].extend(questions)
+    for q in questions:
+        pos = index["count"]
+        terms = _question_search_terms(q)
+        for term, tf in Counter(terms).items():
+            postings = index["postings"].get(term)
+            if postings is None:
+                postings = index["postings"][term] = []
+                bisect.insort(index["terms"], term)
+            postings.append((pos, tf))
+        index["lengths"].append(len(terms))
+        index["total_length"] += len(terms)
+        index["count"] += 1
+
+def _new_search_index(questions: list[dict]) -> dict:
+    # "lock" guards in-place appends against concurrent searches of the same index
+    index = {"count": 0, "questions": [], "postings": {}, "terms": [], "lengths": [], "total_length": 0,
+             "lock": threading.Lock()}
+    _index_questions(index, questions)
+    return index
+
+def _current_search_index(topic_name: str, stamp) -> dict:
+    """The topic's search index if it was built (or last appended to) at stamp, else None."""
+    with _SEARCH_INDEX_LOCK:
+        cached = _SEARCH_INDEXES.get(topic_name)
+    if cached and stamp is not None and cached[0] == stamp:
+        return cached[1]
+    return None
+
+def get_search_index(topic_name: str, stamp, questions: list[dict]) -> dict:
+    """The topic's search index, reused while the bank stamp is unchanged; questions is the bank loaded after reading stamp."""
+    index = _current_search_index(topic_name, stamp)
+    if index is not None and index["count"] >= len(questions):
+        return index
+    index = _new_search_index(questions)
+    with _SEARCH_INDEX_LOCK:
+        _SEARCH_INDEXES[topic_name] = (stamp, index)
+    return index
+
+def _search_index_append(topic_name: str, stamp_before, stamp_after, added: list[dict]):
+    """
+    Extends the topic's index with questions just appended to the bank if it is at stamp_before,
+    else drops it for a rebuild (see BankStore.add_stamped).
+    """
+    with _SEARCH_INDEX_LOCK:
+        cached = _SEARCH_INDEXES.pop(topic_name, None)
+        if not cached or cached[0] != stamp_before or stamp_before is None:
+            return
+        index = cached[1]
+        with index["lock"]:
+            _index_questions(index, added)
+        _SEARCH_INDEXES[topic_name] = (stamp_after, index)
+
+def _parse_search_query(query: str, prefix_last: bool) -> list[tuple[str, bool]]:
+    """Splits a query into (term, is prefix) pairs; a trailing "*" (or prefix_last for the final word) marks a prefix."""
+    words = query.split()
+    parsed = []
+    for i, word in enumerate(words):
+        is_prefix = word.endswith('*') or (prefix_last and i == len(words) - 1)
+        for term in tokenize(word.rstrip('*'), drop_stopwords=not is_prefix):
+            parsed.append((term, False))
+        if is_prefix and parsed and len(parsed[-1][0]) >= config.SEARCH_MIN_PREFIX_CHARS:
+            parsed[-1] = (parsed[-1][0], True)
+    return parsed
+
+def _expand_prefix(index: dict, prefix: str) -> list[str]:
+    # Terms are kept sorted, so the matches are one contiguous run; the most widely used ones are kept
+    start = bisect.bisect_left(index["terms"], prefix)
+    end = bisect.bisect_left(index["terms"], prefix + "\uffff")
+    matches = index["terms"][start:end]
+    if len(matches) > config.SEARCH_MAX_PREFIX_TERMS:
+        matches = heapq.nlargest(config.SEARCH_MAX_PREFIX_TERMS, matches, key=lambda t: len(index["postings"][t]))
+    return matches
+
+def _score_index(index: dict, query_terms: list[tuple[str, bool]], allowed: set = None, limit_pos: int = None) -> dict[int, float]:
+    """BM25 scores {position: score} of questions matching every query term (prefix terms match any expansion)."""
+    k1, b = config.BM25_K1, config.BM25_B
+    n = min(index["count"], limit_pos) if limit_pos is not None else index["count"]
+    avg_length = (index["total_length"] / index["count"]) if index["count"] else 1
+    scores = None
+    for term, is_prefix in query_terms:
+        term_scores = {}
+        for expansion in (_expand_prefix(index, term) if is_prefix else [term]):
+            postings = index["postings"].get(expansion, ())
+            idf = math.log(1 + (index["count"] - len(postings) + 0.5) / (len(postings) + 0.5))
+            for pos, tf in postings:
+                if pos >= n or (allowed is not None and pos not in allowed):
+                    continue
+                norm = 1 - b + b * index["lengths"][pos] / (avg_length or 1)
+                score = idf * tf * (k1 + 1) / (tf + k1 * norm)
+                if score > term_scores.get(pos, 0.0): # A prefix counts once per question, by its best expansion
+                    term_scores[pos] = score
+        if scores is None:
+            scores = term_scores
+        else:
+            scores = {pos: scores[pos] + s for pos, s in term_scores.items() if pos in scores}
+        if not scores:
+            return {}
+    return scores or {}
+
+def search_question_banks(query: str, topics: list[str] = None, sources: list[str] = None, limit: int = None,
+                          prefix: bool = False, fields: list[str] = None) -> dict:
+    """
+    Ranked keyword search over the banks of topics (default: all topics).
+    Every query word must match (in the question, an option or a source PDF name); "net*"
+    matches words starting with "net", and prefix=True treats the last word that way too
+    (search-as-you-type). sources keeps questions tagged with any of those PDFs.
+    Returns {"results": [{"topic", "id", "score", ...question fields}], "total"}.
+    """
+    limit = min(limit or config.SEARCH_DEFAULT_LIMIT, config.SEARCH_MAX_LIMIT)
+    query_terms = _parse_search_query(query or "", prefix)
+    if not query_terms:
+        return {"results": [], "total": 0}
+
+    matches, total = [], 0
+    for topic_name in topics or get_available_topics():
+        stamp = get_bank_stamp(topic_name)
+        index = _current_search_index(topic_name, stamp)
+        if index is None:
+            index = get_search_index(topic_name, stamp, load_question_bank(topic_name))
+        with index["lock"]:
+            questions = index["questions"] # Appends only add positions past limit_pos below
+            count = index["count"]
+        if not count:
+            continue
+        allowed = None
+        if sources:
+            by_source = get_source_index(topic_name, stamp, questions)["by_source"]
+            allowed = {pos for pdf in sources for pos in by_source.get(pdf, ())}
+            if not allowed:
+                continue
+        with index["lock"]:
+            scores = _score_index(index, query_terms, allowed, limit_pos=count)
+        total += len(scores)
+        matches.extend((score, topic_name, pos, questions) for pos, score in heapq.nlargest(limit, scores.items(), key=lambda item: item[1]))
+
+    results = []
+    for score, topic_name, pos, questions in heapq.nlargest(limit, matches, key=lambda m: m[0]):
+        q = questions[pos]
+        item = {k: q[k] for k in fields if k in q} if fields else dict(q)
+        item.update(topic=topic_name, id=pos, score=round(score, 4))
+        results.append(item)
+    return {"results": results, "total": total}
+
+def get_search_index_stats() -> dict:
+    """Topics indexed, questions, distinct terms and postings held by the in-memory search indexes."""
+    with _SEARCH_INDEX_LOCK:
+        indexes = [entry[1] for entry in _SEARCH_INDEXES.values()]
+    return {"topics": len(indexes), "questions": sum(i["count"] for i in indexes),
+            "terms": sum(len(i["terms"]) for i in indexes),
+            "postings": sum(len(p) for i in indexes for p in i["postings"].values())}
+
+def _format_full_question(number: int, q: dict) -> str:
+    q_text = q.get('question', 'N/A')
+    options_str = ""
+    options = q.get('options', {})
+    if isinstance(options, dict):
+         options_str = "\n".join([f"  {k}) {v}" for k, v in options.items()])
+    correct = q.get('correct_answer', 'N/A')
+    sources = q.get('source_pdfs', [])
+    source_info = f" (Sources: {', '.join(sources)})" if sources else ""
+    return f"{number}. Question: {q_text}{source_info}\n{options_str}\n   Correct Answer: {correct}\n---\n"
+
+def _pick_style_examples(questions: list[dict], count: int) -> list[int]:
+    """Picks up to count positions, newest first, taking turns across source PDFs so the sample is varied."""
+    by_source = {}
+    for pos in range(len(questions) - 1, -1, -1):
+        sources = questions[pos].get('source_pdfs') or ["(none)"]
+        by_source.setdefault(sources[0], []).append(pos)
+    picked = []
+    queues = list(by_source.values())
+    while queues and len(picked) < count:
+        for queue in queues:
+            if queue and len(picked) < count:
+                picked.append(queue.pop(0))
+        queues = [q for q in queues if q]
+    return sorted(picked)
+
+def _omitted_note(count: int) -> str:
+    return f"({count} older question(s) omitted for length)\n"
+
+@metrics.timed("format_bank_for_prompt") # The implementation behind format_bank_for_prompt
+def build_history_section(question_bank: list[dict], relevant_source_pdfs: list[str] = None,
+                          token_budget: int = None, strategy: str = None) -> tuple[str, dict]:
+    """
+    Builds the 'Existing Question Bank' prompt section within an estimated token budget.
+    Strategies (config.HISTORY_STRATEGY):
+      "full"          - every question with options, newest first until the budget runs out.
+      "sample_digest" - a few representative questions in full (for style), then question
+                        stems only for the rest, newest first until the budget runs out.
+      "stems"         - question stems only.
+    Returns (section text, stats) where stats reports what was included and its estimated size.
+    """
+    token_budget = token_budget or config.HISTORY_TOKEN_BUDGET
+    strategy = strategy or config.HISTORY_STRATEGY
+    stats = {"strategy": strategy, "token_budget": token_budget, "full_examples": 0,
+             "digest_questions": 0, "omitted_questions": 0, "estimated_tokens": 0}
+
     if not question_bank:
-        return "No existing questions in the bank."
+        return "No existing questions in the bank.", stats
 
     filtered_bank = question_bank
     if relevant_source_pdfs:
@@ -128,18 +635,71 @@ def format_bank_for_prompt(question_bank: list[dict], relevant_source_pdfs: list
                 if any(source_pdf in q_sources for source_pdf in relevant_source_pdfs):
                     filtered_bank.append(q)
         if not filtered_bank:
-            return "No existing questions in the bank relevant to the selected PDF(s)."
+            return "No existing questions in the bank relevant to the selected PDF(s).", stats
 
-    history_text = "\n\n--- Existing Question Bank (Avoid Duplicates and Use as Examples) ---\n"
-    for i, q in enumerate(filtered_bank):
-        q_text = q.get('question', 'N/A')
-        options_str = ""
-        options = q.get('options', {})
-        if isinstance(options, dict):
-             options_str = "\n".join([f"  {k}) {v}" for k, v in options.items()])
-        correct = q.get('correct_answer', 'N/A')
-        sources = q.get('source_pdfs', [])
-        source_info = f" (Sources: {', '.join(sources)})" if sources else ""
-        history_text += f"{i+1}. Question: {q_text}{source_info}\n{options_str}\n   Correct Answer: {correct}\n---\n"
-    history_text += "--- End of Existing Question Bank ---\n"
-    return history_text
+    header = "\n\n--- Existing Question Bank (Avoid Duplicates and Use as Examples) ---\n"
+    footer = "--- End of Existing Question Bank ---\n"
+    full_heading = "Full examples (follow this style):\n"
+    digest_heading = "Other existing questions (stems only, do not repeat):\n"
+    # Every piece is charged separately; estimates round up, so their sum bounds the estimate of the whole text
+    remaining = (token_budget - estimate_tokens(header) - estimate_tokens(footer)
+                 - estimate_tokens(_omitted_note(len(filtered_bank)))) # Room for the longest possible omitted-count note
+    if remaining < 0: # Too small for even the section's frame: leave the history out rather than overrun
+        stats.update(omitted_questions=len(filtered_bank))
+        return "", stats
+
+    if strategy == "full":
+        full_positions = list(range(len(filtered_bank)))
+    elif strategy == "sample_digest":
+        full_positions = _pick_style_examples(filtered_bank, config.HISTORY_FULL_EXAMPLES)
+    elif strategy == "stems":
+        full_positions = []
+    else:
+        raise ValueError(f"Unknown history strategy '{strategy}'")
+
+    # Full examples first (newest first if they don't all fit), then stems for the rest, newest first
+    full_entries = {}
+    for pos in reversed(full_positions):
+        entry = _format_full_question(pos + 1, filtered_bank[pos])
+        cost = estimate_tokens(entry) + (0 if full_entries else estimate_tokens(full_heading))
+        if cost > remaining:
+            break
+        full_entries[pos] = entry
+        remaining -= cost
+
+    digest_entries = {}
+    for pos in range(len(filtered_bank) - 1, -1, -1):
+        if pos in full_entries:
+            continue
+        entry = f"{pos + 1}. {filtered_bank[pos].get('question', 'N/A')}\n"
+        cost = estimate_tokens(entry) + (0 if digest_entries else estimate_tokens(digest_heading))
+        if cost > remaining:
+            break
+        digest_entries[pos] = entry
+        remaining -= cost
+
+    history_text = header
+    if full_entries:
+        history_text += full_heading
+        history_text += "".join(full_entries[pos] for pos in sorted(full_entries))
+    if digest_entries:
+        history_text += digest_heading
+        history_text += "".join(digest_entries[pos] for pos in sorted(digest_entries))
+    omitted = len(filtered_bank) - len(full_entries) - len(digest_entries)
+    if omitted:
+        history_text += _omitted_note(omitted)
+    history_text += footer
+
+    stats.update(full_examples=len(full_entries), digest_questions=len(digest_entries),
+                 omitted_questions=omitted, estimated_tokens=estimate_tokens(history_text))
+    return history_text, stats
+
+def format_bank_for_prompt(question_bank: list[dict], relevant_source_pdfs: list[str] = None,
+                           token_budget: int = None, strategy: str = None) -> str:
+    """
+    Formats question bank questions into a string for the Gemini prompt history.
+    If relevant_source_pdfs is provided, filters the bank to include only questions
+    derived from at least one of those PDFs. The result stays within token_budget
+    (see build_history_section).
+    """
+    return build_history_section(question_bank, relevant_source_pdfs, token_budget, strategy)[0]
@@ -0,0 +1,248 @@
+# dedupe.py
+"""
+Near-duplicate question detection using MinHash signatures and LSH banding.
+
+Each question is reduced to a set of shingles (word unigrams and bigrams of the
+question plus its correct option). Signatures use one-permutation MinHash (each
+shingle is hashed once into one of num_perm bins, empty bins are filled by
+rotation densification), so signing costs O(shingles) rather than
+O(shingles * num_perm). Candidates sharing an LSH bucket with a new question are
+verified with exact Jaccard similarity, so lookups stay well under a millisecond
+even for banks with tens of thousands of questions.
+
+Run as a script to dedupe existing banks:
+    python dedupe.py cloud "web dev"
+    python dedupe.py --all --dry-run
+"""
+import argparse
+import random
+import threading
+import zlib
+import config
+from text_utils import tokenize
+from log_utils import get_logger
+
+logger = get_logger(__name__)
+
+_MASK64 = (1 << 64) - 1
+_GOLDEN64 = 0x9E3779B97F4A7C15 # Odd multiplier for multiplicative hashing
+_DENSIFY_OFFSET = 1 << 32 # Keeps borrowed bin values distinct from native ones
+
+def question_text_for_matching(q: dict) -> str:
+    """The text compared for near-duplicates: question stem plus the correct option."""
+    options = q.get('options') if isinstance(q.get('options'), dict) else {}
+    return f"{q.get('question', '')} {options.get(q.get('correct_answer'), '')}"
+
+def shingles(text: str) -> set[int]:
+    """Hashed word unigrams and bigrams of text (stopwords dropped)."""
+    tokens = tokenize(text)
+    grams = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    return {zlib.crc32(g.encode('utf-8')) for g in grams}
+
+def jaccard(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+def _choose_bands(num_perm: int, threshold: float) -> tuple[int, int]:
+    """Picks (bands, rows) with bands * rows == num_perm whose LSH threshold sits just below threshold."""
+    best = None
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        lsh_threshold = (1 / bands) ** (1 / rows)
+        # Prefer the highest LSH threshold that is still below the target (favours recall)
+        if lsh_threshold <= threshold and (best is None or lsh_threshold > best[0]):
+            best = (lsh_threshold, bands, rows)
+    if best is None:
+        return num_perm, 1
+    return best[1], best[2]
+
+class NearDuplicateIndex:
+    """An incrementally maintained MinHash LSH index over questions."""
+
+    def __init__(self, threshold: float = None, num_perm: int = None, seed: int = 1):
+        self.threshold = threshold if threshold is not None else config.NEAR_DUPLICATE_THRESHOLD
+        self.num_perm = num_perm or config.MINHASH_NUM_PERM
+        self.bands, self.rows = _choose_bands(self.num_perm, self.threshold)
+        self._seed = random.Random(seed).getrandbits(64)
+        self._buckets = [dict() for _ in range(self.bands)] # band -> {band signature: [entry ids]}
+        self._entries = [] # entry id -> (shingle set, question text)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _signature(self, shingle_set: set[int]) -> list[int]:
+        k = self.num_perm
+        bins = [None] * k
+        for h in shingle_set:
+            h = ((h ^ self._seed) * _GOLDEN64) & _MASK64
+            b, v = (h >> 32) % k, h & 0xFFFFFFFF
+            if bins[b] is None or v < bins[b]:
+                bins[b] = v
+        # Rotation densification: an empty bin borrows from the next non-empty bin to its right
+        signature = list(bins)
+        for i in range(k):
+            if bins[i] is None:
+                for distance in range(1, k):
+                    borrowed = bins[(i + distance) % k]
+                    if borrowed is not None:
+                        signature[i] = borrowed + distance * _DENSIFY_OFFSET
+                        break
+        return signature
+
+    def _band_keys(self, signature: list[int]) -> list[tuple]:
+        r = self.rows
+        return [tuple(signature[i * r:(i + 1) * r]) for i in range(self.bands)]
+
+    def query(self, text: str) -> tuple:
+        """Returns (matching question text, Jaccard similarity) for the closest near-duplicate, or None."""
+        shingle_set = shingles(text)
+        if not shingle_set:
+            return None
+        return self._query(shingle_set, self._band_keys(self._signature(shingle_set)))
+
+    def _query(self, shingle_set: set[int], band_keys: list[tuple]) -> tuple:
+        candidates = set()
+        for band, key in enumerate(band_keys):
+            candidates.update(self._buckets[band].get(key, ()))
+        best = None
+        for entry_id in candidates:
+            other_shingles, other_text = self._entries[entry_id]
+            similarity = jaccard(shingle_set, other_shingles)
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (other_text, similarity)
+        return best
+
+    def add(self, text: str, label: str = None):
+        """Adds a question's text to the index. label is what query() reports (defaults to text)."""
+        shingle_set = shingles(text)
+        if not shingle_set:
+            return
+        self._insert(shingle_set, self._band_keys(self._signature(shingle_set)), label or text)
+
+    def _insert(self, shingle_set: set[int], band_keys: list[tuple], label: str):
+        entry_id = len(self._entries)
+        self._entries.append((shingle_set, label))
+        for band, key in enumerate(band_keys):
+            self._buckets[band].setdefault(key, []).append(entry_id)
+
+    def add_if_new(self, text: str, label: str = None) -> tuple:
+        """Adds text unless it near-duplicates an indexed question; returns the match if it does."""
+        shingle_set = shingles(text)
+        if not shingle_set:
+            return None
+        band_keys = self._band_keys(self._signature(shingle_set))
+        match = self._query(shingle_set, band_keys)
+        if match is None:
+            self._insert(shingle_set, band_keys, label or text)
+        return match
+
+def build_index(questions: list[dict]) -> NearDuplicateIndex:
+    index = NearDuplicateIndex()
+    for q in questions:
+        index.add(question_text_for_matching(q), q.get('question', ''))
+    return index
+
+# --- Per-topic Indexes ---
+_TOPIC_INDEXES: dict[str, tuple] = {} # topic -> (bank stamp, NearDuplicateIndex)
+_LOCK = threading.Lock()
+
+def filter_near_duplicates(topic_name: str, new_questions: list[dict], bank_stamp, load_bank) -> list[dict]:
+    """
+    Checks new questions against the topic's index (and each other).
+    With NEAR_DUPLICATE_ACTION 'reject' near-duplicates are dropped; with 'flag'
+    they are kept but annotated with near_duplicate_of/near_duplicate_similarity.
+    The index is rebuilt from load_bank() whenever bank_stamp changes (e.g. another worker wrote).
+    Returns the questions to add.
+    """
+    with _LOCK:
+        cached = _TOPIC_INDEXES.get(topic_name)
+        if cached is None or cached[0] != bank_stamp:
+            cached = (bank_stamp, build_index(load_bank()))
+            _TOPIC_INDEXES[topic_name] = cached
+        index = cached[1]
+
+        kept = []
+        for q in new_questions:
+            # Kept questions go straight into the index so later ones in the same batch are checked against them
+            match = index.add_if_new(question_text_for_matching(q), q.get('question', ''))
+            if match is None:
+                kept.append(q)
+                continue
+            match_text, similarity = match
+            if config.NEAR_DUPLICATE_ACTION == 'flag':
+                q['near_duplicate_of'] = match_text
+                q['near_duplicate_similarity'] = round(similarity, 3)
+                index.add(question_text_for_matching(q), q.get('question', ''))
+                kept.append(q)
+            else:
+                logger.warning(f"Rejected near-duplicate ({similarity:.2f}): {q.get('question', '')[:80]}")
+        return kept
+
+def record_saved(topic_name: str, stamp_before, stamp_after):
+    """
+    Records the bank stamp after the filtered questions were saved, so the index is not rebuilt needlessly.
+    The index is kept only if it is at stamp_before, else dropped (see BankStore.add_stamped).
+    """
+    with _LOCK:
+        cached = _TOPIC_INDEXES.get(topic_name)
+        if cached is None:
+            return
+        if stamp_before is not None and cached[0] == stamp_before:
+            _TOPIC_INDEXES[topic_name] = (stamp_after, cached[1])
+        else:
+            del _TOPIC_INDEXES[topic_name]
+
+def invalidate(topic_name: str):
+    """Drops the topic's index (e.g. after a failed save), forcing a rebuild on next use."""
+    with _LOCK:
+        _TOPIC_INDEXES.pop(topic_name, None)
+
+# --- Batch Job ---
+
+def dedupe_questions(questions: list[dict]) -> tuple[list[dict], list[tuple]]:
+    """Keeps the first of each group of near-duplicates. Returns (kept, [(dropped, kept text, similarity)])."""
+    index = NearDuplicateIndex()
+    kept, dropped = [], []
+    for q in questions:
+        match = index.add_if_new(question_text_for_matching(q), q.get('question', ''))
+        if match is None:
+            kept.append(q)
+        else:
+            dropped.append((q, match[0], match[1]))
+    return kept, dropped
+
+def main():
+    import data_manager as dm
+
+    parser = argparse.ArgumentParser(description="Remove near-duplicate questions from topic banks.")
+    parser.add_argument("topics", nargs="*", help="Topic names (see the topics/ folder)")
+    parser.add_argument("--all", action="store_true", help="Dedupe every topic")
+    parser.add_argument("--threshold", type=float, help="Jaccard threshold (default: config.NEAR_DUPLICATE_THRESHOLD)")
+    parser.add_argument("--dry-run", action="store_true", help="Report duplicates without saving")
+    args = parser.parse_args()
+
+    if args.threshold is not None:
+        config.NEAR_DUPLICATE_THRESHOLD = args.threshold
+    topics = dm.get_available_topics() if args.all else args.topics
+    if not topics:
+        parser.error("Name at least one topic or pass --all.")
+
+    for topic in topics:
+        report = {}
+
+        def drop_near_duplicates(bank: list[dict]) -> list[dict]:
+            kept, dropped = dedupe_questions(bank)
+            report.update(total=len(bank), dropped=dropped)
+            return kept if dropped and not args.dry_run else None
+
+        # Filtered and saved under the store's lock, so questions the app adds meanwhile are not lost
+        dm.rewrite_question_bank(topic, drop_near_duplicates)
+        for q, kept_text, similarity in report["dropped"]:
+            print(f"  [{similarity:.2f}] {q.get('question', '')[:90]}\n         ~ {kept_text[:90]}")
+        print(f"Topic '{topic}': {len(report['dropped'])} near-duplicate(s) of {report['total']} questions.")
+
+if __name__ == "__main__":
+    main()
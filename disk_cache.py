@@ -0,0 +1,93 @@
+# disk_cache.py
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from fs_utils import atomic_write_json
+from log_utils import get_logger
+
+logger = get_logger(__name__)
+
+class DiskCache:
+    """
+    A small key/value cache storing one JSON file per entry in a directory.
+    Entries are evicted least-recently-used first once the directory grows past
+    max_bytes. Reads touch the entry's mtime, which is what the LRU order uses.
+    If ttl_seconds is set, entries older than that are treated as misses.
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes: int, ttl_seconds: float = None):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    def get(self, key: str):
+        """Returns the cached value for key, or None on a miss."""
+        path = self._entry_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            self._count("misses")
+            return None
+
+        if self.ttl_seconds is not None and time.time() - entry.get("created", 0) > self.ttl_seconds:
+            self._remove(path)
+            self._count("misses")
+            return None
+
+        try:
+            os.utime(path) # Mark as recently used
+        except OSError:
+            pass
+        self._count("hits")
+        return entry.get("value")
+
+    def set(self, key: str, value):
+        """Stores value under key, then evicts old entries if over the size cap."""
+        try:
+            # Written via temp file + rename so readers never see a partial entry
+            atomic_write_json(self._entry_path(key), {"created": time.time(), "value": value})
+            self._count("stores")
+        except OSError as e:
+            logger.warning(f"Could not write cache entry in {self.cache_dir}: {e}")
+            return
+        self._evict()
+
+    def _evict(self):
+        """Removes least-recently-used entries until the cache fits in max_bytes."""
+        entries = []
+        total = 0
+        for path in self.cache_dir.glob('*.json'):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        if total <= self.max_bytes:
+            return
+        entries.sort(key=lambda e: e[0])
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if self._remove(path):
+                total -= size
+                self._count("evictions")
+
+    def _remove(self, path: Path) -> bool:
+        try:
+            path.unlink()
+            return True
+        except OSError:
+            return False
+
+    def _count(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
@@ -0,0 +1,186 @@
+# fake_gemini.py
+"""
+A deterministic local stand-in for google.generativeai.GenerativeModel, selected
+with GEMINI_BACKEND=fake. It needs no API key and answers generation and
+example-formatting prompts with well-formed MCQ text built from the prompt's
+own context, so the whole app (and bench/run_benchmarks.py) can run offline.
+
+Behaviour is controlled by the FAKE_GEMINI_* settings in config.py:
+latency per call, extra delay per 1k (prompt + output) tokens, the share of
+questions written malformed, and the share of calls failing with a retryable
+error. The same prompt and seed always produce the same response.
+
+It also stands in for explicit context caching (see context_cache.py):
+create_cached_content registers contents for a TTL, and a model made with
+FakeGenerativeModel.from_cached_content answers as if they preceded each prompt,
+failing with "not found" once the cache has expired or been deleted.
+"""
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import config
+from text_utils import estimate_tokens, tokenize
+
+try:
+    from google.api_core import exceptions as google_exceptions
+except ImportError:
+    google_exceptions = None
+
+_GENERATE_COUNT_PATTERN = re.compile(r"generate (\d+) NEW multiple-choice questions", re.IGNORECASE)
+_CONTEXT_PATTERN = re.compile(r"--- Context Text ---(.*?)--- End of Context Text ---", re.DOTALL)
+_EXAMPLES_PATTERN = re.compile(r"--- START OF RAW TEXT ---(.*?)--- END OF RAW TEXT ---", re.DOTALL)
+_STREAM_CHUNK_CHARS = 200
+
+class FakeResponse:
+    """Mimics the .text of a GenerateContentResponse (or of one streamed chunk)."""
+
+    def __init__(self, text: str):
+        self.text = text
+
+class FakeGenerativeModel:
+    """Answers generate_content like GenerativeModel, after a simulated delay."""
+
+    def __init__(self, model_name: str = None, latency_seconds: float = None, seconds_per_1k_tokens: float = None,
+                 malformed_rate: float = None, error_rate: float = None, seed: int = None, sleep=time.sleep,
+                 cached_content: "FakeCachedContent" = None):
+        self.model_name = model_name or config.GEMINI_MODEL_NAME
+        self.cached_content = cached_content
+        self.latency_seconds = config.FAKE_GEMINI_LATENCY_SECONDS if latency_seconds is None else latency_seconds
+        self.seconds_per_1k_tokens = config.FAKE_GEMINI_SECONDS_PER_1K_TOKENS if seconds_per_1k_tokens is None else seconds_per_1k_tokens
+        self.malformed_rate = config.FAKE_GEMINI_MALFORMED_RATE if malformed_rate is None else malformed_rate
+        self.error_rate = config.FAKE_GEMINI_ERROR_RATE if error_rate is None else error_rate
+        self.seed = config.FAKE_GEMINI_SEED if seed is None else seed
+        self._sleep = sleep
+        self.calls = 0
+
+    @classmethod
+    def from_cached_content(cls, cached_content: "FakeCachedContent", **kwargs) -> "FakeGenerativeModel":
+        return cls(cached_content.model, cached_content=cached_content, **kwargs)
+
+    def _rng(self, prompt: str) -> random.Random:
+        digest = hashlib.sha256(f"{self.seed}:{prompt}".encode('utf-8')).digest()
+        return random.Random(int.from_bytes(digest[:8], 'big'))
+
+    def generate_content(self, contents, *, generation_config=None, safety_settings=None, stream: bool = False,
+                         tools=None, tool_config=None, request_options=None):
+        self.calls += 1
+        prompt = sent = contents if isinstance(contents, str) else str(contents)
+        if self.cached_content is not None: # Answered as if the cached contents preceded the prompt, but not timed as sent
+            prompt = _live_cached_contents(self.cached_content.name) + prompt
+        rng = self._rng(prompt)
+        # Errors are drawn from a per-call RNG so retries of the same prompt can succeed
+        if self.error_rate and random.Random(f"{self.seed}:{self.calls}:{prompt[:64]}").random() < self.error_rate:
+            self._sleep(self.latency_seconds)
+            raise _unavailable_error("Fake Gemini: simulated upstream failure")
+
+        as_json = (generation_config or {}).get("response_mime_type") == "application/json"
+        text = self._respond(prompt, rng, as_json)
+        delay = self.latency_seconds + self.seconds_per_1k_tokens * (estimate_tokens(sent) + estimate_tokens(text)) / 1000
+        timeout = (request_options or {}).get("timeout")
+        if timeout is not None and delay > timeout:
+            self._sleep(timeout)
+            raise _timeout_error(f"Fake Gemini: response took longer than the {timeout}s timeout")
+        if stream:
+            return self._stream(text, delay)
+        self._sleep(delay)
+        return FakeResponse(text)
+
+    def _stream(self, text: str, delay: float):
+        chunks = [text[i:i + _STREAM_CHUNK_CHARS] for i in range(0, len(text), _STREAM_CHUNK_CHARS)] or [""]
+        self._sleep(self.latency_seconds) # Time to first chunk
+        per_chunk = max(0.0, delay - self.latency_seconds) / len(chunks)
+        for chunk in chunks:
+            self._sleep(per_chunk)
+            yield FakeResponse(chunk)
+
+    # --- Response Text ---
+
+    def _respond(self, prompt: str, rng: random.Random, as_json: bool = False) -> str:
+        count_match = _GENERATE_COUNT_PATTERN.search(prompt)
+        if count_match:
+            context_match = _CONTEXT_PATTERN.search(prompt)
+            source = context_match.group(1) if context_match else prompt
+            count = int(count_match.group(1))
+        else: # Example formatting: one question per '?' in the examples
+            examples_match = _EXAMPLES_PATTERN.search(prompt)
+            source = examples_match.group(1) if examples_match else prompt
+            count = max(1, min(20, source.count("?")))
+        words = tokenize(source) or ["topic", "concept", "system", "model", "data", "process"]
+        questions = [self._question(words, rng) for _ in range(count)]
+        if as_json:
+            return json.dumps([{"question": stem, "options": dict(zip("ABCD", options)), "correct_answer": answer}
+                               for stem, options, answer in questions], indent=2)
+        return "\n\n".join(self._question_block(i + 1, *q) for i, q in enumerate(questions)) + "\n"
+
+    def _question(self, words: list[str], rng: random.Random) -> tuple[str, list[str], str]:
+        stem = "What is the role of " + " ".join(rng.choice(words) for _ in range(8)) + "?"
+        options = [" ".join(rng.choice(words) for _ in range(3)) for _ in range(4)]
+        answer = rng.choice("ABCD")
+        if rng.random() < self.malformed_rate:
+            answer = "E" # Fails the parser's/validator's A-D check, like a real malformed item
+        return stem, options, answer
+
+    def _question_block(self, number: int, stem: str, options: list[str], answer: str) -> str:
+        return (f"{number}. Question: {stem}\n"
+                "Options:\n"
+                f"A) {options[0]}\nB) {options[1]}\nC) {options[2]}\nD) {options[3]}\n"
+                f"Correct Answer: {answer}")
+
+# --- Context Caching ---
+
+class FakeCachedContent:
+    """Mimics the name/model/expire_time of a caching.CachedContent."""
+
+    def __init__(self, name: str, model: str, contents: str, expire_time: float):
+        self.name = name
+        self.model = model
+        self.contents = contents
+        self.expire_time = expire_time # time.monotonic()
+
+_CACHED_CONTENTS: dict[str, FakeCachedContent] = {}
+_CACHE_IDS = itertools.count(1)
+_CACHE_LOCK = threading.Lock()
+
+def create_cached_content(model_name: str, contents: str, ttl_seconds: float) -> FakeCachedContent:
+    with _CACHE_LOCK:
+        cache = FakeCachedContent(f"cachedContents/fake-{next(_CACHE_IDS)}", model_name, contents,
+                                  time.monotonic() + ttl_seconds)
+        _CACHED_CONTENTS[cache.name] = cache
+    return cache
+
+def delete_cached_content(name: str):
+    with _CACHE_LOCK:
+        if _CACHED_CONTENTS.pop(name, None) is None:
+            raise _not_found_error(f"Fake Gemini: cached content {name} not found")
+
+def _live_cached_contents(name: str) -> str:
+    with _CACHE_LOCK:
+        cache = _CACHED_CONTENTS.get(name)
+        if cache is not None and cache.expire_time <= time.monotonic():
+            del _CACHED_CONTENTS[name]
+            cache = None
+    if cache is None:
+        raise _not_found_error(f"Fake Gemini: cached content {name} not found (expired or deleted)")
+    return cache.contents
+
+class _NotFound(Exception):
+    code = 404
+
+def _not_found_error(message: str) -> Exception:
+    if google_exceptions is not None:
+        return google_exceptions.NotFound(message)
+    return _NotFound(message)
+
+def _unavailable_error(message: str) -> Exception:
+    if google_exceptions is not None:
+        return google_exceptions.ServiceUnavailable(message)
+    return ConnectionError(message)
+
+def _timeout_error(message: str) -> Exception:
+    if google_exceptions is not None:
+        return google_exceptions.DeadlineExceeded(message)
+    return TimeoutError(message)
@@ -1,14 +1,26 @@
 # file_handler.py
+import hashlib
+import multiprocessing
 import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
+import config
+from disk_cache import DiskCache
+import metrics
+from log_utils import get_logger
+
+logger = get_logger(__name__)
+
 # Consider using pypdf: pip install pypdf
 try:
     from pypdf import PdfReader
     from pypdf.errors import PdfReadError
     PDF_LIB_AVAILABLE = True
 except ImportError:
-    print("Warning: pypdf not found. PDF reading functionality will be disabled.")
-    print("Install it using: pip install pypdf")
+    logger.warning("pypdf not found. PDF reading functionality will be disabled. Install it using: pip install pypdf")
     PDF_LIB_AVAILABLE = False
 
 def read_text_files_in_folder(folder_path_str: str) -> str:
@@ -16,56 +28,296 @@ def read_text_files_in_folder(folder_path_str: str) -> str:
     all_text = ""
     folder_path = Path(folder_path_str)
     if not folder_path.is_dir():
-        print(f"Warning: Directory not found: {folder_path_str}")
+        logger.warning(f"Directory not found: {folder_path_str}")
         return ""
 
-    print(f"Reading text files from: {folder_path}")
+    logger.info(f"Reading text files from: {folder_path}")
     for txt_file in folder_path.glob('*.txt'):
         try:
             with open(txt_file, 'r', encoding='utf-8') as f:
                 content = f.read()
                 all_text += content + "\n\n--- End of File: " + txt_file.name + " ---\n\n"
-            print(f"  Read: {txt_file.name}")
+            logger.info(f"Read: {txt_file.name}")
+        except Exception as e:
+            logger.error(f"Error reading {txt_file.name}: {e}")
+    return all_text
+
+# --- Extracted Text Cache ---
+_EXTRACTION_CACHES: dict[str, DiskCache] = {}
+_FILE_HASHES: dict[str, tuple] = {} # path -> (size, mtime_ns, sha256), avoids rehashing unchanged files
+
+def _get_extraction_cache(pdf_path: Path) -> DiskCache:
+    """Gets the extraction cache for the topic that owns pdf_path (topics/<topic>/.cache/extracted)."""
+    cache_dir = pdf_path.resolve().parent.parent / config.CACHE_DIR_NAME / "extracted"
+    key = str(cache_dir)
+    if key not in _EXTRACTION_CACHES:
+        _EXTRACTION_CACHES[key] = DiskCache(cache_dir, config.EXTRACTION_CACHE_MAX_BYTES)
+    return _EXTRACTION_CACHES[key]
+
+def file_sha256(file_path: Path) -> str:
+    """Returns the SHA-256 of a file, reusing the last result while its size and mtime are unchanged."""
+    st = file_path.stat()
+    path_key = str(file_path.resolve())
+    known = _FILE_HASHES.get(path_key)
+    if known and known[0] == st.st_size and known[1] == st.st_mtime_ns:
+        return known[2]
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    sha = digest.hexdigest()
+    _FILE_HASHES[path_key] = (st.st_size, st.st_mtime_ns, sha)
+    return sha
+
+def extraction_cache_key(pdf_path: Path) -> str:
+    """Returns the cache key identifying this exact version of a file (hash + size + mtime)."""
+    st = pdf_path.stat()
+    return f"{file_sha256(pdf_path)}-{st.st_size}-{st.st_mtime_ns}"
+
+# --- Parallel Extraction ---
+_PROCESS_POOL = None
+_PROCESS_POOL_LOCK = threading.Lock()
+# Workers never fork the (threaded) web process: forkserver where the platform has it, spawn otherwise
+_POOL_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    """Lazily creates the shared extraction process pool (once, even under concurrent requests)."""
+    global _PROCESS_POOL
+    with _PROCESS_POOL_LOCK:
+        if _PROCESS_POOL is None:
+            _PROCESS_POOL = ProcessPoolExecutor(max_workers=config.PDF_EXTRACTION_WORKERS,
+                                                mp_context=multiprocessing.get_context(_POOL_START_METHOD))
+        return _PROCESS_POOL
+
+def _reset_process_pool(broken: ProcessPoolExecutor):
+    """Discards a broken pool so the next parallel extraction starts a fresh one."""
+    global _PROCESS_POOL
+    with _PROCESS_POOL_LOCK:
+        if _PROCESS_POOL is not broken: # Another thread already replaced it
+            return
+        _PROCESS_POOL = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+# --- Extraction Metrics ---
+PDF_FILES = metrics.counter("mcq_pdf_files_total", "PDFs requested for extraction, by whether the cache had them.", ("result",))
+PDF_PAGES = metrics.counter("mcq_pdf_pages_extracted_total", "PDF pages extracted (cache misses only).")
+PDF_PAGE_SECONDS = metrics.histogram("mcq_pdf_page_extract_seconds", "Extraction time per PDF page.")
+
+def _extract_page_range(pdf_path_str: str, start: int, stop: int) -> tuple[list[str], float, int]:
+    """
+    Extracts pages [start, stop) of a PDF (stop is clamped to the page count),
+    returning (page texts, seconds taken, total pages in the file).
+    Runs inside pool workers, so it must stay top-level (and time itself there).
+    """
+    begin = time.perf_counter()
+    reader = PdfReader(pdf_path_str)
+    num_pages = len(reader.pages)
+    texts = [reader.pages[i].extract_text() or "" for i in range(start, min(stop, num_pages))]
+    return texts, time.perf_counter() - begin, num_pages
+
+def _run_extraction_tasks(tasks: list[tuple], parallel: bool) -> dict[tuple, object]:
+    """
+    Runs (path, start, stop) tasks, on the process pool when parallel, returning
+    {task: _extract_page_range result or exception}. A broken pool falls back to serial.
+    """
+    results = {}
+    if parallel:
+        pool = _get_process_pool()
+        try:
+            futures = {task: pool.submit(_extract_page_range, str(task[0]), task[1], task[2]) for task in tasks}
+            for task, future in futures.items():
+                try:
+                    results[task] = future.result()
+                except BrokenProcessPool:
+                    raise
+                except Exception as e:
+                    results[task] = e
+        except BrokenProcessPool as e:
+            logger.warning(f"Extraction process pool failed ({e}). Falling back to serial extraction.")
+            _reset_process_pool(pool)
+            results = {}
+
+    for task in tasks:
+        if task not in results:
+            try:
+                results[task] = _extract_page_range(str(task[0]), task[1], task[2])
+            except Exception as e:
+                results[task] = e
+    return results
+
+@metrics.timed("pdf_extract")
+def extract_pdfs(pdf_paths: list[Path]) -> dict[Path, object]:
+    """
+    Extracts page text for several PDFs, returning {path: list of page texts}.
+    Cached files are served from the extraction cache. For the rest, the first
+    page range of every file is extracted first (on the process pool when there
+    are several files); that task also reports the file's page count, so the
+    parent never parses a PDF just to plan the work. The remaining page ranges
+    of large files then run on the pool, unless so few pages are left that pool
+    overhead would dominate.
+    A file that fails to read maps to the exception instead of a page list.
+    """
+    results = {}
+    pending = [] # (path, cache, key)
+    for pdf_path in (Path(p) for p in pdf_paths):
+        try:
+            cache = _get_extraction_cache(pdf_path)
+            key = extraction_cache_key(pdf_path)
+            pages = cache.get(key)
+            if pages is not None:
+                PDF_FILES.inc(result="cached")
+                results[pdf_path] = pages
+                continue
+            PDF_FILES.inc(result="extracted")
+            pending.append((pdf_path, cache, key))
         except Exception as e:
-            print(f"  Error reading {txt_file.name}: {e}")
+            results[pdf_path] = e
+
+    if not pending:
+        return results
+
+    pool_enabled = config.PDF_EXTRACTION_WORKERS > 1
+    first_tasks = [(pdf_path, 0, config.PDF_PAGES_PER_TASK) for pdf_path, _, _ in pending]
+    chunks = _run_extraction_tasks(first_tasks, pool_enabled and len(first_tasks) > 1)
+
+    rest_tasks = [] # (path, start, stop)
+    for task in first_tasks:
+        if isinstance(chunks[task], Exception):
+            continue
+        num_pages = chunks[task][2]
+        for start in range(config.PDF_PAGES_PER_TASK, num_pages, config.PDF_PAGES_PER_TASK):
+            rest_tasks.append((task[0], start, min(start + config.PDF_PAGES_PER_TASK, num_pages)))
+    if rest_tasks:
+        rest_pages = sum(stop - start for _, start, stop in rest_tasks)
+        parallel = pool_enabled and len(rest_tasks) > 1 and rest_pages >= config.PDF_PARALLEL_MIN_PAGES
+        if parallel:
+            logger.info(f"Extracting {rest_pages} more pages from {len(pending)} PDF(s) as {len(rest_tasks)} parallel task(s)...")
+        chunks.update(_run_extraction_tasks(rest_tasks, parallel))
+
+    # Reassemble each file's pages in order; any failed range fails the whole file
+    tasks = first_tasks + rest_tasks
+    for pdf_path, cache, key in pending:
+        file_chunks = [chunks[task] for task in tasks if task[0] == pdf_path] # Already in page order
+        error = next((c for c in file_chunks if isinstance(c, Exception)), None)
+        if error is not None:
+            results[pdf_path] = error
+            continue
+        for chunk_pages, seconds, _ in file_chunks:
+            for _ in chunk_pages:
+                PDF_PAGE_SECONDS.observe(seconds / len(chunk_pages))
+        # Summed task times, so a file split over several workers reports its extraction work rather than wall time
+        metrics.STAGE_SECONDS.observe(sum(seconds for _, seconds, _ in file_chunks), stage="pdf_extract_file")
+        pages = [page for chunk_pages, _, _ in file_chunks for page in chunk_pages]
+        PDF_PAGES.inc(len(pages))
+        cache.set(key, pages)
+        results[pdf_path] = pages
+    return results
+
+def extract_pdf_pages(pdf_path: Path) -> list[str]:
+    """
+    Returns the extracted text of each page of a PDF.
+    Results are cached per topic keyed by content hash, size and mtime, so a
+    changed file is re-extracted automatically. Raises PdfReadError for unreadable files.
+    """
+    pdf_path = Path(pdf_path)
+    pages = extract_pdfs([pdf_path])[pdf_path]
+    if isinstance(pages, Exception):
+        raise pages
+    return pages
+
+def _format_extracted_documents(extracted: dict[Path, object], names: dict[Path, str]) -> str:
+    """Concatenates extracted files in the given order with the usual document separators."""
+    all_text = ""
+    for pdf_path, result in extracted.items():
+        name = names[pdf_path]
+        if isinstance(result, PdfReadError):
+            logger.warning(f"Could not read corrupted/encrypted PDF: {name}")
+            continue
+        if isinstance(result, Exception):
+            logger.error(f"Error reading {name}: {result}")
+            continue
+        file_text = pages_to_text(result)
+        if file_text:
+            all_text += file_text + f"\n--- End of Document: {name} ---\n\n"
+            logger.info(f"Extracted ~{len(file_text)} chars from {name} ({len(result)} pages).")
+        else:
+            logger.info(f"No text extracted from {name}.")
     return all_text
 
+def pages_to_text(pages: list[str]) -> str:
+    """Joins extracted pages the same way for every caller (one newline after each non-empty page)."""
+    return "".join(page_text + "\n" for page_text in pages if page_text)
+
+def _resolve_selected_pdfs(folder_path: Path, filenames: list[str]) -> dict[Path, str]:
+    """Maps each safe, existing PDF among filenames to its path in folder_path (warns about the rest)."""
+    names = {}
+    for filename in filenames:
+        if ".." in filename or filename.startswith("/"):
+            logger.warning(f"Skipping potentially unsafe filename: {filename}")
+            continue
+
+        file_path = folder_path / filename
+        if not (file_path.is_file() and filename.lower().endswith('.pdf')):
+            logger.warning(f"Selected file not found or not a PDF: {filename}")
+            continue
+        names[file_path] = filename
+    return names
+
+def read_selected_pdfs(folder_path_str: str, filenames: list[str]) -> str:
+    """Reads and concatenates text from the named PDF files within a folder."""
+    if not PDF_LIB_AVAILABLE:
+        logger.error("PDF library (pypdf) not available.")
+        return ""
+
+    folder_path = Path(folder_path_str)
+    names = _resolve_selected_pdfs(folder_path, filenames)
+    logger.info(f"Reading {len(names)} selected file(s) from: {folder_path}")
+    extracted = extract_pdfs(list(names))
+    return _format_extracted_documents({path: extracted[path] for path in names}, names)
+
+def read_selected_pdf_pages(folder_path_str: str, filenames: list[str]) -> dict[str, list[str]]:
+    """Like read_selected_pdfs, but returns {filename: page texts} for the files that could be read."""
+    if not PDF_LIB_AVAILABLE:
+        logger.error("PDF library (pypdf) not available.")
+        return {}
+
+    folder_path = Path(folder_path_str)
+    names = _resolve_selected_pdfs(folder_path, filenames)
+    logger.info(f"Reading {len(names)} selected file(s) from: {folder_path}")
+    extracted = extract_pdfs(list(names))
+    pages_by_name = {}
+    for pdf_path, name in names.items():
+        result = extracted[pdf_path]
+        if isinstance(result, PdfReadError):
+            logger.warning(f"Could not read corrupted/encrypted PDF: {name}")
+        elif isinstance(result, Exception):
+            logger.error(f"Error reading {name}: {result}")
+        else:
+            pages_by_name[name] = result
+    return pages_by_name
+
 def read_pdfs_in_folder(folder_path_str: str) -> str:
     """Reads text content from all PDF files within a specified folder using pypdf."""
     if not PDF_LIB_AVAILABLE:
-        print("Error: PDF library (pypdf) not available.")
+        logger.error("PDF library (pypdf) not available.")
         return ""
 
-    all_text = ""
     folder_path = Path(folder_path_str)
 
     if not folder_path.is_dir():
-        print(f"Error: Directory not found at {folder_path_str}")
+        logger.error(f"Directory not found at {folder_path_str}")
         return ""
 
-    print(f"Reading PDF files from: {folder_path}")
-    pdf_files = list(folder_path.glob('*.pdf'))
+    logger.info(f"Reading PDF files from: {folder_path}")
+    pdf_files = sorted(folder_path.glob('*.pdf')) # Sorted so the combined text is deterministic
 
     if not pdf_files:
-        print(f"No PDF files found in {folder_path_str}")
+        logger.info(f"No PDF files found in {folder_path_str}")
         return ""
 
-    for pdf_file in pdf_files:
-        try:
-            reader = PdfReader(pdf_file)
-            num_pages = len(reader.pages)
-            print(f"  Reading {pdf_file.name} ({num_pages} pages)...")
-            file_text = ""
-            for i, page in enumerate(reader.pages):
-                page_text = page.extract_text()
-                if page_text:
-                    file_text += page_text + "\n"
-            if file_text:
-                 all_text += file_text + "\n--- End of Document: " + pdf_file.name + " ---\n\n"
-        except PdfReadError:
-            print(f"  Warning: Could not read corrupted or encrypted PDF: {pdf_file.name}")
-        except Exception as e:
-            print(f"  Error reading {pdf_file.name}: {e}")
+    extracted = extract_pdfs(pdf_files)
+    all_text = _format_extracted_documents({path: extracted[path] for path in pdf_files},
+                                           {path: path.name for path in pdf_files})
 
-    print(f"Finished reading {len(pdf_files)} PDF file(s).")
+    logger.info(f"Finished reading {len(pdf_files)} PDF file(s).")
     return all_text
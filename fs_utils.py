@@ -0,0 +1,67 @@
+# fs_utils.py
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+    _HAVE_FCNTL = True
+except ImportError: # Windows
+    import msvcrt
+    _HAVE_FCNTL = False
+
+class LockUnavailable(Exception):
+    """Raised by file_lock(blocking=False) when another process holds the lock."""
+
+@contextmanager
+def file_lock(lock_path: Path, blocking: bool = True):
+    """
+    Holds an exclusive inter-process lock on lock_path for the duration of the block.
+    The lock file is created if needed and left in place afterwards.
+    """
+    lock_path = Path(lock_path)
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, 'a+b') as f:
+        try:
+            if _HAVE_FCNTL:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+        except (BlockingIOError, PermissionError, OSError) as e:
+            if blocking:
+                raise
+            raise LockUnavailable(str(lock_path)) from e
+        try:
+            yield
+        finally:
+            if _HAVE_FCNTL:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+def atomic_write_json(filepath: Path, data, indent: int = None, durable: bool = False):
+    """
+    Writes data as JSON to a temp file in the same folder and renames it over filepath,
+    so readers see either the old or the new file, never a partial one.
+    With durable=True the data is fsynced before the rename (survives a crash/power loss).
+    """
+    filepath = Path(filepath)
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=filepath.parent, prefix=f".{filepath.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=indent)
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
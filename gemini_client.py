@@ -0,0 +1,276 @@
+# gemini_client.py
+"""
+A resilient wrapper around a Gemini GenerativeModel (or anything with the same
+generate_content signature, e.g. a local fake).
+
+Every call goes through:
+  - a token-bucket rate limiter for requests per minute and (estimated) tokens per minute,
+  - a per-call timeout (passed to the API as request_options),
+  - retries with jittered exponential backoff for retryable errors (429, 5xx, timeouts),
+  - a circuit breaker that fails fast while the upstream keeps failing.
+"""
+import random
+import threading
+import time
+import config
+from text_utils import estimate_tokens
+from log_utils import get_logger
+
+logger = get_logger(__name__)
+
+try:
+    from google.api_core import exceptions as google_exceptions
+    _RETRYABLE_EXCEPTIONS = (google_exceptions.TooManyRequests, google_exceptions.ResourceExhausted,
+                             google_exceptions.ServiceUnavailable, google_exceptions.InternalServerError,
+                             google_exceptions.DeadlineExceeded, google_exceptions.GatewayTimeout)
+except ImportError:
+    _RETRYABLE_EXCEPTIONS = ()
+
+_RETRYABLE_CODES = {408, 429, 500, 502, 503, 504}
+
+class GeminiError(Exception):
+    """Raised when a Gemini call fails for good (retries exhausted or a non-retryable error)."""
+
+class GeminiUnavailable(GeminiError):
+    """Raised without calling the API while the circuit breaker is open or the rate limit wait is too long."""
+
+class GeminiRequestError(GeminiError):
+    """Raised when Gemini rejected the request itself (blocked prompt, invalid argument, bad API key): retrying will not help."""
+
+def is_retryable(error: Exception) -> bool:
+    """Whether error is worth retrying: throttling, server errors, timeouts and connection errors."""
+    if isinstance(error, _RETRYABLE_EXCEPTIONS + (TimeoutError, ConnectionError)):
+        return True
+    code = getattr(error, 'code', None)
+    code = getattr(code, 'value', code) # grpc status codes wrap the number
+    return isinstance(code, int) and code in _RETRYABLE_CODES
+
+# --- Rate Limiting ---
+
+class TokenBucket:
+    """
+    Refills at rate_per_minute, holding at most rate_per_minute units.
+    acquire() waits for capacity; charge() records usage known only afterwards
+    (the level may go negative, which delays later callers).
+    """
+
+    def __init__(self, rate_per_minute: float, clock=time.monotonic, sleep=time.sleep):
+        self.capacity = float(rate_per_minute)
+        self.rate = rate_per_minute / 60.0
+        self._level = self.capacity
+        self._updated = clock()
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, amount: float = 1, max_wait: float = None) -> float:
+        """Takes amount units, waiting as needed. Returns seconds waited; raises GeminiUnavailable past max_wait."""
+        amount = min(amount, self.capacity) # Oversized requests wait for a full bucket rather than forever
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._level >= amount:
+                    self._level -= amount
+                    return waited
+                delay = (amount - self._level) / self.rate
+            if max_wait is not None and waited + delay > max_wait:
+                raise GeminiUnavailable(f"Rate limit: would wait {waited + delay:.1f}s (max {max_wait:.0f}s)")
+            self._sleep(delay)
+            waited += delay
+
+    def charge(self, amount: float):
+        with self._lock:
+            self._refill()
+            self._level -= amount
+
+# --- Circuit Breaker ---
+
+class CircuitBreaker:
+    """
+    closed -> open after failure_threshold consecutive failures; open -> half_open after
+    reset_seconds, letting one trial call through; the trial's outcome closes or reopens it.
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raises GeminiUnavailable if calls are currently blocked."""
+        with self._lock:
+            if self.state == "open":
+                remaining = self._opened_at + self.reset_seconds - self._clock()
+                if remaining > 0:
+                    raise GeminiUnavailable(f"Gemini circuit breaker is open (retry in {remaining:.0f}s)")
+                self.state = "half_open"
+                self._trial_in_flight = False
+            if self.state == "half_open":
+                if self._trial_in_flight:
+                    raise GeminiUnavailable("Gemini circuit breaker is half-open (trial call in progress)")
+                self._trial_in_flight = True
+
+    def release_trial(self):
+        """Frees the half-open trial slot when the call was abandoned before reaching the API."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.consecutive_failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self._trial_in_flight = False
+            if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+                if self.state != "open":
+                    logger.warning(f"Gemini circuit breaker opened after {self.consecutive_failures} consecutive failure(s).")
+                self.state = "open"
+                self._opened_at = self._clock()
+
+# --- Client ---
+
+class GeminiClient:
+    """Wraps model.generate_content with rate limiting, timeouts, retries and a circuit breaker."""
+
+    def __init__(self, model, requests_per_minute: float = None, tokens_per_minute: float = None,
+                 timeout_seconds: float = None, max_retries: int = None, backoff_base: float = None,
+                 backoff_max: float = None, breaker: CircuitBreaker = None, sleep=time.sleep):
+        self.model = model
+        self.request_bucket = TokenBucket(requests_per_minute or config.GEMINI_REQUESTS_PER_MINUTE, sleep=sleep)
+        self.token_bucket = TokenBucket(tokens_per_minute or config.GEMINI_TOKENS_PER_MINUTE, sleep=sleep)
+        self.timeout_seconds = timeout_seconds or config.GEMINI_TIMEOUT_SECONDS
+        self.max_retries = config.GEMINI_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_base = backoff_base or config.GEMINI_BACKOFF_BASE_SECONDS
+        self.backoff_max = backoff_max or config.GEMINI_BACKOFF_MAX_SECONDS
+        self.breaker = breaker or CircuitBreaker(config.GEMINI_BREAKER_FAILURE_THRESHOLD, config.GEMINI_BREAKER_RESET_SECONDS)
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "attempts": 0, "retries": 0, "failures": 0, "rejected": 0,
+                      "rate_limit_wait_seconds": 0.0, "backoff_seconds": 0.0,
+                      "prompt_tokens": 0, "output_tokens": 0} # Estimated (CHARS_PER_TOKEN), summed over attempts
+
+    def _count(self, name: str, amount=1):
+        with self._lock:
+            self.stats[name] += amount
+
+    def _backoff_delay(self, attempt: int) -> float:
+        # "Full jitter": spreads retries from concurrent callers so they don't hit the API in lockstep
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _before_attempt(self, prompt_tokens: int):
+        try:
+            self.breaker.before_call()
+        except GeminiUnavailable:
+            self._count("rejected")
+            raise
+        try:
+            waited = self.request_bucket.acquire(1, config.GEMINI_RATE_LIMIT_MAX_WAIT_SECONDS)
+            waited += self.token_bucket.acquire(prompt_tokens, config.GEMINI_RATE_LIMIT_MAX_WAIT_SECONDS)
+        except GeminiUnavailable:
+            self.breaker.release_trial()
+            self._count("rejected")
+            raise
+        if waited:
+            self._count("rate_limit_wait_seconds", waited)
+        self._count("attempts")
+        self._count("prompt_tokens", prompt_tokens)
+
+    def _call_with_retries(self, prompt: str, call):
+        """Runs call() (one API attempt) under the limiter/breaker, retrying retryable errors."""
+        self._count("calls")
+        prompt_tokens = estimate_tokens(prompt)
+        attempt = 0
+        while True:
+            self._before_attempt(prompt_tokens)
+            try:
+                result = call()
+            except Exception as e:
+                retryable = is_retryable(e)
+                if retryable:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success() # The API answered; the request itself was bad
+                if not retryable:
+                    self._count("failures")
+                    raise GeminiRequestError(f"Gemini rejected the request: {e}") from e
+                if attempt >= self.max_retries:
+                    self._count("failures")
+                    raise GeminiError(f"Gemini call failed after {attempt + 1} attempt(s): {e}") from e
+                delay = self._backoff_delay(attempt)
+                attempt += 1
+                self._count("retries")
+                self._count("backoff_seconds", delay)
+                logger.warning(f"Gemini call failed ({e}); retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                self._sleep(delay)
+                continue
+            self.breaker.record_success()
+            return result
+
+    def run(self, prompt: str, call):
+        """Runs call(), any other API request sending prompt (e.g. creating a context cache), like one generate() attempt loop."""
+        return self._call_with_retries(prompt, call)
+
+    def generate(self, prompt: str, generation_params: dict = None, model=None) -> str:
+        """Returns the response text for prompt (from model, e.g. one bound to a context cache, instead of self.model if given)."""
+        model = model or self.model
+        kwargs = {"request_options": {"timeout": self.timeout_seconds}}
+        if generation_params:
+            kwargs["generation_config"] = generation_params
+        # .text is read inside the attempt so blocked/empty responses surface as errors of that attempt
+        text = self._call_with_retries(prompt, lambda: model.generate_content(prompt, **kwargs).text)
+        output_tokens = estimate_tokens(text or "")
+        self.token_bucket.charge(output_tokens)
+        self._count("output_tokens", output_tokens)
+        return text
+
+    def stream(self, prompt: str, generation_params: dict = None, model=None):
+        """
+        Yields the response text chunk by chunk. Starting the stream is retried like
+        generate(); once text has been yielded, a failure is raised (retrying would
+        duplicate output).
+        """
+        model = model or self.model
+        kwargs = {"stream": True, "request_options": {"timeout": self.timeout_seconds}}
+        if generation_params:
+            kwargs["generation_config"] = generation_params
+        response = self._call_with_retries(prompt, lambda: iter(model.generate_content(prompt, **kwargs)))
+        output_chars = 0
+        try:
+            for chunk in response:
+                try:
+                    chunk_text = chunk.text
+                except ValueError: # Chunks without text parts (e.g. safety metadata)
+                    continue
+                output_chars += len(chunk_text)
+                yield chunk_text
+        except Exception as e:
+            self._count("failures")
+            if not is_retryable(e):
+                raise GeminiRequestError(f"Gemini stream was rejected: {e}") from e
+            self.breaker.record_failure()
+            raise GeminiError(f"Gemini stream failed: {e}") from e
+        finally:
+            self.token_bucket.charge(output_chars / config.CHARS_PER_TOKEN)
+            self._count("output_tokens", int(output_chars / config.CHARS_PER_TOKEN))
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+        stats["circuit_state"] = self.breaker.state
+        stats["consecutive_failures"] = self.breaker.consecutive_failures
+        return stats
@@ -1,93 +1,217 @@
 # gemini_handler.py
 import google.generativeai as genai
 import config
-import re # For more robust parsing
+import hashlib
+import itertools
+import json
+import threading
+import time
+import context_cache
+from disk_cache import DiskCache
+from gemini_client import GeminiClient, GeminiError, GeminiRequestError, GeminiUnavailable
+import mcq_parser
+import metrics
+from mcq_parser import GEMINI_RESPONSE_SCHEMA, McqStreamParser, parse_mcq_response
+from log_utils import get_logger
+
+logger = get_logger(__name__)
 
 # --- Gemini Configuration ---
 _MODEL = None
 
+def _create_google_model():
+    if not config.GOOGLE_API_KEY or "YOUR_DEFAULT_API_KEY_HERE" in config.GOOGLE_API_KEY:
+         logger.error("Gemini API Key not configured in config.py or .env file. Please set the GOOGLE_API_KEY.")
+         return None
+    genai.configure(api_key=config.GOOGLE_API_KEY)
+    return genai.GenerativeModel(config.GEMINI_MODEL_NAME)
+
+def _create_fake_model():
+    import fake_gemini
+    return fake_gemini.FakeGenerativeModel(config.GEMINI_MODEL_NAME)
+
+# Model backends selectable with config.GEMINI_BACKEND; each returns an object with generate_content (or None)
+MODEL_BACKENDS = {"google": _create_google_model, "fake": _create_fake_model}
+
 def configure_gemini():
-    """Configures the Gemini API using the key from config."""
+    """Configures the Gemini model for config.GEMINI_BACKEND (the real API uses the key from config)."""
     global _MODEL
     try:
-        if not config.GOOGLE_API_KEY or "YOUR_DEFAULT_API_KEY_HERE" in config.GOOGLE_API_KEY:
-             print("Error: Gemini API Key not configured in config.py or .env file.")
-             print("Please set the GOOGLE_API_KEY.")
-             _MODEL = None
-             return False
-        genai.configure(api_key=config.GOOGLE_API_KEY)
-        _MODEL = genai.GenerativeModel(config.GEMINI_MODEL_NAME)
-        print(f"Gemini API configured successfully with model: {config.GEMINI_MODEL_NAME}")
+        create_model = MODEL_BACKENDS.get(config.GEMINI_BACKEND)
+        if create_model is None:
+            logger.error(f"Unknown Gemini backend '{config.GEMINI_BACKEND}'. Expected one of: {', '.join(MODEL_BACKENDS)}")
+            _MODEL = None
+            return False
+        _MODEL = create_model()
+        if _MODEL is None:
+            return False
+        logger.info(f"Gemini API configured successfully with model: {config.GEMINI_MODEL_NAME} (backend: {config.GEMINI_BACKEND})")
         return True
     except Exception as e:
-        print(f"Error configuring Gemini API: {e}")
+        logger.error(f"Error configuring Gemini API: {e}")
         _MODEL = None
         return False
 
-def _parse_mcq_response(text: str) -> list[dict]:
-    """Parses the Gemini response text into a list of MCQ dictionaries."""
-    questions = []
-    # Regex to find question blocks, handling variations in spacing and numbering
-    # This regex looks for "Question:" possibly preceded by a number and dot,
-    # then captures the question text, options block, and correct answer line.
-    pattern = re.compile(
-        r"^\s*(?:\d+\.\s*)?Question:\s*(.*?)\s*" # Capture question text
-        r"Options:\s*\n"                         # Options header
-        r"^\s*A\)\s*(.*?)\s*\n"                  # Option A
-        r"^\s*B\)\s*(.*?)\s*\n"                  # Option B
-        r"^\s*C\)\s*(.*?)\s*\n"                  # Option C
-        r"^\s*D\)\s*(.*?)\s*\n"                  # Option D
-        r"^\s*Correct Answer:\s*([A-D])\s*$",    # Correct Answer (single letter)
-        re.MULTILINE | re.IGNORECASE             # Multiline and case-insensitive
-    )
-
-    matches = pattern.finditer(text)
-
-    for match in matches:
-        question_text = match.group(1).strip()
-        options = {
-            "A": match.group(2).strip(),
-            "B": match.group(3).strip(),
-            "C": match.group(4).strip(),
-            "D": match.group(5).strip(),
-        }
-        correct_answer = match.group(6).strip().upper()
-
-        if question_text and all(options.values()) and correct_answer in options:
-            questions.append({
-                "question": question_text,
-                "options": options,
-                "correct_answer": correct_answer,
-            })
-        else:
-             # Log the block that failed parsing for debugging
-             print(f"\n--- Skipping malformed block detected by regex ---\n{match.group(0)}\n--------------------------------------------------")
-
-
-    if not questions and text.strip(): # If regex found nothing, try the old split method as fallback
-         print("Warning: Regex parsing failed, attempting fallback split method.")
-         # (Include the parsing logic from your original script here as a fallback)
-         # ... (omitted for brevity, but you'd paste your original parsing loop here)
-         # Make sure the fallback also appends to the 'questions' list
-         pass # Placeholder for your original parsing logic
-
-
-    print(f"Parsed {len(questions)} questions from response.")
-    return questions
-
-
-def format_examples_to_mcq(example_text: str) -> list[dict]:
+# --- Client ---
+# Shared by every request/thread so rate limits and the circuit breaker see all traffic
+_CLIENT = None
+
+def _get_client() -> GeminiClient:
+    global _CLIENT
+    if _CLIENT is None or _CLIENT.model is not _MODEL:
+        _CLIENT = GeminiClient(_MODEL)
+    return _CLIENT
+
+def get_client_stats() -> dict:
+    """Attempts/retries/failures, rate-limit waits and circuit breaker state of the shared client."""
+    return _get_client().get_stats()
+
+# --- Response Cache ---
+# Raw response text keyed by hash of (model, prompt, generation params), so retries and
+# re-runs on unchanged input (e.g. /format_examples) don't pay for an identical call again.
+_RESPONSE_CACHE = None
+
+def _get_response_cache() -> DiskCache:
+    global _RESPONSE_CACHE
+    if _RESPONSE_CACHE is None:
+        _RESPONSE_CACHE = DiskCache(config.GEMINI_CACHE_DIR, config.GEMINI_CACHE_MAX_BYTES, config.GEMINI_CACHE_TTL_SECONDS)
+    return _RESPONSE_CACHE
+
+def response_cache_key(prompt: str, generation_params: dict = None, context_key: str = None) -> str:
+    """
+    Content address of a Gemini call: sha256 of the backend, model name, prompt and generation params
+    (and of the context cache the prompt refers to, if any).
+    """
+    call = {"backend": config.GEMINI_BACKEND, "model": config.GEMINI_MODEL_NAME, "prompt": prompt,
+            "params": generation_params or {}}
+    if context_key:
+        call["context"] = context_key
+    payload = json.dumps(call, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+# --- Call Metrics ---
+PROMPT_CHARS = metrics.histogram("mcq_gemini_prompt_chars", "Size of prompts sent to Gemini (or answered from the cache).",
+                                 ("kind",), buckets=metrics.CHARS_BUCKETS)
+RESPONSE_CHARS = metrics.histogram("mcq_gemini_response_chars", "Size of Gemini response texts.",
+                                   ("kind",), buckets=metrics.CHARS_BUCKETS)
+CACHE_LOOKUPS = metrics.counter("mcq_gemini_cache_lookups_total", "Gemini response cache lookups.", ("result",))
+
+def _cached_response(key: str, bypass_cache: bool) -> str:
+    if not config.GEMINI_CACHE_ENABLED or bypass_cache:
+        return None
+    cached = _get_response_cache().get(key)
+    CACHE_LOOKUPS.inc(result="miss" if cached is None else "hit")
+    if cached is not None:
+        logger.info("Using cached Gemini response.")
+    return cached
+
+def _generate_text(prompt: str, generation_params: dict = None, bypass_cache: bool = False,
+                   cached_context: context_cache.CachedContext = None) -> str:
+    """
+    Sends prompt to Gemini through the shared client and returns the response text,
+    serving byte-identical calls from the response cache. bypass_cache skips the
+    lookup (the fresh response still replaces the cached one). With cached_context
+    the prompt is answered against that context cache. Raises GeminiError if the call fails.
+    """
+    use_cache = config.GEMINI_CACHE_ENABLED
+    key = response_cache_key(prompt, generation_params, cached_context and cached_context.key) if use_cache else None
+    PROMPT_CHARS.observe(len(prompt), kind="generate")
+    cached = _cached_response(key, bypass_cache)
+    if cached is not None:
+        RESPONSE_CHARS.observe(len(cached), kind="generate")
+        return cached
+    with metrics.timed("gemini_call"):
+        text = _get_client().generate(prompt, generation_params, cached_context and cached_context.model)
+    RESPONSE_CHARS.observe(len(text or ""), kind="generate")
+    if use_cache and text and text.strip():
+        _get_response_cache().set(key, text)
+    return text
+
+# --- Context Caching ---
+# Large contexts are sent once into a provider-side cache and referenced by later prompts (see context_cache.py)
+
+def _context_section(context_text: str) -> str:
+    return f"--- Context Text ---\n{context_text}\n--- End of Context Text ---\n"
+
+def _call_with_context(context_text: str, history_text: str, num_questions: int, mode: str, call):
+    """
+    Returns call(prompt, cached_context) for a generation prompt over context_text, with the
+    context in a context cache when possible, else inline. If the provider no longer has the
+    cache, it is forgotten and the call is repeated with the context inline.
+    """
+    cached = context_cache.get(_context_section(context_text), _get_client())
+    if cached is not None:
+        try:
+            result = call(build_generation_prompt(context_text, history_text, num_questions, mode, context_cached=True), cached)
+            context_cache.record_use(cached)
+            return result
+        except GeminiError as e:
+            if not context_cache.is_missing_cache_error(e):
+                raise
+            logger.warning(f"Context cache {cached.name} is gone ({e}); sending the context inline.")
+            context_cache.invalidate(cached)
+    return call(build_generation_prompt(context_text, history_text, num_questions, mode), None)
+
+def get_cache_stats() -> dict:
+    """Hit/miss/store/eviction counters of the Gemini response cache."""
+    stats = dict(_get_response_cache().stats)
+    stats["enabled"] = config.GEMINI_CACHE_ENABLED
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else None
+    return stats
+
+# --- Output Modes ---
+# "json": the model returns a JSON array constrained by the MCQ schema; "text": Question:/Options: blocks
+_TEXT_FORMAT_EXAMPLE = """
+    Question: What is the capital of France?
+    Options:
+    A) London
+    B) Berlin
+    C) Paris
+    D) Madrid
+    Correct Answer: C
+"""
+
+_ANSWER_FORMATS = {"text": '"Correct Answer: [Letter]"', "json": '"correct_answer": "[Letter]"'}
+
+def _output_mode() -> str:
+    return "json" if config.GEMINI_OUTPUT_MODE == "json" else "text"
+
+def _generation_params(mode: str) -> dict:
+    """generation_config for the mode: JSON mode asks the API itself to enforce the MCQ schema."""
+    if mode == "json":
+        return {"response_mime_type": "application/json", "response_schema": GEMINI_RESPONSE_SCHEMA}
+    return None
+
+def _format_instructions(mode: str, what: str) -> str:
+    if mode == "json":
+        return f"""Respond with only a JSON array containing one object per {what}, exactly like this example:
+    [{{"question": "What is the capital of France?", "options": {{"A": "London", "B": "Berlin", "C": "Paris", "D": "Madrid"}}, "correct_answer": "C"}}]
+    """
+    return f"""Format each {what} exactly like this example:
+{_TEXT_FORMAT_EXAMPLE}
+    Separate each complete MCQ block with a blank line.
+    """
+
+def get_parse_stats() -> dict:
+    """Parse success rate and wasted output per output mode."""
+    return mcq_parser.get_parse_stats()
+
+
+def format_examples_to_mcq(example_text: str, bypass_cache: bool = False) -> list[dict]:
     """
     Sends raw example text (Q&A pairs) to Gemini and asks it to
     format them into the standard MCQ structure.
+    Raises GeminiError if Gemini could not be reached (after retries).
     """
     if not _MODEL:
-        print("Error: Gemini model not initialized. Call configure_gemini() first.")
+        logger.error("Gemini model not initialized. Call configure_gemini() first.")
         return []
     if not example_text or example_text.isspace():
-         print("No example text provided to format.")
+         logger.warning("No example text provided to format.")
          return []
 
+    mode = _output_mode()
     prompt = f"""
     You are an expert in creating educational multiple-choice questions.
     Based on the following raw text, which contains questions and potentially their answers or related concepts,
@@ -96,7 +220,7 @@ def format_examples_to_mcq(example_text: str) -> list[dict]:
     For each concept you identify, create one MCQ with:
     1. A clear question text.
     2. Four plausible options labeled A, B, C, D. One option must be the correct answer based on the provided text.
-    3. A clear indication of the correct answer using the format "Correct Answer: [Letter]".
+    3. A clear indication of the correct answer using the format {_ANSWER_FORMATS[mode]}.
 
     Ensure the options are relevant and the incorrect options (distractors) are plausible but clearly wrong according to the text.
 
@@ -105,42 +229,36 @@ def format_examples_to_mcq(example_text: str) -> list[dict]:
     {example_text}
     --- END OF RAW TEXT ---
 
-    Format each generated MCQ exactly like this example:
-
-    Question: What is the capital of France?
-    Options:
-    A) London
-    B) Berlin
-    C) Paris
-    D) Madrid
-    Correct Answer: C
-
-    Generate as many MCQs as you can derive from the provided text. Separate each complete MCQ block with a blank line.
-    """
+    Generate as many MCQs as you can derive from the provided text.
+    {_format_instructions(mode, "generated MCQ")}    """
 
     try:
-        print("Sending examples to Gemini for formatting...")
-        response = _MODEL.generate_content(prompt)
+        logger.info("Sending examples to Gemini for formatting...")
+        response_text = _generate_text(prompt, _generation_params(mode), bypass_cache=bypass_cache)
         # print("--- Gemini Formatting Response ---") # Optional: Debugging
-        # print(response.text)
+        # print(response_text)
         # print("----------------------------------")
-        return _parse_mcq_response(response.text)
+        return parse_mcq_response(response_text, mode)
+    except GeminiError:
+        raise # Retries are exhausted or the circuit is open; let the caller report it
     except Exception as e:
-        print(f"Error during Gemini API call for formatting examples: {e}")
+        logger.error(f"Error during Gemini API call for formatting examples: {e}")
         return []
 
 
-def generate_new_mcqs(context_text: str, history_text: str, num_questions: int) -> list[dict]:
+def build_generation_prompt(context_text: str, history_text: str, num_questions: int, mode: str = None,
+                            context_cached: bool = False) -> str:
     """
-    Generates new MCQs based on context, using history/bank for examples and avoiding duplicates.
+    Builds the prompt asking Gemini for num_questions new MCQs from the context, in the given output mode.
+    With context_cached the context itself is left out: it precedes the prompt from a context cache.
     """
-    if not _MODEL:
-        print("Error: Gemini model not initialized. Call configure_gemini() first.")
-        return []
-    if not context_text or context_text.isspace():
-         print("No context text provided for generation.")
-         return []
-
+    mode = mode or _output_mode()
+    if context_cached:
+        context_block = "(The 'Context Text' is provided above, before these instructions.)"
+    else:
+        context_block = f"""--- Context Text ---
+    {context_text}
+    --- End of Context Text ---"""
     prompt = f"""
     You are an expert in creating educational multiple-choice questions.
     Your task is to generate {num_questions} NEW multiple-choice questions based *only* on the provided 'Context Text'.
@@ -152,36 +270,127 @@ def generate_new_mcqs(context_text: str, history_text: str, num_questions: int)
     Each new question must have:
     1.  A clear question text derived from the 'Context Text'.
     2.  Four plausible options labeled A, B, C, D. One option must be the correct answer based *only* on the 'Context Text'.
-    3.  A clear indication of the correct answer using the format "Correct Answer: [Letter]".
+    3.  A clear indication of the correct answer using the format {_ANSWER_FORMATS[mode]}.
 
     Ensure the questions cover different aspects of the 'Context Text', are challenging but fair, and the correct answer letter matches one of the options provided.
 
-    --- Context Text ---
-    {context_text}
-    --- End of Context Text ---
+    {context_block}
 
     {history_text}
 
     Generate exactly {num_questions} new, unique MCQs based on the 'Context Text' above, following the specified format.
-    Format each new question exactly like this:
+    {_format_instructions(mode, "new question")}    """
+    return prompt
 
-    Question: [New question text based on Context Text]
-    Options:
-    A) [Option A]
-    B) [Option B]
-    C) [Option C]
-    D) [Option D]
-    Correct Answer: [Letter]
+
+def generate_new_mcqs(context_text: str, history_text: str, num_questions: int, bypass_cache: bool = False) -> list[dict]:
+    """
+    Generates new MCQs based on context, using history/bank for examples and avoiding duplicates.
+    Raises GeminiError if Gemini could not be reached (after retries).
     """
+    if not _MODEL:
+        logger.error("Gemini model not initialized. Call configure_gemini() first.")
+        return []
+    if not context_text or context_text.isspace():
+         logger.warning("No context text provided for generation.")
+         return []
+
+    mode = _output_mode()
+    generate = lambda prompt, cached: _generate_text(prompt, _generation_params(mode), bypass_cache, cached)
 
     try:
-        print(f"Sending context and history to Gemini for generating {num_questions} new questions...")
-        response = _MODEL.generate_content(prompt)
+        logger.info(f"Sending context and history to Gemini for generating {num_questions} new questions...")
+        response_text = _call_with_context(context_text, history_text, num_questions, mode, generate)
         # print("--- Gemini Generation Response ---") # Optional: Debugging
-        # print(response.text)
+        # print(response_text)
         # print("----------------------------------")
-        return _parse_mcq_response(response.text)
+        return parse_mcq_response(response_text, mode)
+    except GeminiError:
+        raise # Retries are exhausted or the circuit is open; let the caller report it
     except Exception as e:
-        print(f"Error during Gemini API call for generating new questions: {e}")
+        logger.error(f"Error during Gemini API call for generating new questions: {e}")
         return []
 
+
+# --- Streaming Generation ---
+_STREAM_STATS = {"streams": 0, "questions": 0, "first_question_count": 0,
+                 "time_to_first_question_total": 0.0, "time_to_first_question_last": None}
+_STREAM_STATS_LOCK = threading.Lock() # Streams run on concurrent request threads
+
+def _stream_text(prompt: str, generation_params: dict = None, bypass_cache: bool = False,
+                 cached_context: context_cache.CachedContext = None):
+    """Yields the response text piece by piece; a cached response is yielded whole, a fresh one is cached once complete."""
+    use_cache = config.GEMINI_CACHE_ENABLED
+    key = response_cache_key(prompt, generation_params, cached_context and cached_context.key) if use_cache else None
+    PROMPT_CHARS.observe(len(prompt), kind="stream")
+    cached = _cached_response(key, bypass_cache)
+    if cached is not None:
+        RESPONSE_CHARS.observe(len(cached), kind="stream")
+        yield cached
+        return
+    pieces = []
+    start = time.perf_counter()
+    for chunk_text in _get_client().stream(prompt, generation_params, cached_context and cached_context.model):
+        pieces.append(chunk_text)
+        yield chunk_text
+    # Timed by hand: includes the consumer's work between chunks, and an abandoned stream is not recorded
+    metrics.STAGE_SECONDS.observe(time.perf_counter() - start, stage="gemini_stream")
+    text = "".join(pieces)
+    RESPONSE_CHARS.observe(len(text), kind="stream")
+    if use_cache and text.strip():
+        _get_response_cache().set(key, text)
+
+def stream_new_mcqs(context_text: str, history_text: str, num_questions: int, bypass_cache: bool = False):
+    """
+    Like generate_new_mcqs, but streams the Gemini response and yields each MCQ
+    as soon as its block is complete. Records time-to-first-question.
+    """
+    if not _MODEL:
+        logger.error("Gemini model not initialized. Call configure_gemini() first.")
+        return
+    if not context_text or context_text.isspace():
+         logger.warning("No context text provided for generation.")
+         return
+
+    mode = _output_mode()
+
+    def start_stream(prompt, cached):
+        # Pulls the first piece here, so a missing context cache surfaces inside _call_with_context
+        chunks = _stream_text(prompt, _generation_params(mode), bypass_cache, cached)
+        return itertools.chain([next(chunks, "")], chunks)
+
+    parser = McqStreamParser(mode)
+    start = time.perf_counter()
+    count = 0
+    with _STREAM_STATS_LOCK:
+        _STREAM_STATS["streams"] += 1
+    logger.info(f"Streaming {num_questions} new questions from Gemini...")
+    for chunk_text in _call_with_context(context_text, history_text, num_questions, mode, start_stream):
+        for mcq in parser.feed(chunk_text):
+            count += 1
+            if count == 1:
+                _record_time_to_first_question(time.perf_counter() - start)
+            yield mcq
+    for mcq in parser.finish():
+        count += 1
+        if count == 1:
+            _record_time_to_first_question(time.perf_counter() - start)
+        yield mcq
+    with _STREAM_STATS_LOCK:
+        _STREAM_STATS["questions"] += count
+    logger.info(f"Streamed {count} questions in {time.perf_counter() - start:.1f}s.")
+
+def _record_time_to_first_question(seconds: float):
+    with _STREAM_STATS_LOCK:
+        _STREAM_STATS["first_question_count"] += 1
+        _STREAM_STATS["time_to_first_question_total"] += seconds
+        _STREAM_STATS["time_to_first_question_last"] = seconds
+    logger.info(f"Time to first streamed question: {seconds:.2f}s")
+
+def get_stream_stats() -> dict:
+    """Returns streaming counters, including the mean Gemini time-to-first-question in seconds."""
+    with _STREAM_STATS_LOCK:
+        stats = dict(_STREAM_STATS)
+    n = stats["first_question_count"]
+    stats["time_to_first_question_mean"] = stats["time_to_first_question_total"] / n if n else None
+    return stats
@@ -0,0 +1,229 @@
+# generation_planner.py
+"""
+Splits a large generation request into several smaller Gemini calls.
+
+The selected context is cut into segments (page ranges of each PDF, or the
+chunks picked in retrieval mode). Segments are packed in order into parts of
+roughly equal size, one per call of at most PLANNER_QUESTIONS_PER_CALL
+questions, and each part gets a share of the question count proportional to
+its size (or, in fill-gaps mode, to its missing coverage). Calls run concurrently on a bounded thread pool; results are merged,
+deduped (exact and near-duplicate) and any shortfall is topped up with
+follow-up calls that are told which questions already exist.
+"""
+import contextvars
+import itertools
+import math
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import config
+import coverage
+import dedupe
+import data_manager as dm
+import file_handler as fh
+import gemini_handler as gh
+import retrieval
+from text_utils import normalize_question_text
+from log_utils import get_logger
+
+logger = get_logger(__name__)
+
+# --- Segments ---
+
+def build_segments(topic_name: str, filenames: list[str], context_mode: str, question_bank: list[dict],
+                   num_questions: int = None) -> list[dict]:
+    """
+    Extracts the selected PDFs as an ordered list of segments {file, page_start, page_end, text}.
+    In 'full' mode each PDF is cut into runs of PLANNER_SEGMENT_PAGES pages; in 'retrieval'
+    mode the segments are the least-covered chunks picked by retrieval; in 'fill_gaps' mode
+    they are the under-covered chunks from the coverage index, each with a "weight".
+    """
+    if context_mode == 'fill_gaps':
+        return coverage.gap_segments(topic_name, filenames, num_questions or config.PLANNER_QUESTIONS_PER_CALL)
+    segments = []
+    if context_mode == 'retrieval':
+        _, chunks = retrieval.build_retrieval_context(topic_name, filenames, question_bank)
+        for c in chunks:
+            segments.append({"file": c["file"], "page_start": c["page_start"], "page_end": c["page_end"],
+                             "text": f"[Pages {c['page_start']}-{c['page_end']}]\n{c['text']}\n\n"})
+        return segments
+
+    pages_by_name = fh.read_selected_pdf_pages(str(dm.get_context_folder(topic_name)), filenames)
+    step = config.PLANNER_SEGMENT_PAGES
+    for name in filenames:
+        pages = pages_by_name.get(name)
+        if not pages:
+            continue
+        for start in range(0, len(pages), step):
+            text = fh.pages_to_text(pages[start:start + step])
+            if text:
+                segments.append({"file": name, "page_start": start + 1,
+                                 "page_end": min(start + step, len(pages)), "text": text})
+    return segments
+
+def format_segments(segments: list[dict]) -> str:
+    """Joins segments into prompt context, closing each document with the usual separator."""
+    context_text = ""
+    for name, group in itertools.groupby(segments, key=lambda s: s["file"]):
+        body = "".join(s["text"] for s in group).rstrip("\n")
+        if body:
+            context_text += f"{body}\n\n--- End of Document: {name} ---\n\n"
+    return context_text
+
+# --- Planning ---
+
+def _allocate(total: int, weights: list[int]) -> list[int]:
+    """Splits total into integer shares proportional to weights (largest remainder)."""
+    if not sum(weights):
+        weights = [1] * len(weights)
+    weight_sum = sum(weights)
+    raw = [total * w / weight_sum for w in weights]
+    counts = [int(r) for r in raw]
+    by_remainder = sorted(range(len(raw)), key=lambda i: raw[i] - counts[i], reverse=True)
+    for i in by_remainder[:total - sum(counts)]:
+        counts[i] += 1
+    return counts
+
+def plan_generation(segments: list[dict], num_questions: int) -> list[dict]:
+    """
+    Packs segments into parts of similar size, one Gemini call each. Questions are allocated
+    by each part's weight: the segments' "weight" if they have one, else their text size.
+    Returns [{files, segments, context_text, size, weight, num_questions}].
+    """
+    if not segments:
+        return []
+    num_calls = min(len(segments), max(1, math.ceil(num_questions / config.PLANNER_QUESTIONS_PER_CALL)))
+    sizes = [len(s["text"]) for s in segments]
+    total = sum(sizes)
+
+    grouped = [[] for _ in range(num_calls)]
+    offset = 0
+    for segment, size in zip(segments, sizes):
+        # Contiguous split on cumulative size keeps each part's pages together
+        grouped[min(num_calls - 1, offset * num_calls // total)].append(segment)
+        offset += size
+    grouped = [group for group in grouped if group]
+
+    parts = []
+    for group in grouped:
+        files = list(dict.fromkeys(s["file"] for s in group))
+        parts.append({"files": files, "segments": group, "context_text": format_segments(group),
+                      "size": sum(len(s["text"]) for s in group),
+                      "weight": sum(s.get("weight", len(s["text"])) for s in group), "num_questions": 0})
+    for part, count in zip(parts, _allocate(num_questions, [p["weight"] for p in parts])):
+        part["num_questions"] = count
+    return parts
+
+# --- Execution ---
+
+def _already_generated_section(questions: list[dict]) -> str:
+    lines = "".join(f"- {q.get('question', '')}\n" for q in questions)
+    return ("\n--- Questions Already Generated In This Request (do not repeat these) ---\n"
+            f"{lines}--- End of Questions Already Generated ---\n")
+
+def _run_calls(calls: list[tuple[dict, int]], history_text: str, bypass_cache: bool, on_done=None) -> list[tuple[dict, list[dict], Exception]]:
+    """Runs (part, count) Gemini calls concurrently. Returns [(part, questions, error or None)] in call order."""
+    results = [None] * len(calls)
+    with ThreadPoolExecutor(max_workers=max(1, config.PLANNER_MAX_CONCURRENT_CALLS), thread_name_prefix="gen") as pool:
+        # Each call runs in a copy of the caller's context, so its log records keep the request id
+        futures = {pool.submit(contextvars.copy_context().run, gh.generate_new_mcqs, part["context_text"], history_text,
+                               count, bypass_cache): i
+                   for i, (part, count) in enumerate(calls)}
+        for future in as_completed(futures):
+            i = futures[future]
+            error = None
+            try:
+                questions = future.result()
+            except Exception as e:
+                logger.warning(f"Generation call {i + 1} failed: {e}")
+                questions, error = [], e
+            results[i] = (calls[i][0], questions, error)
+            if on_done:
+                on_done()
+    return results
+
+def _split_calls(parts: list[dict], counts: list[int]) -> list[tuple[dict, int]]:
+    """Turns per-part question counts into (part, count) calls of at most PLANNER_QUESTIONS_PER_CALL questions."""
+    calls = []
+    for part, count in zip(parts, counts):
+        while count > 0:
+            calls.append((part, min(count, config.PLANNER_QUESTIONS_PER_CALL)))
+            count -= config.PLANNER_QUESTIONS_PER_CALL
+    return calls
+
+class _Merger:
+    """Accumulates questions across calls, dropping exact and near-duplicates within the request."""
+
+    def __init__(self):
+        self.questions = []
+        self.duplicates_dropped = 0
+        self._seen = set()
+        self._index = dedupe.NearDuplicateIndex() if config.NEAR_DUPLICATE_ACTION != 'off' else None
+
+    def add(self, part: dict, questions: list[dict]):
+        for q in questions:
+            key = normalize_question_text(q.get('question', ''))
+            if key in self._seen or (self._index is not None and
+                                     self._index.add_if_new(dedupe.question_text_for_matching(q), q.get('question', ''))):
+                self.duplicates_dropped += 1
+                continue
+            self._seen.add(key)
+            q['source_pdfs'] = part["files"]
+            self.questions.append(q)
+
+def generate(parts: list[dict], history_text: str, num_questions: int, bypass_cache: bool = False,
+             progress=None, keep_going=None) -> tuple[list[dict], dict]:
+    """
+    Executes a plan: one concurrent call per part, then up to PLANNER_TOP_UP_ROUNDS rounds of
+    follow-up calls for any shortfall. Each question is tagged with its part's source_pdfs.
+    If every call of the first round fails, the first error (usually a GeminiError) is raised.
+    progress(stage, percent) is called as calls finish; keep_going(), if given, before each top-up
+    round, whose False keeps the questions generated so far (e.g. a token budget ran out).
+    Returns (questions, stats).
+    """
+    stats = {"parts": len(parts), "calls": 0, "top_up_calls": 0, "empty_calls": 0, "failed_calls": 0, "duplicates_dropped": 0}
+    merger = _Merger()
+    calls = _split_calls(parts, [part["num_questions"] for part in parts])
+    expected_calls = len(calls)
+    finished = 0
+
+    def on_done():
+        nonlocal finished
+        finished += 1
+        if progress:
+            progress("calling_gemini", 40 + min(49, 50 * finished // max(1, expected_calls)))
+
+    for round_number in range(config.PLANNER_TOP_UP_ROUNDS + 1):
+        if not calls:
+            break
+        round_history = history_text
+        if round_number and keep_going and not keep_going():
+            logger.info(f"Planner: skipping the top-up of {num_questions - len(merger.questions)} question(s).")
+            break
+        if round_number:
+            logger.info(f"Topping up {num_questions - len(merger.questions)} missing question(s) with {len(calls)} call(s)...")
+            round_history += _already_generated_section(merger.questions)
+            stats["top_up_calls"] += len(calls)
+            expected_calls += len(calls)
+        stats["calls"] += len(calls)
+        errors = []
+        for part, questions, error in _run_calls(calls, round_history, bypass_cache, on_done):
+            if error is not None:
+                errors.append(error)
+            elif not questions:
+                stats["empty_calls"] += 1
+            merger.add(part, questions)
+        stats["failed_calls"] += len(errors)
+        if errors and len(errors) == len(calls):
+            if not merger.questions:
+                raise errors[0] # Nothing to show for it; let the caller report the Gemini failure
+            break # Gemini is failing; keep what we have rather than hammer it with top-ups
+
+        shortfall = num_questions - len(merger.questions)
+        if shortfall <= 0:
+            break
+        # Spread the shortfall over the parts again
+        calls = _split_calls(parts, _allocate(shortfall, [p["weight"] for p in parts]))
+
+    stats["duplicates_dropped"] = merger.duplicates_dropped
+    logger.info(f"Planner: {len(merger.questions)}/{num_questions} questions from {stats['calls']} call(s) "
+                f"({stats['top_up_calls']} top-up, {stats['empty_calls']} empty, {stats['failed_calls']} failed, {stats['duplicates_dropped']} duplicates dropped).")
+    return merger.questions[:num_questions], stats
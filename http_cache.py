@@ -0,0 +1,81 @@
+# http_cache.py
+"""
+Conditional GET and compression for the JSON endpoints the frontend re-fetches.
+
+Endpoints tag responses with a strong ETag built from a cheap version value
+(the bank stamp, the context folder fingerprint), so a client that already has
+the current version gets a 304 after a stat() instead of a freshly loaded and
+serialised body. compress_response() gzip- (or, if the brotli package is
+installed, brotli-) encodes large JSON bodies; an encoded body gets its own
+ETag suffix, since strong ETags must differ between representations.
+"""
+import gzip
+import hashlib
+from flask import Response, jsonify
+import config
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    brotli = None
+    BROTLI_AVAILABLE = False
+
+_ENCODING_SUFFIXES = {"br": "-br", "gzip": "-gzip"}
+
+def make_etag(*parts) -> str:
+    """A strong ETag value (unquoted) identifying the resource version described by parts."""
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:24]
+
+def _strip_encoding(tag: str) -> str:
+    for suffix in _ENCODING_SUFFIXES.values():
+        if tag.endswith(suffix):
+            return tag[:-len(suffix)]
+    return tag
+
+def matching_etag(request, etag: str) -> str:
+    """Returns the tag from the request's If-None-Match that names etag (in any encoding), or None."""
+    if request.if_none_match.star_tag:
+        return etag
+    for tag in request.if_none_match.as_set(include_weak=True):
+        if _strip_encoding(tag) == etag:
+            return tag
+    return None
+
+def cached_json(request, etag: str, build_payload) -> Response:
+    """
+    Answers 304 Not Modified if the client already has etag, otherwise jsonify(build_payload())
+    tagged with it. build_payload is only called for a 200, so unchanged resources are never loaded.
+    """
+    matched = matching_etag(request, etag)
+    if matched:
+        response = Response(status=304)
+        response.set_etag(matched)
+    else:
+        response = jsonify(build_payload())
+        response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache' # Revalidate every time; a 304 is cheap
+    return response
+
+def compress_response(request, response: Response) -> Response:
+    """Encodes a JSON response above config.HTTP_COMPRESS_MIN_BYTES with brotli or gzip, if the client accepts it."""
+    if (response.status_code != 200 or response.direct_passthrough or response.mimetype != 'application/json'
+            or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    if len(body) < config.HTTP_COMPRESS_MIN_BYTES:
+        return response
+    encoding = request.accept_encodings.best_match(["br", "gzip"] if BROTLI_AVAILABLE else ["gzip"])
+    if not encoding:
+        return response
+    if encoding == "br":
+        body = brotli.compress(body, quality=config.HTTP_BROTLI_QUALITY)
+    else:
+        body = gzip.compress(body, compresslevel=config.HTTP_GZIP_LEVEL, mtime=0)
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(etag + _ENCODING_SUFFIXES[encoding], weak)
+    return response
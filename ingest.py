@@ -0,0 +1,233 @@
+# ingest.py
+"""
+Background ingestion of topic files, so generation finds them already processed.
+
+A polling watcher scans every topic's context/*.pdf and examples/*.txt. New or
+changed PDFs are extracted (filling the extraction cache) and chunked into the
+retrieval index; example text files are checked to be readable. Per-file
+readiness is kept in topics/<topic>/.cache/ingest_state.json, which
+/get_context_files reports.
+
+Each topic is ingested under a non-blocking lock (topics/<topic>/.cache/ingest.lock):
+when several app workers run a watcher, one does the work and the others skip
+the topic until their next poll.
+
+The watcher is started by `python app.py` (INGEST_WATCHER_ENABLED; importing the app,
+e.g. under gunicorn, does not start it), or run from the command line:
+    python ingest.py --all              # ingest every topic once and exit
+    python ingest.py cloud --watch      # keep watching one topic
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from pathlib import Path
+import config
+import content_store
+import data_manager as dm
+import file_handler as fh
+import retrieval
+from fs_utils import LockUnavailable, atomic_write_json, file_lock
+from log_utils import get_logger
+
+logger = get_logger(__name__)
+
+STATE_FILENAME = "ingest_state.json"
+STATUS_READY = "ready"
+STATUS_PENDING = "pending"
+STATUS_ERROR = "error"
+
+# --- State ---
+
+def get_state_file(topic_name: str) -> Path:
+    return dm.get_topic_path(topic_name) / config.CACHE_DIR_NAME / STATE_FILENAME
+
+def load_state(topic_name: str) -> dict:
+    """Returns {"files": {"context/<name>.pdf": {size, mtime_ns, status, ...}}} (empty if never ingested)."""
+    try:
+        with open(get_state_file(topic_name), 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        if isinstance(state, dict) and isinstance(state.get("files"), dict):
+            return state
+    except FileNotFoundError:
+        pass
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"Could not read ingest state for topic '{topic_name}' ({e}). Re-ingesting.")
+    return {"files": {}}
+
+def _save_state(topic_name: str, state: dict):
+    try:
+        atomic_write_json(get_state_file(topic_name), state, indent=2)
+    except OSError as e:
+        logger.warning(f"Could not save ingest state for topic '{topic_name}': {e}")
+
+def get_state_stamp(topic_name: str) -> tuple:
+    """A cheap value that changes whenever the topic's ingest state is rewritten."""
+    try:
+        st = get_state_file(topic_name).stat()
+        return (st.st_ino, st.st_mtime_ns)
+    except FileNotFoundError:
+        return None
+
+def scan_topic(topic_name: str) -> dict[str, tuple]:
+    """Returns {"context/<name>.pdf" or "examples/<name>.txt": (size, mtime_ns)} for the topic's files."""
+    files = {}
+    for folder, suffix in ((dm.get_context_folder(topic_name), ".pdf"), (dm.get_examples_folder(topic_name), ".txt")):
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.name.endswith(suffix) and entry.is_file():
+                        st = entry.stat()
+                        files[f"{folder.name}/{entry.name}"] = (st.st_size, st.st_mtime_ns)
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+    return files
+
+def _is_current(entry: dict, signature: tuple) -> bool:
+    return bool(entry) and (entry.get("size"), entry.get("mtime_ns")) == tuple(signature)
+
+def get_context_file_status(topic_name: str, signatures: dict[str, tuple] = None) -> dict[str, str]:
+    """Readiness of each context PDF: "ready", "pending" (new, changed or being processed) or "error"."""
+    signatures = scan_topic(topic_name) if signatures is None else signatures
+    state = load_state(topic_name)["files"]
+    status = {}
+    for rel, signature in signatures.items():
+        folder, name = rel.split("/", 1)
+        if folder != "context":
+            continue
+        entry = state.get(rel)
+        status[name] = entry["status"] if _is_current(entry, signature) else STATUS_PENDING
+    return status
+
+# --- Ingestion ---
+
+def _ingest_pdf(topic_name: str, pdf_path: Path) -> dict:
+    pages = fh.extract_pdfs([pdf_path])[pdf_path]
+    if isinstance(pages, Exception):
+        return {"status": STATUS_ERROR, "error": str(pages)}
+    index = retrieval.update_topic_index(topic_name, [pdf_path.name]) # Reuses the pages just cached
+    chunks = index["files"].get(pdf_path.name, {}).get("chunks", [])
+    return {"status": STATUS_READY, "pages": len(pages), "chunks": len(chunks)}
+
+def _ingest_text(txt_path: Path) -> dict:
+    try:
+        with open(txt_path, 'r', encoding='utf-8') as f:
+            return {"status": STATUS_READY, "chars": len(f.read())}
+    except (OSError, UnicodeDecodeError) as e:
+        return {"status": STATUS_ERROR, "error": str(e)}
+
+def ingest_topic(topic_name: str, blocking: bool = False, settle_seconds: float = None) -> dict:
+    """
+    Processes the topic's new or changed files, saving the state after each one.
+    Files modified within settle_seconds (default INGEST_SETTLE_SECONDS) are left for a later
+    pass, since they may still be copying; uploads are complete when linked in, so pass 0 for them.
+    Returns {"ingested", "errors", "removed", "waiting"} counts, or None if another process holds the topic's lock.
+    """
+    settle_seconds = config.INGEST_SETTLE_SECONDS if settle_seconds is None else settle_seconds
+    summary = {"ingested": 0, "errors": 0, "removed": 0, "waiting": 0}
+    try:
+        with file_lock(get_state_file(topic_name).with_name("ingest.lock"), blocking=blocking):
+            state = load_state(topic_name)
+            current = scan_topic(topic_name)
+            for rel in [rel for rel in state["files"] if rel not in current]:
+                del state["files"][rel]
+                summary["removed"] += 1
+            settled_before = time.time_ns() - int(settle_seconds * 1e9)
+
+            for rel, signature in sorted(current.items()):
+                if _is_current(state["files"].get(rel), signature):
+                    continue
+                if signature[1] > settled_before:
+                    summary["waiting"] += 1
+                    continue
+                folder, name = rel.split("/", 1)
+                start = time.perf_counter()
+                if folder == "context":
+                    result = _ingest_pdf(topic_name, dm.get_context_folder(topic_name) / name)
+                else:
+                    result = _ingest_text(dm.get_examples_folder(topic_name) / name)
+                result.update(size=signature[0], mtime_ns=signature[1], ingested_at=time.time(),
+                              seconds=round(time.perf_counter() - start, 2))
+                state["files"][rel] = result
+                summary["errors" if result["status"] == STATUS_ERROR else "ingested"] += 1
+                logger.info(f"Ingest: {topic_name}/{rel} -> {result['status']}"
+                            + (f" ({result['error']})" if result["status"] == STATUS_ERROR else f" in {result['seconds']}s"))
+                _save_state(topic_name, state)
+            if summary["removed"]:
+                _save_state(topic_name, state)
+    except LockUnavailable:
+        return None
+    if summary["removed"]: # Deleted uploads may have been the last links to stored files
+        content_store.collect_garbage()
+    return summary
+
+# --- Watcher ---
+
+class IngestWatcher:
+    """Polls every topic (or the given ones) every poll_seconds on a daemon thread."""
+
+    def __init__(self, topics: list[str] = None, poll_seconds: float = None):
+        self.topics = topics
+        self.poll_seconds = poll_seconds or config.INGEST_POLL_SECONDS
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="ingest-watcher", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, timeout: float = None):
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def poll_once(self):
+        for topic in self.topics or dm.get_available_topics():
+            try:
+                ingest_topic(topic)
+            except Exception as e:
+                logger.error(f"Ingest: error while ingesting topic '{topic}': {e}")
+
+    def _run(self):
+        while True:
+            self.poll_once()
+            if self._stop.wait(self.poll_seconds):
+                return
+
+_WATCHER = None
+
+def start_watcher() -> IngestWatcher:
+    """Starts the shared background watcher (once per process)."""
+    global _WATCHER
+    if _WATCHER is None:
+        _WATCHER = IngestWatcher()
+        _WATCHER.start()
+        logger.info(f"Ingest watcher started (polling every {_WATCHER.poll_seconds}s).")
+    return _WATCHER
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-extract and index topic context PDFs and example files.")
+    parser.add_argument("topics", nargs="*", help="Topic names (see the topics/ folder)")
+    parser.add_argument("--all", action="store_true", help="Ingest every topic")
+    parser.add_argument("--watch", action="store_true", help="Keep polling for new or changed files")
+    args = parser.parse_args()
+
+    topics = dm.get_available_topics() if args.all else args.topics
+    if not topics and not (args.all or args.watch):
+        parser.error("Name at least one topic or pass --all.")
+
+    if args.watch:
+        watcher = IngestWatcher(None if args.all else topics or None) # None: all topics, including new ones
+        watcher.start()
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            watcher.stop()
+        return
+
+    for topic in topics:
+        summary = ingest_topic(topic, blocking=True, settle_seconds=0) # A one-off run should not leave fresh files behind
+        print(f"Topic '{topic}': {summary['ingested']} ingested, {summary['errors']} failed, {summary['removed']} removed.")
+
+if __name__ == "__main__":
+    main()
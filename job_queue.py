@@ -0,0 +1,255 @@
+# job_queue.py
+"""
+A small background job queue for long-running requests (/generate, /format_examples).
+
+Jobs are queued in memory and handed to a backend for execution once a global
+slot and a per-topic slot are free. Kinds given their own cap (kind_caps, e.g.
+ingestion after uploads) run in a separate lane limited only by that cap, so
+they never take the slots user requests wait for. The default backend runs jobs on a thread
+pool inside the Flask process; InlineBackend runs them synchronously. A backend
+for a real broker only needs to implement submit(fn). Work that has to run in
+the request itself (a streamed response) can claim() a slot under the same caps.
+
+Note: job state lives in the process that accepted the job, so under several
+gunicorn workers the /jobs/<id> poll must reach the same worker (or a shared
+backend/state store must be plugged in).
+"""
+import contextvars
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import config
+import log_utils
+import metrics
+import profiling
+from log_utils import get_logger
+
+logger = get_logger(__name__)
+
+# --- Backends ---
+
+class ThreadPoolBackend:
+    """Runs jobs on an in-process thread pool."""
+    name = "thread"
+
+    def __init__(self, max_workers: int):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+
+    def submit(self, fn):
+        self._executor.submit(fn)
+
+class InlineBackend:
+    """Runs jobs synchronously in the submitting thread (useful for debugging and scripts)."""
+    name = "inline"
+
+    def __init__(self, max_workers: int = None):
+        pass
+
+    def submit(self, fn):
+        fn()
+
+BACKENDS = {backend.name: backend for backend in (ThreadPoolBackend, InlineBackend)}
+
+# --- Jobs ---
+
+JOB_WAIT_SECONDS = metrics.histogram("mcq_job_queue_wait_seconds", "Time jobs spent queued before starting.", ("kind",))
+JOB_SECONDS = metrics.histogram("mcq_job_seconds", "Run time of background jobs.", ("kind", "status"))
+
+class Job:
+    """State of one queued request. result holds the JSON payload the endpoint would have returned."""
+
+    def __init__(self, kind: str, topic: str, fn):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.topic = topic
+        self.fn = fn
+        self.request_id = log_utils.get_request_id()
+        self.context = contextvars.copy_context() # The job logs under the request id of the request that queued it
+        self.status = "queued" # queued -> running -> succeeded | failed
+        self.stage = "queued"
+        self.percent = 0
+        self.result = None
+        self.http_status = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._done = threading.Event()
+
+    def wait(self, timeout: float = None) -> bool:
+        """Blocks until the job has finished (or timeout seconds passed). Returns whether it finished."""
+        return self._done.wait(timeout)
+
+    def update_progress(self, stage: str, percent: int = None):
+        """Called by the job function to report what it is doing."""
+        self.stage = stage
+        if percent is not None:
+            self.percent = percent
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "topic": self.topic,
+            "request_id": self.request_id,
+            "status": self.status,
+            "progress": {"stage": self.stage, "percent": self.percent},
+            "result": self.result,
+            "http_status": self.http_status,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+class JobQueue:
+    """Queues jobs and runs them with a global concurrency cap and a per-topic cap."""
+
+    def __init__(self, backend, max_concurrent: int, max_per_topic: int, retention_seconds: float,
+                 kind_caps: dict[str, int] = None):
+        self.backend = backend
+        self.max_concurrent = max_concurrent
+        self.max_per_topic = max_per_topic
+        self.retention_seconds = retention_seconds
+        self.kind_caps = dict(kind_caps or {}) # kind -> jobs of that kind running at once, outside the other caps
+        self._jobs: dict[str, Job] = {}
+        self._pending: deque = deque()
+        self._running_total = 0
+        self._running_by_topic: dict[str, int] = {}
+        self._running_by_kind: dict[str, int] = {} # Only kinds in kind_caps
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, topic: str, fn) -> Job:
+        """
+        Queues fn(job) -> (result payload dict, http status) and returns the Job.
+        The job starts as soon as a global slot and a slot for its topic are free
+        (or, for a kind in kind_caps, a slot of its kind).
+        """
+        job = Job(kind, topic, fn)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+            self._pending.append(job)
+        self._dispatch()
+        return job
+
+    def claim(self, kind: str, topic: str) -> Job:
+        """
+        Takes a global and a per-topic slot for work the caller runs itself (e.g. a streamed
+        response) and returns it as a running Job, or None if the caps leave no slot free right
+        now (jobs already queued for the topic go first). Pass the job to finish() when done.
+        """
+        job = Job(kind, topic, None)
+        with self._lock:
+            self._prune()
+            if not self._can_start(job) or any(queued.topic == topic and self._lane(queued) == self._lane(job)
+                                               for queued in self._pending):
+                return None
+            self._jobs[job.id] = job
+            self._start(job)
+        return job
+
+    def finish(self, job: Job, http_status: int, result: dict = None, error: str = None):
+        """Records the outcome of a claimed job and frees its slots (only the first call counts)."""
+        with self._lock:
+            if job.status != "running":
+                return
+            job.result, job.http_status, job.error = result, http_status, error
+            job.status = "succeeded" if http_status < 400 else "failed"
+        self._release(job)
+
+    def get(self, job_id: str) -> Job:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"queued": len(self._pending), "running": self._running_total + sum(self._running_by_kind.values()),
+                    "running_by_topic": dict(self._running_by_topic), "running_by_kind": dict(self._running_by_kind),
+                    "tracked": len(self._jobs)}
+
+    def _dispatch(self):
+        to_start = []
+        with self._lock:
+            for job in list(self._pending):
+                if not self._can_start(job):
+                    continue # Leave it queued; later jobs for other topics (or lanes) may still start
+                self._pending.remove(job)
+                self._start(job)
+                to_start.append(job)
+        for job in to_start:
+            self.backend.submit(lambda job=job: self._run(job))
+
+    def _lane(self, job: Job) -> str:
+        """The kind whose own cap applies to job, or None for the shared global and per-topic caps."""
+        return job.kind if job.kind in self.kind_caps else None
+
+    def _can_start(self, job: Job) -> bool:
+        """Whether job's caps leave a slot free. Caller holds the lock."""
+        lane = self._lane(job)
+        if lane is not None:
+            return self._running_by_kind.get(lane, 0) < self.kind_caps[lane]
+        return self._running_total < self.max_concurrent and self._running_by_topic.get(job.topic, 0) < self.max_per_topic
+
+    def _start(self, job: Job):
+        """Marks job running in its slots. Caller holds the lock."""
+        lane = self._lane(job)
+        if lane is not None:
+            self._running_by_kind[lane] = self._running_by_kind.get(lane, 0) + 1
+        else:
+            self._running_total += 1
+            self._running_by_topic[job.topic] = self._running_by_topic.get(job.topic, 0) + 1
+        job.status = "running"
+        job.started_at = time.time()
+
+    def _release(self, job: Job):
+        """Marks a running job finished, frees its slots and starts whatever can run now."""
+        with self._lock:
+            job.finished_at = time.time()
+            job.update_progress("done", 100)
+            lane = self._lane(job)
+            if lane is not None:
+                self._running_by_kind[lane] -= 1
+            else:
+                self._running_total -= 1
+                self._running_by_topic[job.topic] -= 1
+                if not self._running_by_topic[job.topic]:
+                    del self._running_by_topic[job.topic]
+        JOB_SECONDS.observe(job.finished_at - job.started_at, kind=job.kind, status=job.status)
+        job._done.set()
+        self._dispatch()
+
+    def _run(self, job: Job):
+        try:
+            JOB_WAIT_SECONDS.observe(job.started_at - job.created_at, kind=job.kind)
+            mode = job.context.get(profiling.PROFILE_MODE)
+            if mode:
+                job.result, job.http_status = job.context.run(profiling.run_profiled, mode, f"job {job.kind} {job.id}", job.fn, job)
+            else:
+                job.result, job.http_status = job.context.run(job.fn, job)
+            job.status = "succeeded" if job.http_status < 400 else "failed"
+        except Exception as e:
+            logger.exception(f"Error in background {job.kind} job {job.id}: {e}")
+            job.status = "failed"
+            job.error = str(e)
+            job.http_status = 500
+            job.result = {"status": "error", "message": f"An internal error occurred: {e}"}
+        finally:
+            self._release(job)
+
+    def _prune(self):
+        """Forgets finished jobs older than the retention period. Caller holds the lock."""
+        cutoff = time.time() - self.retention_seconds
+        for job_id in [j.id for j in self._jobs.values() if j.finished_at and j.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+def create_job_queue() -> JobQueue:
+    """Creates the job queue described by config (JOB_BACKEND, JOB_MAX_CONCURRENT, ...)."""
+    backend_cls = BACKENDS.get(config.JOB_BACKEND)
+    if backend_cls is None:
+        raise ValueError(f"Unknown job backend '{config.JOB_BACKEND}'. Expected one of: {', '.join(BACKENDS)}")
+    kind_caps = {"ingest": config.JOB_INGEST_MAX_CONCURRENT}
+    return JobQueue(backend_cls(config.JOB_MAX_CONCURRENT + sum(kind_caps.values())), config.JOB_MAX_CONCURRENT,
+                    config.JOB_MAX_PER_TOPIC, config.JOB_RETENTION_SECONDS, kind_caps)
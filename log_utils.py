@@ -0,0 +1,76 @@
+# log_utils.py
+"""
+Structured logging for the app and its modules.
+
+Modules log through get_logger(__name__). Every record carries the id of the
+request it belongs to (set by app.py per request from X-Request-ID, or a new
+one), including records from background jobs and Gemini worker threads, which
+run in a copy of the submitting request's context. LOG_FORMAT selects
+"text" lines or one JSON object per line; LOG_LEVEL sets the threshold.
+"""
+import contextvars
+import json
+import logging
+import re
+import sys
+import threading
+import time
+import uuid
+import config
+
+_REQUEST_ID = contextvars.ContextVar("request_id", default=None)
+_REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+_CONFIGURED = False
+_CONFIGURE_LOCK = threading.Lock()
+
+# Attributes every LogRecord has; anything else was passed via extra= and is emitted as a field
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
+
+def get_request_id() -> str:
+    return _REQUEST_ID.get()
+
+def set_request_id(request_id: str = None) -> str:
+    """Sets the current context's request id (a client-supplied one if it is safe to log, else a new one)."""
+    if not request_id or not _REQUEST_ID_RE.match(request_id):
+        request_id = uuid.uuid4().hex[:16]
+    _REQUEST_ID.set(request_id)
+    return request_id
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = _REQUEST_ID.get() or "-"
+        return True
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: ts, level, logger, request_id, message, any extra fields and the traceback."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {"ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+                 "level": record.levelname, "logger": record.name, "request_id": record.request_id,
+                 "message": record.getMessage()}
+        entry.update({k: v for k, v in vars(record).items() if k not in _STANDARD_ATTRS})
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+def configure_logging():
+    """Installs the request-id filter and the LOG_FORMAT formatter on the root logger (once per process)."""
+    global _CONFIGURED
+    with _CONFIGURE_LOCK:
+        if _CONFIGURED:
+            return
+        handler = logging.StreamHandler(sys.stdout)
+        handler.addFilter(RequestIdFilter())
+        if config.LOG_FORMAT == "json":
+            handler.setFormatter(JsonFormatter())
+        else:
+            handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s"))
+        root = logging.getLogger()
+        root.addHandler(handler)
+        root.setLevel(config.LOG_LEVEL)
+        _CONFIGURED = True
+
+def get_logger(name: str) -> logging.Logger:
+    """Returns the named logger, configuring logging on first use so scripts and the app log alike."""
+    configure_logging()
+    return logging.getLogger(name)
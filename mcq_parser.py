@@ -0,0 +1,380 @@
+# mcq_parser.py
+"""
+Turns Gemini responses into MCQ dicts {"question", "options": {A-D}, "correct_answer"}.
+
+Two output modes (config.GEMINI_OUTPUT_MODE):
+  "json" - the model is asked for a JSON array matching MCQ_RESPONSE_SCHEMA. Items are
+           checked with a validator compiled once from the schema; a truncated or
+           otherwise broken array is salvaged object by object.
+  "text" - the model writes "Question: / Options: / A) .. D) / Correct Answer:" blocks,
+           parsed with a regex and, if that finds nothing, a more forgiving line parser.
+Either mode falls back to the other parser when its own finds nothing.
+Per-mode parse statistics are kept so the share of wasted output can be compared.
+"""
+import json
+import re
+import threading
+import metrics
+from log_utils import get_logger
+
+logger = get_logger(__name__)
+
+OPTION_LETTERS = ("A", "B", "C", "D")
+
+# --- Schema ---
+# Declared once; sent to Gemini as response_schema and compiled into the local validator
+MCQ_ITEM_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "question": {"type": "string", "minLength": 1},
+        "options": {
+            "type": "object",
+            "properties": {letter: {"type": "string", "minLength": 1} for letter in OPTION_LETTERS},
+            "required": list(OPTION_LETTERS),
+        },
+        "correct_answer": {"type": "string", "enum": list(OPTION_LETTERS)},
+    },
+    "required": ["question", "options", "correct_answer"],
+}
+MCQ_RESPONSE_SCHEMA = {"type": "array", "items": MCQ_ITEM_SCHEMA}
+
+def _gemini_schema(schema: dict) -> dict:
+    """The schema without keywords Gemini's response_schema does not accept."""
+    if not isinstance(schema, dict):
+        return schema
+    return {key: ({k: _gemini_schema(v) for k, v in value.items()} if key == "properties" else _gemini_schema(value))
+            for key, value in schema.items() if key != "minLength"}
+
+GEMINI_RESPONSE_SCHEMA = _gemini_schema(MCQ_RESPONSE_SCHEMA)
+
+def compile_validator(schema: dict):
+    """
+    Compiles a (small subset of) JSON schema into a function value -> error message or None.
+    Supported: type object/array/string, properties, required, items, enum, minLength.
+    The schema is walked once here, so validating an item is just a few nested calls.
+    """
+    kind = schema.get("type")
+    if kind == "string":
+        enum = set(schema["enum"]) if "enum" in schema else None
+        min_length = schema.get("minLength", 0)
+
+        def validate_string(value, path):
+            if not isinstance(value, str):
+                return f"{path}: expected a string"
+            if len(value.strip()) < min_length:
+                return f"{path}: too short"
+            if enum is not None and value not in enum:
+                return f"{path}: must be one of {sorted(enum)}"
+            return None
+        return validate_string
+
+    if kind == "object":
+        fields = [(name, compile_validator(sub)) for name, sub in schema.get("properties", {}).items()]
+        required = list(schema.get("required", []))
+
+        def validate_object(value, path):
+            if not isinstance(value, dict):
+                return f"{path}: expected an object"
+            for name in required:
+                if name not in value:
+                    return f"{path}: missing '{name}'"
+            for name, check in fields:
+                if name in value:
+                    error = check(value[name], f"{path}.{name}")
+                    if error:
+                        return error
+            return None
+        return validate_object
+
+    if kind == "array":
+        check_item = compile_validator(schema["items"])
+
+        def validate_array(value, path):
+            if not isinstance(value, list):
+                return f"{path}: expected an array"
+            for i, item in enumerate(value):
+                error = check_item(item, f"{path}[{i}]")
+                if error:
+                    return error
+            return None
+        return validate_array
+
+    raise ValueError(f"Unsupported schema type: {kind}")
+
+_validate_item = compile_validator(MCQ_ITEM_SCHEMA)
+
+def validate_mcq(item) -> str:
+    """Returns None if item is a valid MCQ, else what is wrong with it."""
+    if isinstance(item, dict) and isinstance(item.get("correct_answer"), str):
+        item["correct_answer"] = item["correct_answer"].strip().upper() # Tolerate " b"
+    return _validate_item(item, "item")
+
+def _to_mcq(item: dict) -> dict:
+    return {"question": item["question"].strip(),
+            "options": {letter: item["options"][letter].strip() for letter in OPTION_LETTERS},
+            "correct_answer": item["correct_answer"]}
+
+# --- JSON Mode ---
+_FENCE_PATTERN = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$", re.IGNORECASE)
+_DECODER = json.JSONDecoder()
+
+def _scan_json_objects(text: str, pos: int) -> tuple[list, int, bool]:
+    """
+    Decodes consecutive array elements starting at pos (just after '[').
+    Returns (decoded values, position after the last complete one, whether the array closed).
+    Stops quietly at the first element that is incomplete or broken.
+    """
+    values = []
+    length = len(text)
+    while True:
+        while pos < length and text[pos] in " \t\r\n,":
+            pos += 1
+        if pos >= length:
+            return values, pos, False
+        if text[pos] == "]":
+            return values, pos + 1, True
+        try:
+            value, end = _DECODER.raw_decode(text, pos)
+        except json.JSONDecodeError:
+            return values, pos, False
+        values.append(value)
+        pos = end
+
+def parse_json_response(text: str) -> tuple[list[dict], int, bool]:
+    """
+    Parses a JSON array of MCQs. Returns (valid MCQs, number of invalid items, whether the
+    array had to be salvaged because it was truncated or broken).
+    """
+    text = _FENCE_PATTERN.sub("", text)
+    start = text.find("[")
+    if start == -1:
+        return [], 0, False
+    try:
+        items, salvaged = json.loads(text[start:]), False
+        if not isinstance(items, list):
+            items = [items]
+    except json.JSONDecodeError:
+        items, _, _ = _scan_json_objects(text, start + 1)
+        salvaged = True
+    questions, invalid = [], 0
+    for item in items:
+        error = validate_mcq(item)
+        if error:
+            invalid += 1
+            logger.warning(f"Skipping invalid MCQ item ({error})")
+            continue
+        questions.append(_to_mcq(item))
+    return questions, invalid, salvaged
+
+# --- Text Mode ---
+# Regex to find question blocks, handling variations in spacing and numbering
+# This regex looks for "Question:" possibly preceded by a number and dot,
+# then captures the question text, options block, and correct answer line.
+MCQ_PATTERN = re.compile(
+    r"^\s*(?:\d+\.\s*)?Question:\s*(.*?)\s*" # Capture question text
+    r"Options:\s*\n"                         # Options header
+    r"^\s*A\)\s*(.*?)\s*\n"                  # Option A
+    r"^\s*B\)\s*(.*?)\s*\n"                  # Option B
+    r"^\s*C\)\s*(.*?)\s*\n"                  # Option C
+    r"^\s*D\)\s*(.*?)\s*\n"                  # Option D
+    r"^\s*Correct Answer:\s*([A-D])\s*$",    # Correct Answer (single letter)
+    re.MULTILINE | re.IGNORECASE             # Multiline and case-insensitive
+)
+
+def match_to_mcq(match: re.Match) -> dict:
+    """Builds an MCQ dict from an MCQ_PATTERN match, or returns None if the block is malformed."""
+    question_text = match.group(1).strip()
+    options = {
+        "A": match.group(2).strip(),
+        "B": match.group(3).strip(),
+        "C": match.group(4).strip(),
+        "D": match.group(5).strip(),
+    }
+    correct_answer = match.group(6).strip().upper()
+
+    if question_text and all(options.values()) and correct_answer in options:
+        return {
+            "question": question_text,
+            "options": options,
+            "correct_answer": correct_answer,
+        }
+    # Log the block that failed parsing for debugging
+    logger.warning(f"Skipping malformed block detected by regex:\n{match.group(0)}")
+    return None
+
+# Line patterns for the forgiving fallback (markdown bold, "A." / "A:" options, "**Answer:** B", ...)
+_QUESTION_LINE = re.compile(r"^[\s*#>]*(?:\d+[.)]\s*)?[\s*]*Question(?:\s*\d+)?[\s*]*[:.)][\s*]*(.*)$", re.IGNORECASE)
+_OPTION_LINE = re.compile(r"^[\s*\-]*\(?([A-D])[).:\]][\s*]*(.+?)[\s*]*$", re.IGNORECASE)
+_ANSWER_LINE = re.compile(r"^[\s*]*(?:Correct\s+)?Answer[\s*]*[:\-][\s*]*\(?([A-Da-d])\b", re.IGNORECASE)
+_OPTIONS_HEADER = re.compile(r"^[\s*]*Options[\s*]*:?[\s*]*$", re.IGNORECASE)
+
+def parse_text_fallback(text: str) -> list[dict]:
+    """
+    Line-by-line parser for text that drifted from the exact format (the split method of
+    the original script, made tolerant of numbering, markdown and option punctuation).
+    """
+    questions = []
+    current = None
+
+    def finish(block):
+        if block and block["question"] and len(block["options"]) == 4 and block["correct_answer"] in block["options"]:
+            questions.append({"question": " ".join(block["question"]).strip(),
+                              "options": {letter: block["options"][letter] for letter in OPTION_LETTERS},
+                              "correct_answer": block["correct_answer"]})
+        elif block:
+            logger.warning(f"Fallback parser skipped an incomplete block: {' '.join(block['question'])[:80]}")
+
+    for line in text.splitlines():
+        question_match = _QUESTION_LINE.match(line)
+        if question_match:
+            finish(current)
+            current = {"question": [question_match.group(1).strip()], "options": {}, "correct_answer": None}
+            continue
+        if current is None or not line.strip() or _OPTIONS_HEADER.match(line):
+            continue
+        answer_match = _ANSWER_LINE.match(line)
+        if answer_match:
+            current["correct_answer"] = answer_match.group(1).upper()
+            finish(current)
+            current = None
+            continue
+        option_match = _OPTION_LINE.match(line)
+        if option_match:
+            current["options"][option_match.group(1).upper()] = option_match.group(2).strip()
+        elif not current["options"]:
+            current["question"].append(line.strip()) # Question text continued on the next line
+    finish(current)
+    return questions
+
+def parse_text_response(text: str) -> tuple[list[dict], bool]:
+    """
+    Regex parse of 'Question:' blocks, falling back to the line parser if the regex finds nothing.
+    Returns (MCQs, whether the fallback was used).
+    """
+    questions = []
+    for match in MCQ_PATTERN.finditer(text):
+        mcq = match_to_mcq(match)
+        if mcq:
+            questions.append(mcq)
+
+    if not questions and text.strip(): # If regex found nothing, try the line-by-line fallback
+        logger.warning("Regex parsing failed, attempting fallback line parser.")
+        return parse_text_fallback(text), True
+    return questions, False
+
+# --- Parse Statistics ---
+_STATS_LOCK = threading.Lock()
+_PARSE_STATS: dict[str, dict] = {}
+
+def _record(mode: str, text: str, question_count: int, invalid: int = 0, salvaged: bool = False, fallback: bool = False):
+    with _STATS_LOCK:
+        stats = _PARSE_STATS.setdefault(mode, {"responses": 0, "responses_with_questions": 0, "questions": 0,
+                                               "invalid_items": 0, "salvaged_responses": 0, "fallback_used": 0,
+                                               "response_chars": 0, "wasted_chars": 0})
+        stats["responses"] += 1
+        stats["responses_with_questions"] += 1 if question_count else 0
+        stats["questions"] += question_count
+        stats["invalid_items"] += invalid
+        stats["salvaged_responses"] += 1 if salvaged else 0
+        stats["fallback_used"] += 1 if fallback else 0
+        stats["response_chars"] += len(text)
+        if not question_count:
+            stats["wasted_chars"] += len(text) # Output paid for but thrown away
+
+def get_parse_stats() -> dict:
+    """Per-mode parse counters plus success rate and the share of response text that was wasted."""
+    with _STATS_LOCK:
+        result = {}
+        for mode, stats in _PARSE_STATS.items():
+            stats = dict(stats)
+            stats["success_rate"] = stats["responses_with_questions"] / stats["responses"] if stats["responses"] else None
+            stats["wasted_share"] = stats["wasted_chars"] / stats["response_chars"] if stats["response_chars"] else None
+            result[mode] = stats
+        return result
+
+@metrics.timed("parse_mcq_response")
+def parse_mcq_response(text: str, mode: str) -> list[dict]:
+    """Parses a full response written in the given output mode ('json' or 'text')."""
+    invalid, salvaged, fallback = 0, False, False
+    if mode == "json":
+        questions, invalid, salvaged = parse_json_response(text)
+        if not questions and text.strip():
+            logger.warning("No valid JSON MCQs in response, falling back to the text parser.")
+            questions, fallback = parse_text_response(text)[0], True
+    else:
+        questions, fallback = parse_text_response(text)
+        if not questions and "[" in text:
+            questions, invalid, salvaged = parse_json_response(text)
+            fallback = bool(questions)
+    _record(mode, text, len(questions), invalid, salvaged, fallback)
+    logger.info(f"Parsed {len(questions)} questions from response.")
+    return questions
+
+# --- Streaming ---
+
+class McqStreamParser:
+    """
+    Incrementally parses MCQs out of streamed response text.
+    Text mode: a block is only emitted once the line after its 'Correct Answer' has started
+    (or the stream has finished), so a half-received answer line is never parsed.
+    JSON mode: each array element is emitted as soon as it decodes completely.
+    """
+
+    def __init__(self, mode: str = "text"):
+        self.mode = mode
+        self._buffer = ""
+        self._text = []
+        self._json_pos = None # Position after '[' and the last decoded element
+        self._emitted = 0
+        self._invalid = 0
+
+    def feed(self, text: str) -> list[dict]:
+        """Adds streamed text and returns any MCQs completed by it."""
+        self._buffer += text
+        self._text.append(text)
+        questions = self._drain(final=False)
+        self._emitted += len(questions)
+        return questions
+
+    def finish(self) -> list[dict]:
+        """Parses whatever remains once the stream has ended, and records parse statistics."""
+        questions = self._drain(final=True)
+        full_text = "".join(self._text)
+        fallback = False
+        if self.mode == "json" and not self._emitted and not questions and full_text.strip():
+            questions, fallback = parse_text_response(full_text)[0], True # Model ignored the JSON instructions
+        self._emitted += len(questions)
+        _record(self.mode, full_text, self._emitted, self._invalid, fallback=fallback)
+        return questions
+
+    def _drain(self, final: bool) -> list[dict]:
+        if self.mode == "json":
+            return self._drain_json()
+        questions = []
+        consumed = 0
+        for match in MCQ_PATTERN.finditer(self._buffer):
+            if not final and "\n" not in self._buffer[match.end():]:
+                break
+            consumed = match.end()
+            mcq = match_to_mcq(match)
+            if mcq:
+                questions.append(mcq)
+        self._buffer = self._buffer[consumed:]
+        return questions
+
+    def _drain_json(self) -> list[dict]:
+        if self._json_pos is None:
+            start = self._buffer.find("[")
+            if start == -1:
+                return []
+            self._json_pos = start + 1
+        items, self._json_pos, _ = _scan_json_objects(self._buffer, self._json_pos)
+        questions = []
+        for item in items:
+            error = validate_mcq(item)
+            if error:
+                self._invalid += 1
+                logger.warning(f"Skipping invalid MCQ item ({error})")
+            else:
+                questions.append(_to_mcq(item))
+        return questions
@@ -0,0 +1,150 @@
+# metrics.py
+"""
+Lightweight in-process instrumentation: counters, histograms and stage timers,
+exported by /metrics in the Prometheus text exposition format.
+
+Stages are timed with
+    with metrics.timed("bank_load"): ...
+or as a decorator (@metrics.timed("format_bank_for_prompt")), which records
+mcq_stage_seconds{stage=...} and counts exceptions in mcq_stage_errors_total.
+Metrics are per process: under several gunicorn workers each worker reports its own.
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+import config
+
+# Latency buckets in seconds (PDF pages are milliseconds, Gemini calls tens of seconds)
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Size buckets in characters (prompts reach a few hundred thousand)
+CHARS_BUCKETS = (500, 2000, 8000, 32000, 128000, 512000, 2000000)
+
+_LOCK = threading.Lock()
+_METRICS: dict[str, object] = {} # name -> metric, in registration order
+
+def _label_key(labelnames: tuple, labels: dict) -> tuple:
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labelnames: tuple, key: tuple, extra: dict = None) -> str:
+    pairs = list(zip(labelnames, key)) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class Counter:
+    """A monotonically increasing value per label set."""
+    type_name = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        self.name, self.help, self.labelnames = name, help_text, tuple(labelnames)
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        if not config.METRICS_ENABLED:
+            return
+        key = _label_key(self.labelnames, labels)
+        with _LOCK:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> list[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in sorted(self._values.items())]
+
+class Gauge(Counter):
+    """A value that can go up and down (set at scrape time for queue depths and cache sizes)."""
+    type_name = "gauge"
+
+    def set(self, value: float, **labels):
+        if not config.METRICS_ENABLED:
+            return
+        with _LOCK:
+            self._values[_label_key(self.labelnames, labels)] = value
+
+class Histogram:
+    """Cumulative bucket counts, sum and count of observed values per label set."""
+    type_name = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = SECONDS_BUCKETS):
+        self.name, self.help, self.labelnames = name, help_text, tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._values = {} # label key -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels):
+        if not config.METRICS_ENABLED:
+            return
+        key = _label_key(self.labelnames, labels)
+        with _LOCK:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def samples(self) -> list[str]:
+        lines = []
+        for key, entry in sorted(self._values.items()):
+            for bound, count in zip(self.buckets, entry):
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, {'le': _format_value(bound)})} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(entry[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {entry[-1]}")
+        return lines
+
+def _register(cls, name: str, help_text: str, labelnames: tuple = (), **kwargs):
+    with _LOCK:
+        metric = _METRICS.get(name)
+        if metric is None:
+            metric = _METRICS[name] = cls(name, help_text, labelnames, **kwargs)
+        elif not isinstance(metric, cls):
+            raise ValueError(f"Metric '{name}' is already registered as a {metric.type_name}")
+        return metric
+
+def counter(name: str, help_text: str, labelnames: tuple = ()) -> Counter:
+    """Returns the counter registered under name, creating it on first use."""
+    return _register(Counter, name, help_text, labelnames)
+
+def gauge(name: str, help_text: str, labelnames: tuple = ()) -> Gauge:
+    return _register(Gauge, name, help_text, labelnames)
+
+def histogram(name: str, help_text: str, labelnames: tuple = (), buckets: tuple = SECONDS_BUCKETS) -> Histogram:
+    return _register(Histogram, name, help_text, labelnames, buckets=buckets)
+
+# --- Stage Timers ---
+
+STAGE_SECONDS = histogram("mcq_stage_seconds", "Time spent in each processing stage.", ("stage",))
+STAGE_ERRORS = counter("mcq_stage_errors_total", "Stages that ended with an exception.", ("stage",))
+
+@contextmanager
+def timed(stage: str):
+    """Times the enclosed block (or decorated function) as mcq_stage_seconds{stage}."""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+# --- Exposition ---
+
+def render() -> str:
+    """All metrics in the Prometheus text format (version 0.0.4)."""
+    with _LOCK:
+        lines = []
+        for metric in _METRICS.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
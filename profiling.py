@@ -0,0 +1,194 @@
+# profiling.py
+"""
+Opt-in per-request profiling for admins.
+
+Only active when PROFILING_ADMIN_TOKEN is set: app.py then installs the hooks
+below (otherwise nothing is registered, so there is no overhead). A request
+carrying X-Admin-Token: <token> plus either X-Profile: <mode> or ?profile=<mode>
+runs its handler under:
+  - "cprofile": cProfile, saved as <id>.pstats (snakeviz, flameprof, gprof2dot)
+  - "sample":   a wall-clock stack sampler over all threads, saved as <id>.collapsed
+                ("thread;frame;frame count" lines, ready for flamegraph.pl or speedscope)
+Background jobs queued by a profiled request (e.g. /generate) are profiled too,
+under their own id, since that is where generation time is spent. Profiles and
+a JSON summary of each are written to PROFILES_DIR; the newest PROFILES_MAX_KEPT
+are kept and listed by /profiles.
+"""
+import contextvars
+import cProfile
+import hmac
+import json
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+import config
+from fs_utils import atomic_write_json
+from log_utils import get_logger, get_request_id
+
+logger = get_logger(__name__)
+
+MODES = ("cprofile", "sample")
+PROFILE_MODE = contextvars.ContextVar("profile_mode", default=None)
+_SAFE_LABEL_RE = re.compile(r"[^A-Za-z0-9_.-]+")
+
+# --- Sessions ---
+
+class CProfileSession:
+    """Deterministic profile of the current thread."""
+    suffix = ".pstats"
+
+    def __init__(self):
+        self._profile = cProfile.Profile()
+
+    def start(self):
+        self._profile.enable()
+
+    def stop(self):
+        self._profile.disable()
+
+    def save(self, path: Path):
+        self._profile.dump_stats(str(path))
+
+class SamplingSession:
+    """Samples every thread's stack each PROFILE_SAMPLE_INTERVAL_SECONDS on a background thread."""
+    suffix = ".collapsed"
+
+    def __init__(self, interval: float = None):
+        self.interval = interval or config.PROFILE_SAMPLE_INTERVAL_SECONDS
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    self.stacks[_collapse(names.get(ident, str(ident)), frame)] += 1
+
+    def save(self, path: Path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+def _collapse(thread_name: str, frame) -> str:
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f"{Path(code.co_filename).name}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join([thread_name] + frames[::-1]).replace(" ", "_")
+
+_SESSIONS = {"cprofile": CProfileSession, "sample": SamplingSession}
+
+# --- Storage ---
+
+def get_profiles_dir() -> Path:
+    return Path(config.PROFILES_DIR)
+
+def _save(session, mode: str, label: str, seconds: float) -> str:
+    profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{get_request_id() or 'none'}-{_SAFE_LABEL_RE.sub('_', label)[:60]}"
+    folder = get_profiles_dir()
+    folder.mkdir(parents=True, exist_ok=True)
+    session.save(folder / f"{profile_id}{session.suffix}")
+    atomic_write_json(folder / f"{profile_id}.json", {
+        "id": profile_id, "label": label, "mode": mode, "request_id": get_request_id(),
+        "seconds": round(seconds, 3), "created_at": time.time(), "file": f"{profile_id}{session.suffix}"})
+    _prune(folder)
+    logger.info(f"Saved {mode} profile of {label} ({seconds:.2f}s) as {profile_id}{session.suffix}")
+    return profile_id
+
+def _prune(folder: Path):
+    summaries = sorted(folder.glob("*.json"), key=lambda p: p.stat().st_mtime, reverse=True)
+    for summary in summaries[config.PROFILES_MAX_KEPT:]:
+        for path in folder.glob(f"{summary.stem}.*"):
+            path.unlink(missing_ok=True)
+
+def list_profiles(limit: int = 20) -> list[dict]:
+    """Summaries of the most recent profiles, newest first."""
+    profiles = []
+    for summary in get_profiles_dir().glob("*.json"):
+        try:
+            with open(summary, 'r', encoding='utf-8') as f:
+                profiles.append(json.load(f))
+        except (OSError, json.JSONDecodeError):
+            continue
+    return sorted(profiles, key=lambda p: p.get("created_at", 0), reverse=True)[:limit]
+
+# --- Running Profiled ---
+
+def start(mode: str):
+    """Starts a session of the given mode, or returns None (logging why) if it cannot start."""
+    session = _SESSIONS[mode]()
+    try:
+        session.start()
+    except ValueError as e: # e.g. another cProfile already active in this thread
+        logger.warning(f"Could not start {mode} profiling: {e}")
+        return None
+    return session
+
+def finish(session, mode: str, label: str, started: float) -> str:
+    """Stops session and saves it. Returns the profile id (None if saving failed)."""
+    session.stop()
+    try:
+        return _save(session, mode, label, time.perf_counter() - started)
+    except OSError as e:
+        logger.warning(f"Could not save {mode} profile of {label}: {e}")
+        return None
+
+def run_profiled(mode: str, label: str, fn, *args):
+    """Calls fn(*args) under a profiling session (used for jobs queued by a profiled request)."""
+    session = start(mode)
+    started = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        if session:
+            finish(session, mode, label, started)
+
+# --- Flask Integration ---
+
+def is_admin(request) -> bool:
+    token = request.headers.get('X-Admin-Token', '')
+    return bool(config.PROFILING_ADMIN_TOKEN) and hmac.compare_digest(token.encode('utf-8'), config.PROFILING_ADMIN_TOKEN.encode('utf-8'))
+
+def requested_mode(request) -> str:
+    """The profiling mode an admin asked for on this request, or None."""
+    mode = request.headers.get('X-Profile') or request.args.get('profile')
+    if not mode:
+        return None
+    if mode not in MODES or not is_admin(request):
+        logger.warning(f"Ignoring profiling request (mode '{mode}') without a valid admin token or mode.")
+        return None
+    return mode
+
+def install(app):
+    """Registers the request hooks that profile flagged requests (a streamed body is not included)."""
+    from flask import g, request
+
+    @app.before_request
+    def start_profile():
+        mode = requested_mode(request)
+        PROFILE_MODE.set(mode) # Jobs run in a copy of this context, so they are profiled as well
+        if mode:
+            g.profile = (start(mode), mode, time.perf_counter())
+
+    @app.after_request
+    def finish_profile(response):
+        session, mode, started = g.pop('profile', (None, None, None))
+        if session:
+            profile_id = finish(session, mode, f"{request.method} {request.path}", started)
+            if profile_id:
+                response.headers['X-Profile-Id'] = profile_id
+        return response
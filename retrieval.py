@@ -0,0 +1,241 @@
+# retrieval.py
+import json
+import math
+from collections import Counter
+from pathlib import Path
+import config
+import data_manager as dm
+import file_handler as fh
+from fs_utils import atomic_write_json, file_lock
+from text_utils import tokenize, estimate_tokens
+from log_utils import get_logger
+
+logger = get_logger(__name__)
+
+INDEX_FORMAT_VERSION = 1
+# Chunks with fewer terms than this (title slides, agenda pages) are never selected
+MIN_CHUNK_TERMS = 15
+
+# --- Chunking ---
+
+def _split_long_text(text: str, max_chars: int) -> list[str]:
+    """Splits text on line breaks into pieces of at most ~max_chars characters."""
+    if len(text) <= max_chars:
+        return [text]
+    pieces, piece = [], ""
+    for line in text.splitlines():
+        if piece and len(piece) + len(line) + 1 > max_chars:
+            pieces.append(piece)
+            piece = ""
+        piece = f"{piece}\n{line}" if piece else line
+    if piece:
+        pieces.append(piece)
+    return pieces
+
+def chunk_pages(filename: str, pages: list[str], max_chars: int = None) -> list[dict]:
+    """
+    Splits a document's pages into chunks of roughly max_chars characters.
+    Consecutive short pages are merged; a page longer than max_chars is split on line breaks.
+    Each chunk records the 1-based page range it came from.
+    """
+    max_chars = max_chars or config.RETRIEVAL_CHUNK_CHARS
+    chunks = []
+    buffer, buffer_len, start_page, end_page = [], 0, None, None
+
+    for page_no, page_text in enumerate(pages, start=1):
+        page_text = (page_text or "").strip()
+        for piece in (_split_long_text(page_text, max_chars) if page_text else []):
+            if buffer and buffer_len + len(piece) > max_chars:
+                chunks.append({"file": filename, "page_start": start_page, "page_end": end_page,
+                               "text": "\n".join(buffer)})
+                buffer, buffer_len = [], 0
+            if not buffer:
+                start_page = page_no
+            buffer.append(piece)
+            buffer_len += len(piece)
+            end_page = page_no
+    if buffer:
+        chunks.append({"file": filename, "page_start": start_page, "page_end": end_page, "text": "\n".join(buffer)})
+
+    for i, chunk in enumerate(chunks):
+        chunk["id"] = f"{filename}#{i}"
+        terms = tokenize(chunk["text"])
+        chunk["terms"] = dict(Counter(terms))
+        chunk["length"] = len(terms)
+    return chunks
+
+# --- Persisted Index ---
+
+def get_index_file(topic_name: str) -> Path:
+    """Gets the retrieval index path for a topic (stored next to question_bank.json)."""
+    return dm.get_topic_path(topic_name) / "retrieval_index.json"
+
+def _index_lock_file(topic_name: str) -> Path:
+    return dm.get_topic_path(topic_name) / "retrieval_index.json.lock"
+
+def _load_index(topic_name: str) -> dict:
+    filepath = get_index_file(topic_name)
+    try:
+        with open(filepath, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        if isinstance(index, dict) and index.get("version") == INDEX_FORMAT_VERSION:
+            return index
+        logger.info(f"Retrieval index {filepath} has an old format. Rebuilding.")
+    except FileNotFoundError:
+        pass
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"Could not read retrieval index {filepath} ({e}). Rebuilding.")
+    return {"version": INDEX_FORMAT_VERSION, "files": {}}
+
+def _save_index(topic_name: str, index: dict):
+    filepath = get_index_file(topic_name)
+    try:
+        atomic_write_json(filepath, index)
+    except OSError as e:
+        logger.warning(f"Could not save retrieval index {filepath}: {e}")
+
+def update_topic_index(topic_name: str, filenames: list[str]) -> dict:
+    """
+    Makes sure the topic's retrieval index has up-to-date chunks for the given context PDFs.
+    Files are re-chunked only when their extraction cache key (hash + size + mtime) changes.
+    Extraction runs unlocked; the new entries are then merged into a fresh read of the
+    index under an inter-process lock, so concurrent ingest and /generate updates
+    (in any worker) never drop each other's files. Returns the index.
+    """
+    index = _load_index(topic_name)
+    context_folder = dm.get_context_folder(topic_name)
+    stale = {}
+    for filename in filenames:
+        pdf_path = context_folder / filename
+        if ".." in filename or filename.startswith("/") or not pdf_path.is_file():
+            continue
+        key = fh.extraction_cache_key(pdf_path)
+        entry = index["files"].get(filename)
+        if not entry or entry.get("key") != key:
+            stale[pdf_path] = key
+
+    if stale:
+        logger.info(f"Indexing {len(stale)} file(s) for retrieval in topic '{topic_name}'...")
+        extracted = fh.extract_pdfs(list(stale))
+        entries = {}
+        for pdf_path, key in stale.items():
+            pages = extracted[pdf_path]
+            if isinstance(pages, Exception):
+                logger.warning(f"Could not index {pdf_path.name}: {pages}")
+                continue
+            entries[pdf_path.name] = {"key": key, "chunks": chunk_pages(pdf_path.name, pages)}
+        if entries:
+            with file_lock(_index_lock_file(topic_name)):
+                index = _load_index(topic_name)
+                index["files"].update(entries)
+                _save_index(topic_name, index)
+    return index
+
+# --- BM25 ---
+
+class Bm25:
+    """Okapi BM25 scoring over a fixed list of chunks."""
+
+    def __init__(self, chunks: list[dict]):
+        self.chunks = chunks
+        self.avg_length = (sum(c["length"] for c in chunks) / len(chunks)) if chunks else 0
+        self.postings = {} # term -> list of (chunk position, term frequency)
+        for pos, chunk in enumerate(chunks):
+            for term, tf in chunk["terms"].items():
+                self.postings.setdefault(term, []).append((pos, tf))
+        n = len(chunks)
+        self.idf = {term: math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5)) for term, p in self.postings.items()}
+
+    def scores(self, query_terms: list[str]) -> dict[int, float]:
+        """Returns {chunk position: score} for chunks matching any query term."""
+        k1, b = config.BM25_K1, config.BM25_B
+        results = {}
+        for term in set(query_terms):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf[term]
+            for pos, tf in postings:
+                norm = 1 - b + b * self.chunks[pos]["length"] / (self.avg_length or 1)
+                results[pos] = results.get(pos, 0.0) + idf * tf * (k1 + 1) / (tf + k1 * norm)
+        return results
+
+def question_query_terms(q: dict) -> list[str]:
+    """Terms of a question and its correct answer, used to find the chunk it was written from."""
+    options = q.get('options') if isinstance(q.get('options'), dict) else {}
+    return tokenize(f"{q.get('question', '')} {options.get(q.get('correct_answer'), '')}")
+
+def chunk_coverage(bm25: Bm25, question_bank: list[dict]) -> list[int]:
+    """Counts, for each chunk, the bank questions whose best-matching chunk it is."""
+    coverage = [0] * len(bm25.chunks)
+    for q in question_bank:
+        scores = bm25.scores(question_query_terms(q))
+        if scores:
+            coverage[max(scores, key=scores.get)] += 1
+    return coverage
+
+# --- Context Selection ---
+
+def select_chunks(chunks: list[dict], coverage: list[int], token_budget: int, top_k: int) -> list[dict]:
+    """
+    Picks up to top_k chunks within token_budget, least-covered first.
+    Files take turns so a single deck cannot use up the whole budget.
+    """
+    per_file = {}
+    for pos, chunk in enumerate(chunks):
+        if chunk["length"] >= MIN_CHUNK_TERMS:
+            per_file.setdefault(chunk["file"], []).append(pos)
+    for positions in per_file.values():
+        positions.sort(key=lambda pos: (coverage[pos], pos))
+
+    selected, used_tokens = [], 0
+    queues = list(per_file.values())
+    while queues and len(selected) < top_k:
+        # Visit files in order of their best remaining chunk's coverage
+        queues.sort(key=lambda q: coverage[q[0]])
+        progressed = False
+        for queue in queues:
+            if len(selected) >= top_k:
+                break
+            while queue:
+                pos = queue.pop(0)
+                tokens = estimate_tokens(chunks[pos]["text"])
+                if used_tokens + tokens <= token_budget:
+                    selected.append(pos)
+                    used_tokens += tokens
+                    progressed = True
+                    break
+        queues = [q for q in queues if q]
+        if not progressed:
+            break
+    return [chunks[pos] for pos in sorted(selected)]
+
+def build_retrieval_context(topic_name: str, filenames: list[str], question_bank: list[dict],
+                            token_budget: int = None, top_k: int = None) -> tuple[str, list[dict]]:
+    """
+    Builds a compact context from the selected PDFs for generation.
+    Only the chunks least covered by existing bank questions are included, up to
+    top_k chunks and token_budget estimated tokens. Returns (context text, selected chunks).
+    """
+    token_budget = token_budget or config.RETRIEVAL_TOKEN_BUDGET
+    top_k = top_k or config.RETRIEVAL_TOP_K
+    index = update_topic_index(topic_name, filenames)
+    chunks = [c for name in filenames for c in index["files"].get(name, {}).get("chunks", [])]
+    if not chunks:
+        return "", []
+
+    relevant_bank = [q for q in question_bank
+                     if not isinstance(q.get('source_pdfs'), list) or set(q['source_pdfs']) & set(filenames)]
+    bm25 = Bm25(chunks)
+    selected = select_chunks(chunks, chunk_coverage(bm25, relevant_bank), token_budget, top_k)
+
+    context_text = ""
+    for name in filenames:
+        file_chunks = [c for c in selected if c["file"] == name]
+        if not file_chunks:
+            continue
+        for c in file_chunks:
+            context_text += f"[Pages {c['page_start']}-{c['page_end']}]\n{c['text']}\n\n"
+        context_text += f"--- End of Document: {name} ---\n\n"
+    logger.info(f"Selected {len(selected)} of {len(chunks)} chunks (~{estimate_tokens(context_text)} tokens) for retrieval context.")
+    return context_text, selected
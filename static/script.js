@@ -8,8 +8,13 @@ document.addEventListener('DOMContentLoaded', () => {
     const addTopicBtn = document.getElementById('add-topic-btn');
     const clearHistoryBtn = document.getElementById('clear-history-btn'); // New Button
     const numQuestionsInput = document.getElementById('num-questions');
+    const contextModeSelect = document.getElementById('context-mode');
+    const streamResultsCheckbox = document.getElementById('stream-results');
+    const freshResultsCheckbox = document.getElementById('fresh-results');
     // const loadingOverlay = document.getElementById('loading-overlay'); // Overlay is removed
     const contextFileSelector = document.getElementById('context-file-selector');
+    const contextUploadInput = document.getElementById('context-upload-input');
+    const contextUploadBtn = document.getElementById('context-upload-btn');
 
     // --- Quiz DOM Elements ---
     const quizArea = document.getElementById('quiz-area');
@@ -21,14 +26,44 @@ document.addEventListener('DOMContentLoaded', () => {
     const nextQuestionBtn = document.getElementById('next-question-btn');
     const questionCounter = document.getElementById('question-counter');
     const quizPdfFilterContainer = document.getElementById('quiz-pdf-filter-container');
+    const loadMoreBankBtn = document.getElementById('load-more-bank-btn');
 
     // --- State Variables ---
-    let currentTopicBank = [];
+    const BANK_PAGE_SIZE = 50;
+    const QUIZ_PAGE_SIZE = 20;
+    const QUESTION_FIELDS = 'question,options,correct_answer'; // All the display and quiz show
+    let currentTopic = null;
+    let topicQuestionCount = 0; // Questions in the topic's bank (unfiltered)
+    let bankCursor = null; // next_cursor of the bank display
     let currentQuestionIndex = 0;
-    let activeQuizBank = []; // Holds the currently active set of questions for the quiz (can be filtered)
+    let activeQuizBank = []; // Quiz questions loaded so far (filtered and shuffled by the server)
+    let quizTotal = 0; // Questions matching the quiz filter, loaded or not
+    let quizCursor = null;
+    let quizSeed = null;
+    let quizSources = [];
+    let quizLoadId = 0; // Bumped whenever the quiz restarts, so stale page responses are dropped
     let answerSubmitted = false;
 
     // --- Helper Functions ---
+    // GETs JSON, revalidating earlier responses with If-None-Match; a 304 reuses the cached body.
+    const etagCache = new Map(); // url -> { etag, data }
+    const ETAG_CACHE_MAX_ENTRIES = 100;
+    async function fetchJsonCached(url) {
+        const cached = etagCache.get(url);
+        const response = await fetch(url, { headers: cached ? { 'If-None-Match': cached.etag } : {} });
+        if (response.status === 304 && cached) {
+            return { ok: true, status: 200, data: cached.data };
+        }
+        const data = await response.json();
+        const etag = response.headers.get('ETag');
+        if (response.ok && etag) {
+            etagCache.delete(url); // Re-insert so the Map's order is least recently used first
+            etagCache.set(url, { etag: etag, data: data });
+            if (etagCache.size > ETAG_CACHE_MAX_ENTRIES) etagCache.delete(etagCache.keys().next().value);
+        }
+        return { ok: response.ok, status: response.status, data: data };
+    }
+
     function logMessage(message, isError = false) {
         const timestamp = new Date().toLocaleTimeString();
         const logEntry = `[${timestamp}] ${message}\n`;
@@ -48,6 +83,9 @@ document.addEventListener('DOMContentLoaded', () => {
         addTopicBtn.disabled = isLoading;
         clearHistoryBtn.disabled = isLoading; // Disable clear button too
         topicSelect.disabled = isLoading;
+        contextModeSelect.disabled = isLoading;
+        streamResultsCheckbox.disabled = isLoading;
+        freshResultsCheckbox.disabled = isLoading;
         submitAnswerBtn.disabled = isLoading;
         prevQuestionBtn.disabled = isLoading;
         nextQuestionBtn.disabled = isLoading;
@@ -68,9 +106,9 @@ document.addEventListener('DOMContentLoaded', () => {
             prevQuestionBtn.disabled = true;
             nextQuestionBtn.disabled = true;
             submitAnswerBtn.disabled = true;
-            if (activeQuizBank.length === 0 && currentTopicBank.length > 0) { // Filters resulted in no questions
+            if (activeQuizBank.length === 0 && topicQuestionCount > 0) { // Filters resulted in no questions
                  questionText.textContent = 'No questions match the current PDF filter.';
-            } else if (currentTopicBank.length === 0) { // No questions for topic
+            } else if (topicQuestionCount === 0) { // No questions for topic
                  quizArea.style.display = 'none';
             }
             return;
@@ -118,9 +156,9 @@ document.addEventListener('DOMContentLoaded', () => {
         }
 
         // Update counter and button states
-        questionCounter.textContent = `Question ${index + 1} of ${activeQuizBank.length}`;
+        questionCounter.textContent = `Question ${index + 1} of ${quizTotal}`;
         prevQuestionBtn.disabled = index === 0;
-        nextQuestionBtn.disabled = index === activeQuizBank.length - 1;
+        nextQuestionBtn.disabled = index >= quizTotal - 1;
         submitAnswerBtn.disabled = false; // Enable submit for the new question
         quizArea.style.display = 'block'; // Make sure quiz area is visible
     }
@@ -179,11 +217,10 @@ document.addEventListener('DOMContentLoaded', () => {
         }
         logMessage(`Fetching context files for topic: ${topic}`);
         try {
-            const response = await fetch(`/get_context_files?topic=${encodeURIComponent(topic)}`);
-            if (!response.ok) {
-                throw new Error(`HTTP error! status: ${response.status}`);
+            const { ok, status, data } = await fetchJsonCached(`/get_context_files?topic=${encodeURIComponent(topic)}`);
+            if (!ok) {
+                throw new Error(`HTTP error! status: ${status}`);
             }
-            const data = await response.json();
 
             if (data.error) {
                 logMessage(`Error fetching context files: ${data.error}`, true);
@@ -209,11 +246,23 @@ document.addEventListener('DOMContentLoaded', () => {
                     label.htmlFor = checkboxId;
                     label.textContent = ` ${filename}`;
 
+                    const ingestNote = document.createElement('small');
+                    ingestNote.classList.add('ms-2', 'ingest-note');
+                    ingestNote.dataset.file = filename;
+
+                    const coverageNote = document.createElement('small');
+                    coverageNote.classList.add('text-muted', 'ms-2', 'coverage-note');
+                    coverageNote.dataset.file = filename;
+
                     formCheckDiv.appendChild(checkbox);
                     formCheckDiv.appendChild(label);
+                    formCheckDiv.appendChild(ingestNote);
+                    formCheckDiv.appendChild(coverageNote);
                     contextFileSelector.appendChild(formCheckDiv);
                 });
                  logMessage(`Found ${data.files.length} context files for ${topic}.`);
+                 showIngestStatus(topic, data.status || {});
+                 showCoverage(topic); // Not awaited: the first call may need to extract every PDF
             } else {
                 contextFileSelector.innerHTML = '<p>No PDF files found in the context folder for this topic.</p>';
                  logMessage(`No context files found for ${topic}.`);
@@ -223,30 +272,184 @@ document.addEventListener('DOMContentLoaded', () => {
             contextFileSelector.innerHTML = '<p style="color: red;">Error loading available files. See log.</p>';
         }
     }
-    function shuffleArray(array) {
-        for (let i = array.length - 1; i > 0; i--) {
-            const j = Math.floor(Math.random() * (i + 1));
-            [array[i], array[j]] = [array[j], array[i]]; // Swap elements
+    // Marks context files the server has not finished pre-processing, re-checking until all are ready.
+    let ingestPollTimer = null;
+    function showIngestStatus(topic, statusByFile) {
+        let pending = 0;
+        contextFileSelector.querySelectorAll('.ingest-note').forEach(note => {
+            const status = statusByFile[note.dataset.file] || 'ready';
+            note.textContent = status === 'pending' ? '(processing...)' : status === 'error' ? '(could not be read)' : '';
+            note.className = `ms-2 ingest-note ${status === 'error' ? 'text-danger' : 'text-warning'}`;
+            if (status === 'pending') pending++;
+        });
+        clearTimeout(ingestPollTimer);
+        if (pending > 0) {
+            ingestPollTimer = setTimeout(async () => {
+                if (topic !== topicSelect.value) return;
+                try {
+                    const { ok, data } = await fetchJsonCached(`/get_context_files?topic=${encodeURIComponent(topic)}`);
+                    if (ok && topic === topicSelect.value) showIngestStatus(topic, data.status || {});
+                } catch (error) {
+                    logMessage(`Failed to refresh file status: ${error}`, true);
+                }
+            }, 5000);
         }
     }
 
-    function populatePdfFilters() {
-        const filterTitleHTML = '<h5 class="h6">Filter Questions by Source PDF:</h5>';
-        quizPdfFilterContainer.innerHTML = filterTitleHTML; // Reset but keep title
+    // Uploads PDFs to /upload_context, logging upload progress. fetch() cannot report upload progress, so this uses XHR.
+    function uploadContextFiles(topic, files) {
+        const formData = new FormData();
+        Array.from(files).forEach(file => formData.append('files', file, file.name));
+        return new Promise((resolve, reject) => {
+            const xhr = new XMLHttpRequest();
+            let lastLogged = -1;
+            xhr.upload.onprogress = event => {
+                if (!event.lengthComputable) return;
+                const percent = Math.floor(event.loaded / event.total * 100);
+                if (percent >= lastLogged + 10 || percent === 100) { // Log every 10%, not every chunk
+                    lastLogged = percent;
+                    logMessage(`Uploading: ${percent}% (${(event.loaded / 1048576).toFixed(1)} of ${(event.total / 1048576).toFixed(1)} MB)`);
+                }
+            };
+            xhr.onload = () => {
+                let result;
+                try {
+                    result = JSON.parse(xhr.responseText);
+                } catch (error) {
+                    result = { message: `HTTP error ${xhr.status}` };
+                }
+                resolve({ ok: xhr.status >= 200 && xhr.status < 300, status: xhr.status, result: result });
+            };
+            xhr.onerror = () => reject(new Error('Network error during upload'));
+            xhr.open('POST', `/upload_context?topic=${encodeURIComponent(topic)}`);
+            xhr.send(formData);
+        });
+    }
+
+    // Annotates each context file with its question coverage from /coverage.
+    async function showCoverage(topic) {
+        try {
+            const { ok, status, data } = await fetchJsonCached(`/coverage?topic=${encodeURIComponent(topic)}`);
+            if (!ok) throw new Error(data.error || `HTTP error! status: ${status}`);
+            if (topic !== topicSelect.value) return; // Another topic was selected meanwhile
+            const byFile = new Map(data.files.map(entry => [entry.file, entry]));
+            contextFileSelector.querySelectorAll('.coverage-note').forEach(note => {
+                const entry = byFile.get(note.dataset.file);
+                note.textContent = entry
+                    ? `${entry.questions} questions, ${Math.round(entry.coverage * 100)}% covered (${entry.status})`
+                    : '';
+            });
+            logMessage(`Coverage for ${topic}: ${data.deficit} more question(s) needed to reach ${data.target_per_chunk} per chunk.`);
+        } catch (error) {
+            logMessage(`Failed to fetch coverage: ${error}`, true);
+        }
+    }
 
-        const allSourcePdfs = new Set();
-        currentTopicBank.forEach(q => {
-            if (q.source_pdfs && Array.isArray(q.source_pdfs)) {
-                q.source_pdfs.forEach(pdf => allSourcePdfs.add(pdf));
+    // Polls /jobs/<id> until the background job finishes. Returns { response-like status, result payload }.
+    async function waitForJob(jobId, label) {
+        let lastStage = null;
+        let delay = 1000;
+        while (true) {
+            await new Promise(resolve => setTimeout(resolve, delay));
+            const response = await fetch(`/jobs/${encodeURIComponent(jobId)}`);
+            const job = await response.json();
+            if (!response.ok) {
+                return { ok: false, status: response.status, result: job };
             }
+            if (job.progress && job.progress.stage !== lastStage) {
+                lastStage = job.progress.stage;
+                logMessage(`${label}: ${job.status} (${lastStage}, ${job.progress.percent}%)`);
+            }
+            if (job.status === 'succeeded' || job.status === 'failed') {
+                return { ok: job.status === 'succeeded', status: job.http_status, result: job.result || {} };
+            }
+            delay = Math.min(delay * 1.5, 3000); // Back off while long Gemini calls run
+        }
+    }
+
+    // Submits a POST that may be queued as a background job (HTTP 202) and waits for its result.
+    async function postJob(url, body, label) {
+        const response = await fetch(url, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(body),
+        });
+        const result = await response.json();
+        if (response.status === 202 && result.job_id) {
+            logMessage(`${label}: queued as job ${result.job_id}.`);
+            return waitForJob(result.job_id, label);
+        }
+        return { ok: response.ok, status: response.status, result: result };
+    }
+
+    // Posts to /generate_stream and reads its Server-Sent Events as they arrive.
+    // Calls onQuestion(question, index) per streamed MCQ; resolves with the final 'done' or 'error' event.
+    async function postStream(url, body, onQuestion) {
+        const response = await fetch(url, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json', 'Accept': 'text/event-stream' },
+            body: JSON.stringify(body),
         });
+        if (!response.ok) {
+            const result = await response.json().catch(() => ({}));
+            return { ok: false, status: response.status, result: result };
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let final = { ok: false, status: response.status, result: { message: 'Stream ended unexpectedly.' } };
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                let eventName = 'message';
+                let data = '';
+                rawEvent.split('\n').forEach(line => {
+                    if (line.startsWith('event: ')) eventName = line.slice(7);
+                    else if (line.startsWith('data: ')) data += line.slice(6);
+                });
+                const payload = data ? JSON.parse(data) : {};
+                if (eventName === 'status') {
+                    logMessage(`Generation: ${payload.stage}`);
+                } else if (eventName === 'question') {
+                    onQuestion(payload.question, payload.index);
+                } else if (eventName === 'done') {
+                    final = { ok: true, status: response.status, result: { status: 'success', ...payload } };
+                } else if (eventName === 'error') {
+                    final = { ok: false, status: response.status, result: payload };
+                }
+            }
+        }
+        return final;
+    }
+
+    // Fetches one page of the topic's bank (see /get_bank): { questions, total, next_cursor }.
+    async function fetchBankPage(topic, { cursor = null, limit, seed = null, sources = [], fields }) {
+        const query = new URLSearchParams({ topic: topic, limit: limit, fields: fields });
+        if (cursor) query.set('cursor', cursor);
+        if (seed) query.set('seed', seed);
+        sources.forEach(pdf => query.append('sources', pdf));
+        const { ok, status, data: page } = await fetchJsonCached(`/get_bank?${query}`);
+        if (!ok || page.error) throw new Error(page.error || `HTTP error! status: ${status}`);
+        return page;
+    }
+
+    function populatePdfFilters(sourceCounts) {
+        const filterTitleHTML = '<h5 class="h6">Filter Questions by Source PDF:</h5>';
+        quizPdfFilterContainer.innerHTML = filterTitleHTML; // Reset but keep title
 
-        if (allSourcePdfs.size === 0) {
+        const pdfNames = Object.keys(sourceCounts);
+        if (pdfNames.length === 0) {
             quizPdfFilterContainer.style.display = 'none';
             return;
         }
 
-        Array.from(allSourcePdfs).sort().forEach(pdfName => {
+        pdfNames.sort().forEach(pdfName => {
             const checkboxId = `pdf-filter-${pdfName.replace(/[^a-zA-Z0-9_.-]/g, '-')}`;
             const formCheckDiv = document.createElement('div');
             // Use form-check-inline for horizontal layout if preferred, or just form-check for vertical
@@ -258,12 +461,12 @@ document.addEventListener('DOMContentLoaded', () => {
             checkbox.id = checkboxId;
             checkbox.value = pdfName;
             checkbox.name = 'quizPdfFilter';
-            checkbox.addEventListener('change', updateFilteredQuizAndDisplay);
+            checkbox.addEventListener('change', startQuiz);
 
             const label = document.createElement('label');
             label.classList.add('form-check-label');
             label.htmlFor = checkboxId;
-            label.textContent = pdfName;
+            label.textContent = `${pdfName} (${sourceCounts[pdfName]})`;
 
             formCheckDiv.appendChild(checkbox);
             formCheckDiv.appendChild(label);
@@ -276,27 +479,33 @@ document.addEventListener('DOMContentLoaded', () => {
         quizPdfFilterContainer.style.display = 'block';
     }
 
-    function getFilteredQuizBank() {
-        const selectedFilterPDFs = Array.from(quizPdfFilterContainer.querySelectorAll('input[name="quizPdfFilter"]:checked'))
-                                      .map(cb => cb.value);
-
-        if (selectedFilterPDFs.length === 0) {
-            return [...currentTopicBank]; // Return a copy of all questions if no filter
-        }
-
-        return currentTopicBank.filter(q => {
-            if (!q.source_pdfs || q.source_pdfs.length === 0) {
-                // If question has no source_pdfs, it won't match any filter if filters are selected.
-                // If no filters are selected, it would have been included by the above condition.
-                return false;
-            }
-            return q.source_pdfs.some(sourcePdf => selectedFilterPDFs.includes(sourcePdf));
+    // Loads the next page of the quiz (random order fixed by quizSeed, filtered on the server).
+    async function loadQuizPage() {
+        const loadId = quizLoadId;
+        const page = await fetchBankPage(currentTopic, {
+            cursor: quizCursor, limit: QUIZ_PAGE_SIZE, seed: quizSeed, sources: quizSources, fields: QUESTION_FIELDS,
         });
+        if (loadId !== quizLoadId) return false; // The topic or filter changed meanwhile
+        activeQuizBank.push(...page.questions);
+        quizTotal = page.total;
+        quizCursor = page.next_cursor;
+        return true;
     }
 
-    function updateFilteredQuizAndDisplay() {
-        activeQuizBank = getFilteredQuizBank();
+    // (Re)starts the quiz for the selected PDF filters, fetching only its first page.
+    async function startQuiz() {
+        quizLoadId++;
+        quizSources = Array.from(quizPdfFilterContainer.querySelectorAll('input[name="quizPdfFilter"]:checked'))
+                           .map(cb => cb.value);
+        activeQuizBank = [];
+        quizCursor = null;
+        quizTotal = 0;
         currentQuestionIndex = 0; // Reset index
+        try {
+            if (!await loadQuizPage()) return;
+        } catch (error) {
+            logMessage(`Failed to load quiz questions: ${error}`, true);
+        }
         if (activeQuizBank.length > 0) {
             displayQuestion(currentQuestionIndex); // displayQuestion will use activeQuizBank
             quizArea.style.display = 'block';
@@ -312,9 +521,42 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
-    // --- MODIFIED fetchQuestionBank ---
+    function appendBankDisplay(questions) {
+        let displayStr = '';
+        questions.forEach(q => {
+            displayStr += `${q.id + 1}. Question: ${q.question || 'N/A'}\n`;
+            if (q.options && typeof q.options === 'object') {
+                for (const [key, value] of Object.entries(q.options)) {
+                    displayStr += `  ${key}) ${value}\n`;
+                }
+            }
+            displayStr += `   Correct Answer: ${q.correct_answer || 'N/A'}\n--------------------\n`;
+        });
+        questionBankDisplay.textContent += displayStr;
+    }
+
+    async function loadMoreBank() {
+        if (!bankCursor) return;
+        loadMoreBankBtn.disabled = true;
+        try {
+            const page = await fetchBankPage(currentTopic, { cursor: bankCursor, limit: BANK_PAGE_SIZE, fields: QUESTION_FIELDS });
+            appendBankDisplay(page.questions);
+            bankCursor = page.next_cursor;
+        } catch (error) {
+            logMessage(`Failed to load more questions: ${error}`, true);
+        } finally {
+            loadMoreBankBtn.disabled = false;
+            loadMoreBankBtn.style.display = bankCursor ? 'inline-block' : 'none';
+        }
+    }
+
+    // Loads the first page of the bank display, the quiz's source filter and the quiz's first page.
     async function fetchQuestionBank(topic) {
-        currentTopicBank = []; // Clear previous bank
+        currentTopic = topic;
+        topicQuestionCount = 0;
+        bankCursor = null;
+        quizLoadId++;
+        loadMoreBankBtn.style.display = 'none';
         quizArea.style.display = 'none';
         questionBankDisplay.textContent = 'Loading bank...';
 
@@ -324,39 +566,29 @@ document.addEventListener('DOMContentLoaded', () => {
         }
         logMessage(`Fetching question bank for topic: ${topic}`);
         try {
-            const response = await fetch(`/get_bank?topic=${encodeURIComponent(topic)}`);
-            if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
-            let bank = await response.json(); // Use 'let' as we modify it
-
-            // Display raw bank in the text area (BEFORE shuffling)
-            if (bank.error) {
-                 logMessage(`Error fetching bank: ${bank.error}`, true);
-                 questionBankDisplay.textContent = `Error: ${bank.error}`;
-            } else if (bank.length === 0) {
+            const [sourcesResponse, page] = await Promise.all([
+                fetchJsonCached(`/get_bank_sources?topic=${encodeURIComponent(topic)}`),
+                fetchBankPage(topic, { limit: BANK_PAGE_SIZE, fields: QUESTION_FIELDS }),
+            ]);
+            const sources = sourcesResponse.data;
+            if (!sourcesResponse.ok || sources.error) throw new Error(sources.error || `HTTP error! status: ${sourcesResponse.status}`);
+            if (topic !== currentTopic) return; // Another topic was selected meanwhile
+
+            if (page.total === 0) {
                 questionBankDisplay.textContent = `Question bank for '${topic}' is empty.`;
             } else {
-                // Display the raw, ordered bank first
-                let displayStr = `--- Question Bank for: ${topic} (${bank.length} questions) ---\n\n`;
-                bank.forEach((q, i) => {
-                    displayStr += `${i + 1}. Question: ${q.question || 'N/A'}\n`;
-                    if (q.options && typeof q.options === 'object') {
-                        for (const [key, value] of Object.entries(q.options)) {
-                            displayStr += `  ${key}) ${value}\n`;
-                        }
-                    }
-                    displayStr += `   Correct Answer: ${q.correct_answer || 'N/A'}\n--------------------\n`;
-                });
-                questionBankDisplay.textContent = displayStr;
-
-                // --- SHUFFLE the bank for the quiz ---
-                shuffleArray(bank);
-                logMessage(`Shuffled ${bank.length} questions for quiz mode.`);
-                // --- End Shuffle ---
-
-                // Prepare for Quiz Mode with the shuffled bank
-                currentTopicBank = bank; // Store the SHUFFLED bank
-                populatePdfFilters(); // Populate filters based on the full bank
-                updateFilteredQuizAndDisplay(); // Initial display based on filters (or no filters)
+                // Display the bank in insertion order, one page at a time
+                questionBankDisplay.textContent = `--- Question Bank for: ${topic} (${page.total} questions) ---\n\n`;
+                appendBankDisplay(page.questions);
+                bankCursor = page.next_cursor;
+                loadMoreBankBtn.style.display = bankCursor ? 'inline-block' : 'none';
+
+                // Quiz Mode: the server shuffles with this seed, so pages stay consistent as we fetch more
+                topicQuestionCount = page.total;
+                quizSeed = Math.random().toString(36).slice(2);
+                populatePdfFilters(sources.sources || {});
+                await startQuiz();
+                logMessage(`Loaded ${activeQuizBank.length} of ${quizTotal} questions (shuffled) for quiz mode.`);
             }
              logMessage(`Successfully loaded and processed bank for ${topic}.`);
         } catch (error) {
@@ -382,10 +614,58 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
-    nextQuestionBtn.addEventListener('click', () => {
-        if (activeQuizBank.length > 0 && currentQuestionIndex < activeQuizBank.length - 1) {
-            currentQuestionIndex++;
-            displayQuestion(currentQuestionIndex);
+    nextQuestionBtn.addEventListener('click', async () => {
+        if (activeQuizBank.length > 0 && currentQuestionIndex < quizTotal - 1) {
+            if (currentQuestionIndex + 1 >= activeQuizBank.length && quizCursor) {
+                nextQuestionBtn.disabled = true;
+                try {
+                    if (!await loadQuizPage()) return;
+                } catch (error) {
+                    logMessage(`Failed to load more quiz questions: ${error}`, true);
+                    nextQuestionBtn.disabled = false;
+                    return;
+                }
+            }
+            if (currentQuestionIndex + 1 < activeQuizBank.length) {
+                currentQuestionIndex++;
+                displayQuestion(currentQuestionIndex);
+            }
+        }
+    });
+
+    loadMoreBankBtn.addEventListener('click', loadMoreBank);
+
+    contextUploadBtn.addEventListener('click', async () => {
+        const topic = topicSelect.value;
+        if (!topic) {
+            logMessage('Please select a topic first.', true);
+            Swal.fire({ icon: 'error', title: 'Validation Error', text: 'Please select a topic first.' });
+            return;
+        }
+        if (contextUploadInput.files.length === 0) {
+            logMessage('Please choose at least one PDF to upload.', true);
+            return;
+        }
+        contextUploadBtn.disabled = true;
+        try {
+            const { ok, status, result } = await uploadContextFiles(topic, contextUploadInput.files);
+            (result.errors || []).forEach(err => logMessage(`Rejected ${err.file}: ${err.error}`, true));
+            if (!ok) {
+                throw new Error(result.message || `HTTP error ${status}`);
+            }
+            result.files.forEach(file => logMessage(`Uploaded ${file.file} (${(file.size / 1048576).toFixed(1)} MB${file.deduplicated ? ', already stored' : ''}${file.unchanged ? ', unchanged' : ''}).`));
+            contextUploadInput.value = '';
+            await fetchAndDisplayContextFiles(topic); // New files show as processing until ingested
+            if (result.job_id) {
+                const job = await waitForJob(result.job_id, 'Processing uploads');
+                if (topic === topicSelect.value) fetchAndDisplayContextFiles(topic);
+                if (!job.ok) logMessage(`Processing uploads failed: ${job.result.message || job.status}`, true);
+            }
+        } catch (error) {
+            logMessage(`Upload failed: ${error.message || error}`, true);
+            Swal.fire({ icon: 'error', title: 'Upload Failed', text: `${error.message || error}` });
+        } finally {
+            contextUploadBtn.disabled = false;
         }
     });
 
@@ -428,34 +708,42 @@ document.addEventListener('DOMContentLoaded', () => {
             return;
         }
 
-        logMessage(`Starting generation for topic '${topic}', count: ${numQuestions} from files: ${selectedFiles.join(', ')}...`);
+        logMessage(`Starting generation for topic '${topic}', count: ${numQuestions} from files: ${selectedFiles.join(', ')} (context: ${contextModeSelect.value})...`);
         setLoading(true);
 
         try {
-            // Send JSON data, including the list of selected filenames
-            const response = await fetch('/generate', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json', // Set content type to JSON
-                },
-                body: JSON.stringify({ // Send data as a JSON string
-                    topic: topic,
-                    num_questions: numQuestions,
-                    selected_files: selectedFiles // Send the array of filenames
-                 }),
-            });
-
-            const result = await response.json(); // Expect JSON response
-
-            if (response.ok && result.status === 'success') {
+            const requestBody = {
+                topic: topic,
+                num_questions: numQuestions,
+                selected_files: selectedFiles, // Send the array of filenames
+                context_mode: contextModeSelect.value, // 'full' or 'retrieval'
+                fresh: freshResultsCheckbox.checked // Bypass the server's Gemini response cache
+            };
+            // Streamed: questions are shown (and saved) one by one as Gemini writes them.
+            // Otherwise the server queues the request as a job and we poll for the result.
+            const { ok, status, result } = streamResultsCheckbox.checked
+                ? await postStream('/generate_stream', requestBody, (question, index) => {
+                    logMessage(`New question ${index}: ${question.question}`);
+                    questionBankDisplay.textContent += `\n[new] ${question.question}`;
+                })
+                : await postJob('/generate', requestBody, 'Generation');
+
+            if (ok && result.status === 'success') {
                 logMessage(`Generation successful: ${result.message}`);
+                if (result.ttfq_ms != null) {
+                    logMessage(`First question after ${(result.ttfq_ms / 1000).toFixed(1)}s, all done after ${(result.total_ms / 1000).toFixed(1)}s.`);
+                }
+                if (result.history) {
+                    logMessage(`Prompt history: ~${result.history.estimated_tokens}/${result.history.token_budget} tokens (${result.history.strategy}: ${result.history.full_examples} full, ${result.history.digest_questions} stems, ${result.history.omitted_questions} omitted).`);
+                }
                 Swal.fire({
                     icon: 'success', title: 'Success!', text: result.message || 'MCQs generated successfully!',
                 });
                 // Refresh the bank display and quiz (which might now include new questions)
                 fetchQuestionBank(topic);
+                showCoverage(topic);
             } else {
-                 const errorMsg = result.message || `HTTP error ${response.status}`;
+                 const errorMsg = result.message || `HTTP error ${status}`;
                  logMessage(`Generation failed: ${errorMsg}`, true);
                  Swal.fire({
                     icon: 'error', title: 'Generation Failed', text: errorMsg,
@@ -486,20 +774,15 @@ document.addEventListener('DOMContentLoaded', () => {
         logMessage(`Starting example formatting for topic '${topic}'...`);
         setLoading(true);
         try {
-            const response = await fetch('/format_examples', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ topic: topic }),
-            });
-            const result = await response.json();
-             if (response.ok && result.status === 'success') {
+            const { ok, status, result } = await postJob('/format_examples', { topic: topic, fresh: freshResultsCheckbox.checked }, 'Formatting');
+             if (ok && result.status === 'success') {
                 logMessage(`Formatting successful: ${result.message}`);
                 Swal.fire({
                     icon: 'success', title: 'Success!', text: result.message || 'Examples formatted successfully!',
                 });
                 fetchQuestionBank(topic); // Refresh bank and quiz
             } else {
-                 const errorMsg = result.message || `HTTP error ${response.status}`;
+                 const errorMsg = result.message || `HTTP error ${status}`;
                  logMessage(`Formatting failed: ${errorMsg}`, true);
                   Swal.fire({
                     icon: 'error', title: 'Formatting Failed', text: errorMsg,
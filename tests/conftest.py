@@ -0,0 +1,87 @@
+# tests/conftest.py
+import shutil
+import sys
+from pathlib import Path
+import pytest
+
+# The app's modules live at the repository root
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+import config
+import data_manager as dm
+import gemini_handler as gh
+
+# Small lecture decks from the sample topic, for tests that need real PDF text
+SAMPLE_PDFS = [REPO_ROOT / "topics" / "cloud" / "context" / name
+               for name in ("L13_revision_and_exam_info.pdf", "L9_CodePipeline_da (1).pdf")]
+SAMPLE_PDF = SAMPLE_PDFS[0]
+
+def make_question(text: str, answer: str = "one") -> dict:
+    """A well-formed MCQ whose correct answer (A) is answer."""
+    return {"question": text, "options": {"A": answer, "B": "a queue", "C": "a cron job", "D": "a volume"},
+            "correct_answer": "A"}
+
+SEED_QUESTION = make_question("Which scheduler places pods onto nodes?", "the scheduler")
+
+@pytest.fixture
+def topics_dir(tmp_path, monkeypatch) -> Path:
+    """An empty topics folder in place of config.TOPICS_BASE_DIR."""
+    monkeypatch.setattr(config, "TOPICS_BASE_DIR", str(tmp_path))
+    return tmp_path
+
+@pytest.fixture
+def bank_cache_enabled() -> bool:
+    """Overridden (e.g. parametrised) by test modules that also run without the bank cache."""
+    return True
+
+@pytest.fixture(params=["json", "sqlite"])
+def topic(request, topics_dir, bank_cache_enabled, monkeypatch):
+    """A topic holding SEED_QUESTION, once per bank store, with near-duplicate checks off."""
+    monkeypatch.setattr(config, "QUESTION_BANK_BACKEND", request.param)
+    monkeypatch.setattr(config, "BANK_CACHE_ENABLED", bank_cache_enabled)
+    monkeypatch.setattr(config, "NEAR_DUPLICATE_ACTION", "off")
+    dm.create_topic("topic")
+    dm.add_questions_to_bank("topic", [SEED_QUESTION])
+    yield "topic"
+    dm.invalidate_topic_caches("topic")
+
+@pytest.fixture
+def other_worker_adds(topic, monkeypatch):
+    """
+    Returns add(questions): makes the store's next add_stamped call first write questions the way
+    another worker would, after our caller read the bank but before our write takes the lock.
+    """
+    store_class = type(dm.get_bank_store())
+    add_stamped = store_class.add_stamped
+
+    def add(questions: list[dict]):
+        def add_after_other_worker(self, topic_path, ours):
+            monkeypatch.setattr(store_class, "add_stamped", add_stamped)
+            add_stamped(self, topic_path, questions)
+            return add_stamped(self, topic_path, ours)
+
+        monkeypatch.setattr(store_class, "add_stamped", add_after_other_worker)
+    return add
+
+@pytest.fixture
+def client(topics_dir, monkeypatch):
+    """A test client for the app, on the fake Gemini backend."""
+    monkeypatch.setattr(config, "GEMINI_BACKEND", "fake")
+    monkeypatch.setattr(config, "FAKE_GEMINI_LATENCY_SECONDS", 0)
+    monkeypatch.setattr(config, "FAKE_GEMINI_SECONDS_PER_1K_TOKENS", 0)
+    monkeypatch.setattr(config, "FAKE_GEMINI_ERROR_RATE", 0)
+    monkeypatch.setattr(config, "FAKE_GEMINI_MALFORMED_RATE", 0)
+    monkeypatch.setattr(config, "GEMINI_CACHE_ENABLED", False)
+    import app
+    assert gh.configure_gemini()
+    return app.app.test_client()
+
+@pytest.fixture
+def pdf_topic(topics_dir) -> str:
+    """A topic whose context folder holds the SAMPLE_PDFS."""
+    dm.create_topic("lectures")
+    for pdf in SAMPLE_PDFS:
+        shutil.copy2(pdf, dm.get_context_folder("lectures") / pdf.name)
+    yield "lectures"
+    dm.invalidate_topic_caches("lectures")
@@ -0,0 +1,15 @@
+# tests/test_bank_cache.py
+import data_manager as dm
+from conftest import make_question
+
+def test_add_writes_through_to_the_cache(topic):
+    dm.load_question_bank(topic)
+    dm.add_questions_to_bank(topic, [make_question("What does a service load balance?")])
+    assert len(dm.load_question_bank(topic)) == 2
+
+def test_write_by_another_worker_before_add_is_not_hidden(topic, other_worker_adds):
+    dm.load_question_bank(topic) # Cached at the current stamp
+    other_worker_adds([make_question("Which controller keeps replicas running?")])
+    dm.add_questions_to_bank(topic, [make_question("What does a service load balance?")])
+    store = dm.get_bank_store()
+    assert len(dm.load_question_bank(topic)) == len(store.load(dm.get_topic_path(topic))) == 3
@@ -0,0 +1,60 @@
+# tests/test_bulk_generate.py
+import json
+import shutil
+import sys
+import pytest
+import config
+import bulk_generate
+import data_manager as dm
+from conftest import SAMPLE_PDFS
+
+@pytest.fixture
+def topics(client) -> list[str]:
+    """Three topics holding a sample deck each (the client fixture puts Gemini on the fake backend)."""
+    names = ["alpha", "beta", "gamma"]
+    for name, pdf in zip(names, SAMPLE_PDFS * 2):
+        dm.create_topic(name)
+        shutil.copy2(pdf, dm.get_context_folder(name) / pdf.name)
+    yield names
+    for name in names:
+        dm.invalidate_topic_caches(name)
+
+@pytest.fixture
+def bulk(tmp_path, monkeypatch):
+    """Returns bulk(*args): runs bulk_generate.py's main with args and returns its --report summary."""
+    checkpoint, report = tmp_path / "checkpoint.json", tmp_path / "report.json"
+    def bulk(*args) -> dict:
+        monkeypatch.setattr(sys, "argv", ["bulk_generate.py", *args, "-n", "3", "--checkpoint", str(checkpoint),
+                                          "--report", str(report)])
+        bulk_generate.main()
+        return json.loads(report.read_text())
+    bulk.checkpoint = checkpoint
+    return bulk
+
+def test_resume_keeps_progress_when_topics_are_added(topics, bulk):
+    first = bulk(topics[0])
+    assert first["topics"]["done"] == 1
+    resumed = bulk(*topics, "--resume")
+    assert resumed["topics"]["resumed"] == 1
+    assert sorted(resumed["results"]) == topics[1:]
+    saved = json.loads(bulk.checkpoint.read_text())
+    assert "topics" not in saved["settings"] and sorted(saved["topics"]) == topics
+
+def test_resume_with_other_options_starts_over(topics, bulk):
+    bulk(topics[0])
+    rerun = bulk(topics[0], "--resume", "--context-mode", "retrieval")
+    assert rerun["topics"]["resumed"] == 0 and rerun["topics"]["done"] == 1
+
+def test_max_tokens_is_not_overshot_by_concurrent_topics(topics, bulk):
+    one_topic = bulk(topics[0], "--fresh")["tokens"]["total"]
+    bulk.checkpoint.unlink()
+    summary = bulk(*topics, "--fresh", "--workers", "3", "--max-tokens", str(int(one_topic * 1.5)))
+    assert summary["budget_exhausted"] and summary["topics"]["skipped"]
+    assert summary["tokens"]["total"] <= one_topic * 1.5
+
+def test_token_budget_reservations():
+    budget = bulk_generate.TokenBudget(100, bulk_generate.gh.get_client_stats())
+    assert budget.reserve(60)
+    assert not budget.reserve(60) and budget.exhausted.is_set()
+    budget.release(60)
+    assert budget.reserve(60)
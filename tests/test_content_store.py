@@ -0,0 +1,64 @@
+# tests/test_content_store.py
+import os
+import time
+import pytest
+import config
+import content_store
+import data_manager as dm
+import ingest
+from conftest import SAMPLE_PDFS
+
+@pytest.fixture
+def upload(client):
+    """Returns upload(topic, pdf, name): posts pdf to /upload_context as name and waits for its ingest job."""
+    import app
+    def upload(topic: str, pdf, name: str) -> dict:
+        with open(pdf, 'rb') as f:
+            r = client.post(f'/upload_context?topic={topic}', data={"files": (f, name)}, content_type='multipart/form-data')
+        assert r.status_code == 200, r.json
+        if r.json["job_id"]:
+            assert app.jobs.get(r.json["job_id"]).wait(60)
+        return r.json["files"][0]
+    for topic in ("week1", "week2"):
+        dm.create_topic(topic)
+    return upload
+
+def _stored_files() -> list:
+    return sorted(content_store.get_store_dir().glob("??/*.pdf"))
+
+def test_same_content_in_two_topics_is_stored_once(upload):
+    first = upload("week1", SAMPLE_PDFS[0], "lecture.pdf")
+    second = upload("week2", SAMPLE_PDFS[0], "revision.pdf")
+    assert (first["deduplicated"], second["deduplicated"]) == (False, True)
+    [stored] = _stored_files()
+    assert stored.stat().st_nlink == 3
+    assert os.path.samefile(stored, dm.get_context_folder("week1") / "lecture.pdf")
+    assert os.path.samefile(stored, dm.get_context_folder("week2") / "revision.pdf")
+    assert upload("week1", SAMPLE_PDFS[0], "lecture.pdf")["unchanged"]
+
+def test_replacing_the_last_link_collects_the_old_content(upload):
+    upload("week1", SAMPLE_PDFS[0], "lecture.pdf")
+    upload("week2", SAMPLE_PDFS[0], "lecture.pdf")
+    [old] = _stored_files()
+
+    assert upload("week1", SAMPLE_PDFS[1], "lecture.pdf")["replaced"]
+    assert old.exists() # week2 still links to it
+    upload("week2", SAMPLE_PDFS[1], "lecture.pdf")
+    assert not old.exists()
+    [new] = _stored_files()
+    assert new.stat().st_nlink == 3
+
+def test_ingest_collects_content_of_deleted_pdfs(upload):
+    upload("week1", SAMPLE_PDFS[0], "lecture.pdf")
+    (dm.get_context_folder("week1") / "lecture.pdf").unlink()
+    assert ingest.ingest_topic("week1", blocking=True, settle_seconds=0)["removed"] == 1
+    assert _stored_files() == []
+
+def test_collect_garbage_removes_only_stale_upload_leftovers(topics_dir):
+    stale, fresh = content_store.HashingUpload(), content_store.HashingUpload()
+    for leftover in (stale, fresh):
+        leftover.close()
+    old = time.time() - config.CONTENT_STORE_TMP_MAX_AGE_SECONDS - 60
+    os.utime(stale.path, (old, old))
+    assert content_store.collect_garbage()["removed"] == 1
+    assert fresh.path.exists() and not stale.path.exists()
@@ -0,0 +1,40 @@
+# tests/test_context_cache.py
+import pytest
+import config
+import context_cache
+import fake_gemini
+import gemini_handler as gh
+
+CONTEXT = " ".join(f"container orchestration kubernetes pod{i} scheduling" for i in range(4000))
+
+@pytest.fixture(autouse=True)
+def fake_backend(monkeypatch):
+    monkeypatch.setattr(config, "GEMINI_BACKEND", "fake")
+    monkeypatch.setattr(config, "FAKE_GEMINI_LATENCY_SECONDS", 0)
+    monkeypatch.setattr(config, "FAKE_GEMINI_ERROR_RATE", 0)
+    monkeypatch.setattr(config, "GEMINI_CACHE_ENABLED", False)
+    monkeypatch.setattr(config, "CONTEXT_CACHE_ENABLED", True)
+    assert gh.configure_gemini()
+    yield
+    context_cache.clear()
+
+def test_reuses_the_cache_across_generations():
+    before = context_cache.get_stats()
+    assert gh.generate_new_mcqs(CONTEXT, "", 2)
+    assert gh.generate_new_mcqs(CONTEXT, "history changed", 2)
+    after = context_cache.get_stats()
+    assert after["created"] - before["created"] == 1
+    assert after["hits"] - before["hits"] == 2
+
+def test_falls_back_inline_when_the_provider_dropped_the_cache():
+    assert gh.generate_new_mcqs(CONTEXT, "", 2)
+    entry = context_cache.get(gh._context_section(CONTEXT))
+    fake_gemini.delete_cached_content(entry.name)
+    invalidated = context_cache.get_stats()["invalidated"]
+    assert gh.generate_new_mcqs(CONTEXT, "after drop", 2)
+    assert context_cache.get_stats()["invalidated"] == invalidated + 1
+
+def test_small_contexts_and_disabled_caching_are_sent_inline(monkeypatch):
+    assert context_cache.get("short context") is None
+    monkeypatch.setattr(config, "CONTEXT_CACHE_ENABLED", False)
+    assert context_cache.get(gh._context_section(CONTEXT)) is None
@@ -0,0 +1,46 @@
+# tests/test_dedupe.py
+import sys
+import threading
+import pytest
+import config
+import data_manager as dm
+from conftest import make_question
+
+OTHER = make_question("Which controller keeps the desired number of pod replicas running?", "a replica set")
+OTHER_REWORDED = make_question("Which controller keeps the desired number of pod replicas running at all times?",
+                              "a replica set")
+
+@pytest.fixture(autouse=True)
+def reject_near_duplicates(topic, monkeypatch):
+    monkeypatch.setattr(config, "NEAR_DUPLICATE_ACTION", "reject")
+
+def test_rejects_near_duplicates(topic):
+    assert dm.add_questions_to_bank(topic, [OTHER]) == 1
+    assert dm.add_questions_to_bank(topic, [OTHER_REWORDED]) == 0
+
+def test_index_sees_questions_written_by_another_worker_during_add(topic, other_worker_adds):
+    other_worker_adds([OTHER])
+    dm.add_questions_to_bank(topic, [make_question("What does a service load balance across?", "pods")])
+    assert dm.add_questions_to_bank(topic, [OTHER_REWORDED]) == 0
+
+def test_batch_dedupe_keeps_questions_added_while_it_runs(topic, monkeypatch):
+    monkeypatch.setattr(config, "NEAR_DUPLICATE_ACTION", "off")
+    dm.add_questions_to_bank(topic, [OTHER, OTHER_REWORDED])
+    added_meanwhile = make_question("What does a service load balance across?", "pods")
+    dedupe_questions = dm.dedupe.dedupe_questions
+
+    def dedupe_while_another_worker_adds(bank):
+        worker = threading.Thread(target=dm.add_questions_to_bank, args=(topic, [added_meanwhile]))
+        worker.start()
+        worker.join(timeout=0.2) # Blocks on the store's lock until the rewrite is saved
+        threads.append(worker)
+        return dedupe_questions(bank)
+
+    threads = []
+    monkeypatch.setattr(dm.dedupe, "dedupe_questions", dedupe_while_another_worker_adds)
+    monkeypatch.setattr(sys, "argv", ["dedupe.py", topic])
+    dm.dedupe.main()
+    threads[0].join()
+    questions = [q["question"] for q in dm.load_question_bank(topic)]
+    assert OTHER_REWORDED["question"] not in questions
+    assert OTHER["question"] in questions and added_meanwhile["question"] in questions
@@ -0,0 +1,154 @@
+# tests/test_gemini_client.py
+import pytest
+import data_manager as dm
+import gemini_client
+import gemini_handler as gh
+from gemini_client import CircuitBreaker, GeminiClient, GeminiError, GeminiRequestError, GeminiUnavailable, TokenBucket
+
+class FakeClock:
+    """A monotonic clock that only moves when something sleeps on it."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+class ApiError(Exception):
+    def __init__(self, code: int):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+# --- TokenBucket ---
+
+def test_bucket_serves_its_capacity_then_waits_for_the_refill():
+    clock = FakeClock()
+    bucket = TokenBucket(60, clock=clock, sleep=clock.sleep) # One unit per second
+    assert [bucket.acquire() for _ in range(60)] == [0.0] * 60
+    assert bucket.acquire(2) == pytest.approx(2.0)
+    assert clock.sleeps == [pytest.approx(2.0)]
+
+def test_bucket_refuses_waits_past_max_wait_without_sleeping():
+    clock = FakeClock()
+    bucket = TokenBucket(60, clock=clock, sleep=clock.sleep)
+    bucket.acquire(60)
+    with pytest.raises(GeminiUnavailable):
+        bucket.acquire(10, max_wait=5)
+    assert clock.sleeps == []
+
+def test_bucket_charge_can_go_negative_and_delays_the_next_caller():
+    clock = FakeClock()
+    bucket = TokenBucket(60, clock=clock, sleep=clock.sleep)
+    bucket.charge(90) # Output tokens known only after the call
+    assert bucket.acquire(1) == pytest.approx(31.0)
+
+def test_oversized_request_waits_for_a_full_bucket_only():
+    clock = FakeClock()
+    bucket = TokenBucket(60, clock=clock, sleep=clock.sleep)
+    bucket.acquire(30)
+    assert bucket.acquire(500) == pytest.approx(30.0)
+
+# --- CircuitBreaker ---
+
+def test_breaker_opens_after_the_threshold_and_fails_fast():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=3, reset_seconds=30, clock=clock)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(GeminiUnavailable):
+        breaker.before_call()
+
+def test_breaker_lets_one_trial_through_after_the_reset_period():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=30, clock=clock)
+    breaker.record_failure()
+    clock.sleep(30)
+    breaker.before_call() # The trial
+    assert breaker.state == "half_open"
+    with pytest.raises(GeminiUnavailable):
+        breaker.before_call() # A second caller while the trial runs
+    breaker.record_success()
+    assert breaker.state == "closed"
+    breaker.before_call()
+
+def test_failed_trial_reopens_the_breaker():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=5, reset_seconds=30, clock=clock)
+    for _ in range(5):
+        breaker.record_failure()
+    clock.sleep(30)
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    clock.sleep(29)
+    with pytest.raises(GeminiUnavailable):
+        breaker.before_call()
+
+# --- Retries ---
+
+@pytest.fixture
+def gemini(monkeypatch):
+    """A client with limits too high to wait, 3 retries and backoff delays at their maximum."""
+    clock = FakeClock()
+    monkeypatch.setattr(gemini_client.random, "uniform", lambda low, high: high)
+    breaker = CircuitBreaker(failure_threshold=4, reset_seconds=60, clock=clock)
+    gemini = GeminiClient(model=None, requests_per_minute=10**6, tokens_per_minute=10**9, max_retries=3,
+                          backoff_base=1, backoff_max=5, breaker=breaker, sleep=clock.sleep)
+    gemini.clock = clock
+    return gemini
+
+def _call_failing(errors: list[Exception], result: str = "ok"):
+    attempts = []
+    def call():
+        attempts.append(len(attempts))
+        if len(attempts) <= len(errors):
+            raise errors[len(attempts) - 1]
+        return result
+    return call, attempts
+
+def test_retryable_errors_are_retried_with_exponential_backoff(gemini):
+    call, attempts = _call_failing([ApiError(503), TimeoutError("slow"), ApiError(429)])
+    assert gemini.run("prompt", call) == "ok"
+    assert len(attempts) == 4 and gemini.clock.sleeps == [1, 2, 4]
+    assert gemini.stats["retries"] == 3 and gemini.breaker.state == "closed"
+
+def test_exhausted_retries_raise_gemini_error_and_open_the_breaker(gemini):
+    call, attempts = _call_failing([ApiError(500)] * 10)
+    with pytest.raises(GeminiError) as raised:
+        gemini.run("prompt", call)
+    assert not isinstance(raised.value, GeminiRequestError)
+    assert len(attempts) == 4 and gemini.clock.sleeps == [1, 2, 4]
+    assert gemini.breaker.state == "open" and gemini.stats["failures"] == 1
+    with pytest.raises(GeminiUnavailable):
+        gemini.run("prompt", lambda: "never called")
+
+def test_rejected_requests_fail_at_once_without_tripping_the_breaker(gemini):
+    for error in (ApiError(400), ApiError(403), ValueError("response was blocked")):
+        call, attempts = _call_failing([error])
+        with pytest.raises(GeminiRequestError):
+            gemini.run("prompt", call)
+        assert len(attempts) == 1
+    assert gemini.clock.sleeps == [] and gemini.breaker.state == "closed"
+    assert gemini.stats["retries"] == 0 and gemini.stats["failures"] == 3
+
+@pytest.mark.parametrize("error, status", [(GeminiRequestError("Gemini rejected the request: API key not valid"), 500),
+                                           (GeminiError("Gemini call failed after 4 attempt(s): HTTP 503"), 503)])
+def test_app_reports_rejected_requests_as_errors_not_as_unavailable(client, topics_dir, monkeypatch, error, status):
+    dm.create_topic("examples")
+    (dm.get_examples_folder("examples") / "sample.txt").write_text("Q: What is a pod? A: A group of containers.")
+    def format_examples_to_mcq(example_text, bypass_cache=False):
+        raise error
+    monkeypatch.setattr(gh, "format_examples_to_mcq", format_examples_to_mcq)
+    r = client.post('/format_examples', json={"topic": "examples", "wait": True})
+    assert r.status_code == status
+    assert ("try again shortly" in r.json["message"]) == (status == 503)
@@ -0,0 +1,39 @@
+# tests/test_generate_stream.py
+import json
+import threading
+import config
+from conftest import SAMPLE_PDFS
+
+def _events(response) -> list[tuple[str, dict]]:
+    events = []
+    for block in response.get_data(as_text=True).split("\n\n"):
+        if block.startswith("event: "):
+            name, data = block.split("\n", 1)
+            events.append((name[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+def _body(topic: str, num_questions: int = 4) -> dict:
+    return {"topic": topic, "num_questions": num_questions, "selected_files": [pdf.name for pdf in SAMPLE_PDFS]}
+
+def test_questions_are_tagged_with_their_parts_pdfs(client, pdf_topic, monkeypatch):
+    monkeypatch.setattr(config, "PLANNER_SEGMENT_PAGES", 1000) # One segment per PDF
+    monkeypatch.setattr(config, "PLANNER_QUESTIONS_PER_CALL", 2) # Two parts: one per PDF
+    r = client.post('/generate_stream', json=_body(pdf_topic))
+    events = _events(r)
+    assert r.status_code == 200 and events[-1][0] == "done"
+    tags = {tuple(data["question"]["source_pdfs"]) for name, data in events if name == "question"}
+    assert tags == {(SAMPLE_PDFS[0].name,), (SAMPLE_PDFS[1].name,)}
+
+def test_busy_topic_gets_429_and_the_slot_is_freed_after_the_stream(client, pdf_topic):
+    import app
+    release = threading.Event()
+    blocker = app.jobs.submit("generate", pdf_topic, lambda job: (release.wait(5), ({}, 200))[1])
+    r = client.post('/generate_stream', json=_body(pdf_topic, 2))
+    assert r.status_code == 429 and r.headers["Retry-After"]
+    release.set()
+    assert blocker.wait(5)
+
+    r = client.post('/generate_stream', json=_body(pdf_topic, 2))
+    assert r.status_code == 200 and _events(r)[-1][0] == "done"
+    r.close()
+    assert pdf_topic not in app.jobs.stats()["running_by_topic"]
@@ -0,0 +1,88 @@
+# tests/test_generation_planner.py
+import threading
+import pytest
+import config
+import gemini_handler as gh
+import generation_planner as planner
+from conftest import make_question
+
+def _segment(file: str, page: int, size: int) -> dict:
+    return {"file": file, "page_start": page, "page_end": page, "text": "x" * size}
+
+@pytest.fixture(autouse=True)
+def small_calls(monkeypatch):
+    monkeypatch.setattr(config, "PLANNER_QUESTIONS_PER_CALL", 2)
+    monkeypatch.setattr(config, "PLANNER_TOP_UP_ROUNDS", 2)
+    monkeypatch.setattr(config, "NEAR_DUPLICATE_ACTION", "reject")
+
+@pytest.fixture
+def gemini_calls(monkeypatch):
+    """Replaces generate_new_mcqs with replies from a per-test responder(context, history, count) -> questions."""
+    calls = []
+    lock = threading.Lock()
+
+    def use(responder):
+        def generate_new_mcqs(context_text, history_text, count, bypass_cache=False):
+            with lock:
+                calls.append((context_text, history_text, count))
+            return responder(context_text, history_text, count)
+        monkeypatch.setattr(gh, "generate_new_mcqs", generate_new_mcqs)
+        return calls
+    return use
+
+def test_plan_keeps_files_together_and_allocates_by_size():
+    segments = [_segment("a.pdf", 1, 300), _segment("a.pdf", 2, 300), _segment("b.pdf", 1, 200), _segment("b.pdf", 2, 200)]
+    parts = planner.plan_generation(segments, 4)
+    assert [part["files"] for part in parts] == [["a.pdf"], ["b.pdf"]]
+    assert [part["num_questions"] for part in parts] == [2, 2]
+    assert sum(part["num_questions"] for part in planner.plan_generation(segments, 7)) == 7
+
+def test_merge_drops_duplicates_across_parts_and_tags_each_part(gemini_calls):
+    shared = "Which service stores objects in buckets?"
+    def reply(context_text, history_text, count):
+        file = "a.pdf" if "a.pdf" in context_text else "b.pdf"
+        return [make_question(shared), make_question(f"Which {file} topic covers subnet routing tables?")][:count]
+
+    gemini_calls(reply)
+    parts = planner.plan_generation([_segment("a.pdf", 1, 100), _segment("b.pdf", 1, 100)], 4)
+    questions, stats = planner.generate(parts, "", 3)
+    texts = [q["question"] for q in questions]
+    assert texts.count(shared) == 1 and stats["duplicates_dropped"] >= 1
+    for q in questions:
+        if "topic covers" in q["question"]:
+            assert q["source_pdfs"] == [q["question"].split()[1]]
+
+def test_shortfall_is_topped_up_with_the_questions_so_far_in_the_prompt(gemini_calls):
+    topics = iter(["sticky sessions", "object versioning", "autoscaling cooldowns", "security group rules",
+                   "read replicas", "dead letter queues", "edge caching", "container registries"])
+    def one_new_question_per_call(context_text, history_text, count):
+        return [make_question(f"Which cloud feature provides {next(topics)}?")]
+
+    calls = gemini_calls(one_new_question_per_call)
+    parts = planner.plan_generation([_segment("a.pdf", 1, 100)], 4)
+    questions, stats = planner.generate(parts, "HISTORY", 4)
+    assert len(questions) == 4
+    assert stats["top_up_calls"] > 0 and stats["calls"] == len(calls)
+    first_round = calls[:2]
+    assert all("Questions Already Generated" not in history for _, history, _ in first_round)
+    assert all(history.startswith("HISTORY") and "Questions Already Generated" in history for _, history, _ in calls[2:])
+
+def test_top_ups_stop_after_the_configured_rounds(gemini_calls):
+    calls = gemini_calls(lambda context_text, history_text, count: [])
+    parts = planner.plan_generation([_segment("a.pdf", 1, 100)], 2)
+    questions, stats = planner.generate(parts, "", 2)
+    assert questions == [] and stats["empty_calls"] == len(calls) == 1 + config.PLANNER_TOP_UP_ROUNDS
+
+def test_keep_going_false_skips_the_top_ups(gemini_calls):
+    calls = gemini_calls(lambda context_text, history_text, count: [])
+    parts = planner.plan_generation([_segment("a.pdf", 1, 100)], 2)
+    questions, stats = planner.generate(parts, "", 2, keep_going=lambda: False)
+    assert questions == [] and len(calls) == 1 and stats["top_up_calls"] == 0
+
+def test_raises_when_every_first_round_call_fails(gemini_calls):
+    def fail(context_text, history_text, count):
+        raise gh.GeminiError("circuit open")
+    gemini_calls(fail)
+    parts = planner.plan_generation([_segment("a.pdf", 1, 100), _segment("b.pdf", 1, 100)], 4)
+    with pytest.raises(gh.GeminiError):
+        planner.generate(parts, "", 4)
@@ -0,0 +1,69 @@
+# tests/test_get_bank.py
+import pytest
+import config
+import data_manager as dm
+from conftest import SEED_QUESTION, make_question
+
+WORDS = ["bucket", "subnet", "lambda", "replica", "gateway", "volume", "cluster", "queue", "policy", "snapshot", "region"]
+
+@pytest.fixture
+def bank(topic) -> list[str]:
+    """The topic's question texts in bank order: SEED_QUESTION plus one tagged question per word."""
+    dm.add_questions_to_bank(topic, [dict(make_question(f"Which service manages the {word}?"),
+                                          source_pdfs=[f"week{i % 3}.pdf"])
+                                     for i, word in enumerate(WORDS)])
+    return [SEED_QUESTION["question"]] + [f"Which service manages the {word}?" for word in WORDS]
+
+def _pages(client, topic: str, **params) -> list[dict]:
+    pages, cursor = [], None
+    while True:
+        r = client.get('/get_bank', query_string={"topic": topic, **params, **({"cursor": cursor} if cursor else {})})
+        assert r.status_code == 200
+        pages.append(r.json)
+        cursor = r.json["next_cursor"]
+        if cursor is None:
+            return pages
+
+def test_pages_cover_the_bank_once_in_order(client, topic, bank):
+    pages = _pages(client, topic, limit=5)
+    assert [len(page["questions"]) for page in pages] == [5, 5, 2]
+    assert [q["question"] for page in pages for q in page["questions"]] == bank
+    assert [q["id"] for page in pages for q in page["questions"]] == list(range(len(bank)))
+    assert all(page["total"] == len(bank) for page in pages)
+
+def test_last_full_page_has_no_next_cursor(client, topic, bank):
+    pages = _pages(client, topic, limit=len(bank) // 2)
+    assert len(pages) == 2 and pages[-1]["next_cursor"] is None
+
+def test_cursor_stays_valid_while_the_bank_grows(client, topic, bank):
+    first = client.get('/get_bank', query_string={"topic": topic, "limit": 4}).json
+    dm.add_questions_to_bank(topic, [make_question("Which service rotates access keys?")])
+    rest = _pages(client, topic, limit=4, cursor=first["next_cursor"])
+    texts = [q["question"] for q in first["questions"]] + [q["question"] for page in rest for q in page["questions"]]
+    assert texts == bank + ["Which service rotates access keys?"]
+
+def test_seeded_order_is_a_stable_shuffle_across_pages(client, topic, bank):
+    ids = [q["id"] for page in _pages(client, topic, limit=3, seed="quiz1") for q in page["questions"]]
+    assert sorted(ids) == list(range(len(bank))) and ids != sorted(ids)
+    assert ids == [q["id"] for page in _pages(client, topic, limit=5, seed="quiz1") for q in page["questions"]]
+    assert ids != [q["id"] for page in _pages(client, topic, limit=3, seed="quiz2") for q in page["questions"]]
+
+def test_source_filter_pages_only_tagged_questions(client, topic, bank):
+    pages = _pages(client, topic, limit=2, sources="week1.pdf", fields="question,source_pdfs")
+    questions = [q for page in pages for q in page["questions"]]
+    assert len(questions) == pages[0]["total"] == len(WORDS[1::3])
+    assert all(set(q) == {"id", "question", "source_pdfs"} and q["source_pdfs"] == ["week1.pdf"] for q in questions)
+
+def test_limit_is_capped(client, topic, bank, monkeypatch):
+    monkeypatch.setattr(config, "BANK_PAGE_MAX_LIMIT", 4)
+    page = client.get('/get_bank', query_string={"topic": topic, "limit": 1000}).json
+    assert len(page["questions"]) == 4 and page["next_cursor"]
+
+@pytest.mark.parametrize("params", [{"cursor": "not-a-cursor"}, {"cursor": "WzFd", "seed": "quiz"}, {"limit": 0},
+                                    {"limit": "ten"}, {"fields": "question,answer_key"}])
+def test_bad_paging_parameters_are_400(client, topic, bank, params):
+    r = client.get('/get_bank', query_string={"topic": topic, **params})
+    assert r.status_code == 400 and r.json["error"]
+
+def test_without_paging_parameters_the_whole_bank_is_a_list(client, topic, bank):
+    assert [q["question"] for q in client.get('/get_bank', query_string={"topic": topic}).json] == bank
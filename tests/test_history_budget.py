@@ -0,0 +1,36 @@
+# tests/test_history_budget.py
+import random
+import pytest
+import data_manager as dm
+from text_utils import estimate_tokens
+
+STRATEGIES = ("full", "sample_digest", "stems")
+
+def _bank(size: int = 120, seed: int = 7) -> list[dict]:
+    rng = random.Random(seed)
+    words = "cloud container kubernetes pod scheduler network storage volume replica service ingress node".split()
+    return [{"question": f"Which {' '.join(rng.choice(words) for _ in range(rng.randint(3, 25)))} question {i}?",
+             "options": {label: " ".join(rng.choice(words) for _ in range(rng.randint(1, 8))) for label in "ABCD"},
+             "correct_answer": rng.choice("ABCD"),
+             "source_pdfs": [f"lecture{i % 4}.pdf"]}
+            for i in range(size)]
+
+@pytest.mark.parametrize("strategy", STRATEGIES)
+@pytest.mark.parametrize("token_budget", [1, 10, 30, 50, 75, 100, 150, 225, 300, 500, 800, 1200, 1500, 4000])
+def test_history_section_stays_within_budget(strategy, token_budget):
+    text, stats = dm.build_history_section(_bank(), token_budget=token_budget, strategy=strategy)
+    assert estimate_tokens(text) <= token_budget
+    assert stats["estimated_tokens"] <= token_budget
+
+@pytest.mark.parametrize("strategy", STRATEGIES)
+def test_history_section_with_source_filter_stays_within_budget(strategy):
+    for token_budget in range(40, 1500, 37):
+        text, _ = dm.build_history_section(_bank(), relevant_source_pdfs=["lecture1.pdf"],
+                                           token_budget=token_budget, strategy=strategy)
+        assert estimate_tokens(text) <= token_budget
+
+def test_history_section_counts_every_question():
+    bank = _bank()
+    _, stats = dm.build_history_section(bank, token_budget=600, strategy="sample_digest")
+    assert stats["full_examples"] + stats["digest_questions"] + stats["omitted_questions"] == len(bank)
+    assert stats["full_examples"] > 0 and stats["omitted_questions"] > 0
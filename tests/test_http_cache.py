@@ -0,0 +1,60 @@
+# tests/test_http_cache.py
+import gzip
+import json
+import pytest
+import config
+import data_manager as dm
+import http_cache
+from conftest import make_question
+
+@pytest.fixture
+def big_bank(topic) -> str:
+    """Grows the topic's bank well past HTTP_COMPRESS_MIN_BYTES."""
+    dm.add_questions_to_bank(topic, [make_question(f"Which setting number {i} controls autoscaling group {i * 7}?")
+                                     for i in range(40)])
+    return topic
+
+def _get_bank(client, topic: str, **headers):
+    return client.get('/get_bank', query_string={"topic": topic}, headers=headers)
+
+def test_unchanged_bank_is_a_304_without_a_body(client, big_bank):
+    first = _get_bank(client, big_bank)
+    assert first.status_code == 200 and first.headers["ETag"]
+    again = _get_bank(client, big_bank, **{"If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304 and again.get_data() == b""
+    assert again.headers["ETag"] == first.headers["ETag"]
+
+def test_changed_bank_gets_a_new_etag(client, big_bank):
+    etag = _get_bank(client, big_bank).headers["ETag"]
+    dm.add_questions_to_bank(big_bank, [make_question("Which tool applies infrastructure templates?")])
+    r = _get_bank(client, big_bank, **{"If-None-Match": etag})
+    assert r.status_code == 200 and r.headers["ETag"] != etag
+
+def test_304_does_not_load_the_bank(client, big_bank, monkeypatch):
+    etag = _get_bank(client, big_bank).headers["ETag"]
+    def fail(topic_name):
+        raise AssertionError("bank loaded for a 304")
+    monkeypatch.setattr(dm, "load_question_bank", fail)
+    assert _get_bank(client, big_bank, **{"If-None-Match": etag}).status_code == 304
+
+def test_gzip_when_accepted_with_its_own_etag_that_still_revalidates(client, big_bank, monkeypatch):
+    monkeypatch.setattr(http_cache, "BROTLI_AVAILABLE", False)
+    plain = _get_bank(client, big_bank)
+    r = _get_bank(client, big_bank, **{"Accept-Encoding": "gzip"})
+    assert r.headers["Content-Encoding"] == "gzip" and "Accept-Encoding" in r.headers["Vary"]
+    assert json.loads(gzip.decompress(r.get_data())) == plain.json
+    assert r.headers["ETag"] != plain.headers["ETag"] and r.headers["ETag"].endswith('-gzip"')
+    again = _get_bank(client, big_bank, **{"Accept-Encoding": "gzip", "If-None-Match": r.headers["ETag"]})
+    assert again.status_code == 304 and again.headers["ETag"] == r.headers["ETag"]
+
+@pytest.mark.skipif(not http_cache.BROTLI_AVAILABLE, reason="brotli not installed")
+def test_brotli_is_preferred_when_available(client, big_bank):
+    r = _get_bank(client, big_bank, **{"Accept-Encoding": "gzip, br"})
+    assert r.headers["Content-Encoding"] == "br"
+    assert json.loads(http_cache.brotli.decompress(r.get_data()))
+
+def test_no_compression_when_not_accepted_or_small(client, big_bank, monkeypatch):
+    assert "Content-Encoding" not in _get_bank(client, big_bank, **{"Accept-Encoding": "identity"}).headers
+    monkeypatch.setattr(config, "HTTP_COMPRESS_MIN_BYTES", 10**7)
+    r = _get_bank(client, big_bank, **{"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in r.headers and r.json
@@ -0,0 +1,99 @@
+# tests/test_job_queue.py
+import threading
+import time
+import pytest
+import config
+import job_queue
+from conftest import SAMPLE_PDF
+
+def _queue(max_concurrent: int = 2, max_per_topic: int = 1, kind_caps: dict = None) -> job_queue.JobQueue:
+    return job_queue.JobQueue(job_queue.ThreadPoolBackend(4), max_concurrent, max_per_topic, retention_seconds=60,
+                              kind_caps=kind_caps)
+
+def _job_until(release: threading.Event):
+    def fn(job):
+        release.wait(5)
+        return {"status": "success"}, 200
+    return fn
+
+def _poll(client, status_url: str) -> dict:
+    for _ in range(500):
+        job = client.get(status_url).json
+        if job["status"] in ("succeeded", "failed"):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"{status_url} did not finish")
+
+def test_runs_one_job_per_topic_at_a_time():
+    release = threading.Event()
+    jobs = _queue()
+    first = jobs.submit("generate", "cloud", _job_until(release))
+    second = jobs.submit("generate", "cloud", _job_until(release))
+    other_topic = jobs.submit("generate", "security", _job_until(release))
+    assert (first.status, second.status, other_topic.status) == ("running", "queued", "running")
+    release.set()
+    assert all(job.wait(5) for job in (first, second, other_topic))
+    assert [job.status for job in (first, second, other_topic)] == ["succeeded"] * 3
+
+def test_global_cap_holds_jobs_for_idle_topics():
+    release = threading.Event()
+    jobs = _queue(max_concurrent=2, max_per_topic=2)
+    submitted = [jobs.submit("generate", f"topic{i}", _job_until(release)) for i in range(3)]
+    assert [job.status for job in submitted] == ["running", "running", "queued"]
+    assert jobs.stats()["running"] == 2
+    release.set()
+    assert submitted[2].wait(5) and submitted[2].status == "succeeded"
+
+def test_ingest_lane_does_not_take_the_topics_slot():
+    release = threading.Event()
+    jobs = _queue(kind_caps={"ingest": 1})
+    ingest = jobs.submit("ingest", "cloud", _job_until(release))
+    queued_ingest = jobs.submit("ingest", "security", _job_until(release))
+    generate = jobs.claim("generate", "cloud")
+    assert (ingest.status, queued_ingest.status) == ("running", "queued")
+    assert generate is not None and generate.status == "running"
+    assert jobs.claim("ingest", "cloud") is None # The lane's own cap still applies
+    assert jobs.stats()["running_by_kind"] == {"ingest": 1}
+    jobs.finish(generate, 200)
+    release.set()
+    assert ingest.wait(5) and queued_ingest.wait(5)
+    assert jobs.stats()["running"] == 0
+
+def test_failing_job_reports_500_and_frees_its_slot():
+    jobs = _queue()
+    def fail(job):
+        raise RuntimeError("extraction crashed")
+    job = jobs.submit("generate", "cloud", fail)
+    assert job.wait(5)
+    assert (job.status, job.http_status, job.error) == ("failed", 500, "extraction crashed")
+    assert jobs.stats()["running"] == 0
+
+def test_generate_returns_202_then_the_job_holds_the_result(client, pdf_topic):
+    r = client.post('/generate', json={"topic": pdf_topic, "num_questions": 3, "selected_files": [SAMPLE_PDF.name]})
+    assert r.status_code == 202 and r.json["status"] == "queued"
+    job = _poll(client, r.json["status_url"])
+    assert job["status"] == "succeeded" and job["http_status"] == 200
+    assert job["result"]["new_questions_count"] > 0 and job["progress"]["percent"] == 100
+
+def test_wait_still_queues_behind_the_topics_running_job(client, pdf_topic, monkeypatch):
+    import app
+    monkeypatch.setattr(config, "JOB_WAIT_TIMEOUT_SECONDS", 0.2)
+    release = threading.Event()
+    blocker = app.jobs.submit("generate", pdf_topic, _job_until(release))
+    body = {"topic": pdf_topic, "num_questions": 3, "selected_files": [SAMPLE_PDF.name], "wait": True}
+    r = client.post('/generate', json=body)
+    assert r.status_code == 202 # Not run in the request thread past the per-topic cap
+    release.set()
+    assert blocker.wait(5)
+    assert _poll(client, r.json["status_url"])["status"] == "succeeded"
+
+    monkeypatch.setattr(config, "JOB_WAIT_TIMEOUT_SECONDS", 30)
+    r = client.post('/generate', json=body)
+    assert r.status_code == 200 and r.json["status"] == "success"
+
+def test_unknown_job_is_404(client):
+    assert client.get('/jobs/not-a-job').status_code == 404
+
+def test_importing_the_app_does_not_start_the_ingest_watcher(client):
+    import ingest
+    assert ingest._WATCHER is None
@@ -0,0 +1,20 @@
+# tests/test_search.py
+import pytest
+import data_manager as dm
+from conftest import make_question
+
+@pytest.fixture(params=[True, False], ids=["bank-cache", "no-bank-cache"])
+def bank_cache_enabled(request) -> bool:
+    return request.param
+
+def test_finds_questions_added_through_the_app(topic):
+    assert dm.search_question_banks("scheduler", [topic])["total"] == 1
+    dm.add_questions_to_bank(topic, [make_question("Which ingress routes traffic to a service?")])
+    assert dm.search_question_banks("ingress", [topic])["total"] == 1
+
+def test_finds_questions_another_worker_added(topic, other_worker_adds):
+    assert dm.search_question_banks("scheduler", [topic])["total"] == 1 # Index built
+    other_worker_adds([make_question("Which volume type survives pod restarts?")])
+    dm.add_questions_to_bank(topic, [make_question("Which ingress routes traffic to a service?")])
+    results = dm.search_question_banks("restarts", [topic])
+    assert results["total"] == 1 and results["results"][0]["question"].startswith("Which volume")
@@ -0,0 +1,32 @@
+# text_utils.py
+import re
+import config
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-'][a-z0-9]+)*")
+
+# Common English words that carry no topical meaning for matching purposes
+STOPWORDS = frozenset("""
+a about above after again all also an and any are as at be because been before being below between
+both but by can could did do does doing down during each few for from further had has have having
+he her here hers him his how i if in into is it its itself just me more most my no nor not now of
+off on once only or other our ours out over own same she should so some such than that the their
+theirs them then there these they this those through to too under until up very was we were what
+when where which while who whom why will with would you your yours following true false
+""".split())
+
+def tokenize(text: str, drop_stopwords: bool = True) -> list[str]:
+    """Lowercases text and splits it into word tokens, optionally dropping stopwords."""
+    tokens = _TOKEN_RE.findall(text.lower())
+    if drop_stopwords:
+        return [t for t in tokens if t not in STOPWORDS]
+    return tokens
+
+def estimate_tokens(text: str) -> int:
+    """Cheap model-token estimate based on character count (rounded up, so estimates of parts add up safely)."""
+    if not text:
+        return 0
+    return -(-len(text) // config.CHARS_PER_TOKEN)
+
+def normalize_question_text(text: str) -> str:
+    """Normalizes question text for duplicate checks (case and whitespace insensitive)."""
+    return " ".join((text or "").split()).casefold()